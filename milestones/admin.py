@@ -1,5 +1,9 @@
 from django.contrib import admin
-from milestones.models import Milestone
+from milestones.models import Milestone, MilestoneRecurrence
+
+
+class MilestoneRecurrenceInline(admin.StackedInline):
+    model = MilestoneRecurrence
 
 
 class MilestoneAdmin(admin.ModelAdmin):
@@ -8,5 +12,6 @@ class MilestoneAdmin(admin.ModelAdmin):
     search_fields = ('article_revision__title', 'owner__first_name',
                      'owner__last_name', 'title')
     ordering = ['-created']
+    inlines = [MilestoneRecurrenceInline]
 
 admin.site.register(Milestone, MilestoneAdmin)
@@ -0,0 +1,346 @@
+"""
+JSON API for milestones.
+
+    GET  api/milestones/           list, see ``milestone_list``
+    GET  api/milestones/search/    list those whose titles match ``q``
+    POST api/milestones/           create
+    GET  api/milestones/<pk>/      read
+    POST api/milestones/<pk>/      update the given fields
+    POST api/milestones/bulk/      change the status of, or delete, many
+    POST api/milestones/<pk>/occurrences/<date>/
+                                   set the status of one occurrence
+    GET  api/summary/              counts per owner and article
+
+Request bodies may be JSON or form encoded. Writes go through the same
+forms and history recording as the plugin pages, and are CSRF protected
+like them. Responses are built from ``values()`` rows by
+``milestones.serializers`` without touching the template engine.
+"""
+import json
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.forms.models import model_to_dict
+from django.http import HttpResponse
+from django.utils.dateparse import parse_date
+from django.utils.translation import ugettext as _
+from django.views.decorators.http import require_http_methods
+from django.contrib.auth.models import User
+from wiki.models import Article
+
+from milestones import (forms, history, models, pagination, search,
+                        serializers, settings, summary)
+
+
+def json_response(data, status=200):
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder),
+                        content_type='application/json', status=status)
+
+
+def error_response(message, status=400, **extra):
+    extra['error'] = message
+    return json_response(extra, status=status)
+
+
+def api_login_required(view):
+    """ Like login_required, but answers 401 instead of redirecting. """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated():
+            return error_response(u'Authentication required.', status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+class BadRequest(Exception):
+    pass
+
+
+def get_payload(request):
+    if request.META.get('CONTENT_TYPE', '').startswith('application/json'):
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            raise BadRequest(u'Malformed JSON.')
+        if not isinstance(payload, dict):
+            raise BadRequest(u'Expected a JSON object.')
+        return payload
+    payload = request.POST.dict()
+    if 'ids' in request.POST:
+        payload['ids'] = request.POST.getlist('ids')
+    return payload
+
+
+def _get_int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise BadRequest(u'%s must be an integer.' % name)
+
+
+def _get_date(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise BadRequest(u'%s must be a YYYY-MM-DD date.' % name)
+    return date
+
+
+def _can_write(article, user):
+    return article.can_write(user) and not article.current_revision.locked
+
+
+def _get_milestone_data(pk):
+    row = (models.Milestone.objects.filter(pk=pk)
+           .values(*serializers.API_FIELDS)[0])
+    return serializers.api_milestone(row)
+
+
+def filter_milestones(request):
+    """
+    Apply the list filters: ``article`` (id), ``owner`` (username),
+    ``status`` (repeatable), the ``start`` and ``end`` dates of a window,
+    ``deleted=1`` to include deleted milestones and ``q``, words the title
+    must contain, see ``milestones.search``. Only milestones of articles
+    the user may read are listed.
+    """
+    milestones = models.Milestone.objects.readable_by(request.user)
+    article_id = request.GET.get('article')
+    if article_id:
+        milestones = milestones.filter(
+            article_id=_get_int(article_id, 'article'))
+    owner = request.GET.get('owner')
+    if owner:
+        milestones = milestones.filter(owner__username=owner)
+    statuses = request.GET.getlist('status')
+    if statuses:
+        milestones = milestones.filter(
+            status__in=[_get_int(status, 'status') for status in statuses])
+    start_date = _get_date(request, 'start')
+    end_date = _get_date(request, 'end')
+    if start_date or end_date:
+        milestones = milestones.overlapping(start_date, end_date)
+    if request.GET.get('deleted') != '1':
+        milestones = milestones.filter(deleted=False)
+    if 'q' in request.GET:
+        milestones = search.search(milestones, request.GET['q'])
+    return milestones
+
+
+@api_login_required
+@require_http_methods(['GET', 'POST'])
+def milestone_list(request):
+    """
+    GET lists milestones ordered by date and time, ``limit`` (at most
+    MILESTONES_PAGE_SIZE) at a time; pass the ``next`` cursor of a response
+    as ``after`` to get the following page. Recurring milestones are
+    listed once, with their ``repeat`` rule. POST creates a milestone from
+    the fields of the article tab's form.
+    """
+    if request.method == 'POST':
+        try:
+            return create_milestone(request, get_payload(request))
+        except BadRequest as e:
+            return error_response(e.args[0])
+    return list_milestones(request)
+
+
+@api_login_required
+@require_http_methods(['GET'])
+def milestone_search(request):
+    """
+    List the milestones whose titles contain every word of ``q``, the last
+    one as a prefix, as GET on ``milestone_list`` does with the same
+    filters and paging. Searches are answered from a title index.
+    """
+    if not request.GET.get('q', '').strip():
+        return error_response(u'q is required.')
+    return list_milestones(request)
+
+
+def list_milestones(request):
+    try:
+        milestones = filter_milestones(request)
+        limit = request.GET.get('limit')
+        if limit:
+            limit = min(max(_get_int(limit, 'limit'), 1),
+                        settings.PAGE_SIZE)
+    except BadRequest as e:
+        return error_response(e.args[0])
+
+    if request.GET.get('article'):
+        article = Article.objects.filter(pk=request.GET['article']).first()
+        if article is None or not article.can_read(request.user):
+            return error_response(u'Not found.', status=404)
+
+    rows, cursor = pagination.get_page(milestones, request.GET.get('after'),
+                                       size=limit,
+                                       values=serializers.API_FIELDS)
+    return json_response({
+        'results': [serializers.api_milestone(row) for row in rows],
+        'next': cursor,
+    })
+
+
+def create_milestone(request, payload):
+    try:
+        article = Article.objects.get(
+            pk=_get_int(payload.get('article'), 'article'))
+    except Article.DoesNotExist:
+        return error_response(u'Not found.', status=404)
+    if not _can_write(article, request.user):
+        return error_response(u'Permission denied.', status=403)
+
+    data = dict(payload, article=article.pk,
+                article_revision=article.current_revision_id)
+    form = forms.MilestoneForm(data, article=article, request=request)
+    if not form.is_valid():
+        return error_response(u'Invalid milestone.', errors=form.errors)
+    name = request.user.get_full_name()
+    milestone = history.save_form(
+        form, request.user, history.get_ip_address(request),
+        _(u"Milestone created by %s. Title: %s") % (name,
+                                                    form.instance.title))
+    return json_response(_get_milestone_data(milestone.pk), status=201)
+
+
+@api_login_required
+@require_http_methods(['GET', 'POST'])
+def milestone_detail(request, pk):
+    """
+    GET returns one milestone. POST updates it; fields left out of the
+    request keep their values.
+    """
+    milestone = (models.Milestone.objects.select_related('article')
+                 .filter(pk=pk).first())
+    if milestone is None or not milestone.article.can_read(request.user):
+        return error_response(u'Not found.', status=404)
+    if request.method == 'GET':
+        return json_response(_get_milestone_data(milestone.pk))
+
+    if not _can_write(milestone.article, request.user):
+        return error_response(u'Permission denied.', status=403)
+    try:
+        payload = get_payload(request)
+    except BadRequest as e:
+        return error_response(e.args[0])
+
+    data = model_to_dict(milestone,
+                         fields=forms.MilestoneEditForm._meta.fields)
+    data.update(payload)
+    data['article'] = milestone.article_id
+    form = forms.MilestoneEditForm(data, article=milestone.article,
+                                   request=request, instance=milestone)
+    if not form.is_valid():
+        return error_response(u'Invalid milestone.', errors=form.errors)
+    action = u'deleted' if form.instance.deleted else u'updated'
+    history.save_form(
+        form, request.user, history.get_ip_address(request),
+        _(u"Milestone %s by %s. Title: %s PK: %d") % (
+            action, request.user.get_full_name(), milestone.title,
+            milestone.pk))
+    return json_response(_get_milestone_data(milestone.pk))
+
+
+@api_login_required
+@require_http_methods(['POST'])
+def milestone_occurrence(request, pk, date):
+    """
+    Set the ``status`` of the occurrence on ``date`` (YYYY-MM-DD) of a
+    recurring milestone. The rest of the series keeps its status.
+    """
+    milestone = (models.Milestone.objects.select_related('article')
+                 .filter(pk=pk, deleted=False).first())
+    if milestone is None or not milestone.article.can_read(request.user):
+        return error_response(u'Not found.', status=404)
+    try:
+        date = parse_date(date)
+    except ValueError:
+        date = None
+    if date is None or not milestone.has_occurrence(date):
+        return error_response(u'Not found.', status=404)
+    if not _can_write(milestone.article, request.user):
+        return error_response(u'Permission denied.', status=403)
+    try:
+        payload = get_payload(request)
+    except BadRequest as e:
+        return error_response(e.args[0])
+
+    form = forms.MilestoneOccurrenceForm(payload)
+    if not form.is_valid():
+        return error_response(u'Invalid status.', errors=form.errors)
+    history.save_occurrence_status(milestone, date,
+                                   form.cleaned_data['status'], request.user,
+                                   history.get_ip_address(request))
+    return json_response({'id': milestone.pk, 'date': date,
+                          'status': form.cleaned_data['status']})
+
+
+@api_login_required
+@require_http_methods(['POST'])
+def milestone_bulk(request):
+    """
+    Apply ``action`` to the milestones listed in ``ids``, as the batch page
+    does: ``action`` is a status or ``delete_action``, and only the user's
+    own milestones are changed. Returns the number of rows updated.
+    """
+    try:
+        payload = get_payload(request)
+        ids = payload.get('ids') or []
+        if not isinstance(ids, list):
+            raise BadRequest(u'ids must be a list.')
+        ids = [_get_int(pk, 'ids') for pk in ids]
+    except BadRequest as e:
+        return error_response(e.args[0])
+    form = forms.MilestonesBatchForm({'action': payload.get('action')},
+                                     user=request.user)
+    if not form.is_valid():
+        return error_response(u'Invalid action.', errors=form.errors)
+
+    selected = models.Milestone.objects.filter(owner=request.user,
+                                               pk__in=ids)
+    updated = history.batch_update(selected, request.user,
+                                   history.get_ip_address(request),
+                                   form.cleaned_data['action'])
+    return json_response({'updated': updated})
+
+
+@api_login_required
+@require_http_methods(['GET'])
+def milestone_summary(request):
+    """
+    Return the open, overdue and completed this week counts of the owners
+    (by username) and articles (by id) given as repeatable ``owner`` and
+    ``article`` parameters, defaulting to the requesting user.
+
+    Owner counts span every article, readable or not, so only those of the
+    requesting user are given; other owners and unreadable articles are
+    left out.
+    """
+    usernames = request.GET.getlist('owner')
+    try:
+        article_ids = [_get_int(pk, 'article')
+                       for pk in request.GET.getlist('article')]
+    except BadRequest as e:
+        return error_response(e.args[0])
+    if not usernames and not article_ids:
+        usernames = [request.user.username]
+
+    owners = dict(User.objects.filter(pk=request.user.pk,
+                                      username__in=usernames)
+                  .values_list('pk', 'username'))
+    readable = [article.pk for article in
+                Article.objects.filter(pk__in=article_ids)
+                if article.can_read(request.user)]
+    owner_counts = summary.get_counts(summary.OWNER_SCOPE, owners)
+    article_counts = summary.get_counts(summary.ARTICLE_SCOPE, readable)
+    return json_response({
+        'owners': dict((owners[pk], counts)
+                       for pk, counts in owner_counts.items()),
+        'articles': article_counts,
+    })
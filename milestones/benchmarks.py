@@ -0,0 +1,347 @@
+"""
+Benchmarks for the milestones plugin hot paths.
+
+Run them with ``manage.py milestones_benchmark``. A synthetic fixture of
+users, articles and milestones is generated first, then every benchmark
+runs against it inside a savepoint that is rolled back afterwards, and the
+fixture itself is rolled back at the end, so the database is left as it
+was found. Cached fragments and calendar users built from the fixture are
+orphaned too. Point ``--settings`` at a PostgreSQL configuration to benchmark
+there instead of SQLite; the vendor is recorded with the results.
+
+Views are timed through the test client, so they include the middleware,
+the URL resolver and the templates, as a real request would.
+"""
+import calendar
+import datetime
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+from wiki.models import Article, ArticleRevision
+
+from milestones import (cache, colors, digest, history, models, recurrence,
+                        settings)
+from milestones.markdown_extensions import render_many
+
+PASSWORD = 'milestones-benchmark'
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+@contextmanager
+def timer(results, name):
+    start = time.time()
+    yield
+    results[name] = time.time() - start
+
+
+def best_of(results, name, repeat, func):
+    """
+    Time ``func`` ``repeat`` times and keep the fastest run, along with the
+    queries it made. Returns the last result of ``func``.
+    """
+    timings = []
+    for i in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            value = func()
+            timings.append(time.time() - start)
+    results[name] = min(timings)
+    results[name + '_queries'] = len(queries)
+    return value
+
+
+def create_article(title='Benchmark', content=''):
+    article = Article.objects.create()
+    article.add_revision(ArticleRevision(title=title, content=content),
+                         save=True)
+    return article
+
+
+def create_owner(username='milestones-benchmark'):
+    return User.objects.create_user(username)
+
+
+class Fixture(object):
+    """
+    Synthetic data: ``milestones`` spread round robin over ``users`` owners
+    and ``articles`` articles and over four years around ``today``, with
+    every status and one milestone in a hundred repeating weekly. The
+    first user can log in with PASSWORD.
+    """
+    def __init__(self, users=10, articles=10, milestones=10000):
+        self.user_count = users
+        self.article_count = articles
+        self.milestone_count = milestones
+        self.today = datetime.date.today()
+
+    def generate(self):
+        self.users = [User.objects.create_user(
+            'milestones-benchmark-0', password=PASSWORD)]
+        self.users += [create_owner('milestones-benchmark-%d' % i)
+                       for i in range(1, self.user_count)]
+        self.articles = [create_article('Benchmark %d' % i)
+                         for i in range(self.article_count)]
+        statuses = [status for status, name in
+                    models.Milestone.STATUS_CHOICES]
+
+        chunk = settings.BULK_BATCH_SIZE * 10
+        for offset in range(0, self.milestone_count, chunk):
+            milestones = []
+            for i in range(offset, min(offset + chunk,
+                                       self.milestone_count)):
+                article = self.articles[i % self.article_count]
+                milestones.append(models.Milestone(
+                    article=article,
+                    article_revision=article.current_revision,
+                    owner=self.users[i % self.user_count],
+                    title='Milestone %d' % i,
+                    status=statuses[i % len(statuses)],
+                    date=self.today + datetime.timedelta(days=i % 1461 - 730),
+                    time=datetime.time(i % 24) if i % 3 == 0 else None))
+            models.Milestone.objects.bulk_insert(milestones)
+            # bulk_create() skips save(), which computes last_date; weekly
+            # series without an end have none.
+            models.MilestoneRecurrence.objects.bulk_create([
+                models.MilestoneRecurrence(milestone=milestone,
+                                           frequency=recurrence.WEEKLY)
+                for milestone in milestones[::100]])
+        cache.bump_versions()
+        return self
+
+    @property
+    def owner(self):
+        return self.users[0]
+
+    @property
+    def article(self):
+        return self.articles[0]
+
+    def client(self):
+        client = Client()
+        client.login(username=self.owner.username, password=PASSWORD)
+        return client
+
+
+def bench_macro(fixture, repeat=3):
+    """
+    Time rendering a page's worth of [milestones] tags with an empty and
+    with a warm fragment cache.
+    """
+    results = {}
+    today = fixture.today
+    tags = [
+        (None, 7, None, None, None),
+        (None, 30, None, None, None),
+        (fixture.owner.username, 30, None, None, None),
+        (None, None, today, today + datetime.timedelta(days=90), None),
+        (None, 30, None, None, u'milestone 1'),
+    ]
+
+    def cold():
+        cache.bump_versions()
+        return render_many(tags, today)
+    best_of(results, 'macro_cold', repeat, cold)
+    best_of(results, 'macro_warm', repeat, lambda: render_many(tags, today))
+    return results
+
+
+def bench_view(fixture, repeat=3):
+    """ Time GET and POST of the article tab, MilestoneView. """
+    results = {}
+    client = fixture.client()
+    url = reverse('wiki:milestone',
+                  kwargs={'article_id': fixture.article.pk})
+    best_of(results, 'view_get', repeat, lambda: client.get(url))
+
+    data = {
+        'article': fixture.article.pk,
+        'article_revision': fixture.article.current_revision_id,
+        'owner': fixture.owner.pk,
+        'title': 'Posted',
+        'status': models.Milestone.ACTIVE_STATUS,
+        'date': fixture.today.isoformat(),
+    }
+    best_of(results, 'view_post', repeat, lambda: client.post(url, data))
+    return results
+
+
+def bench_range_create(fixture, days=365):
+    """
+    Time creating the ``days`` daily copies of a milestone that expanding
+    a date range makes, both with one save() per copy and with
+    bulk_insert().
+    """
+    results = {}
+    first = models.Milestone(
+        article=fixture.article,
+        article_revision=fixture.article.current_revision,
+        owner=fixture.owner, title='Range', date=fixture.today)
+    # Copies start the day after ``first``, which is not saved.
+    end_date = first.date + datetime.timedelta(days=days)
+
+    with timer(results, 'range_create_%d_per_row' % days):
+        for copy in first.get_range_copies(end_date):
+            copy.save()
+
+    with timer(results, 'range_create_%d_bulk' % days):
+        models.Milestone.objects.bulk_insert(
+            first.get_range_copies(end_date))
+    return results
+
+
+def bench_batch(fixture, repeat=3):
+    """
+    Time the batch page listing and an action applied across every open
+    milestone of the owner.
+    """
+    results = {}
+    client = fixture.client()
+    url = reverse('milestones_batch')
+    best_of(results, 'batch_get', repeat, lambda: client.get(url))
+    with CaptureQueriesContext(connection) as queries:
+        with timer(results, 'batch_update'):
+            client.post(url, {'action': models.Milestone.COMPLETED_STATUS,
+                              'select_across': 'on'})
+    results['batch_update_queries'] = len(queries)
+    return results
+
+
+def bench_calendar(fixture, repeat=3, windows=(7, 31, 92, 365)):
+    """
+    Time calendar.json over windows of increasing length centred on
+    today, consuming the streamed response.
+    """
+    results = {}
+    client = fixture.client()
+    url = reverse('milestones_calendar_json')
+    for days in windows:
+        start = fixture.today - datetime.timedelta(days=days // 2)
+        end = start + datetime.timedelta(days=days)
+        params = {'start': calendar.timegm(start.timetuple()),
+                  'end': calendar.timegm(end.timetuple())}
+
+        def fetch():
+            # A new version each run, so no run is answered with a 304.
+            cache.bump_versions()
+            return b''.join(client.get(url, params).streaming_content)
+        content = best_of(results, 'calendar_%d_days' % days, repeat, fetch)
+        results['calendar_%d_days_bytes' % days] = len(content)
+    return results
+
+
+def bench_digest(fixture):
+    """ Time one digest run over the fixture. """
+    results = {}
+    today = fixture.today
+    with timer(results, 'digest_collect'):
+        digests = digest.collect(today - datetime.timedelta(days=1), today)
+    results['digest_owners'] = len(digests)
+    results['digest_milestones'] = sum(
+        [len(due) + len(overdue) for _, due, overdue in digests])
+    return results
+
+
+def _text_bytes(queryset, *fields):
+    # Approximates storage growth by the size of the text columns written.
+    return sum([sum([len(value or '') for value in row])
+                for row in queryset.values_list(*fields).iterator()])
+
+
+def bench_revision_modes(fixture, saves=200, content_size=20000):
+    """
+    Time ``saves`` milestone creations on an article holding
+    ``content_size`` characters, in each MILESTONES_REVISION_MODE, and
+    report how many rows and text bytes each mode adds.
+    """
+    results = {}
+    original_mode = settings.REVISION_MODE
+    owner = fixture.owner
+    try:
+        for mode in (settings.REVISION_MODE_ARTICLE,
+                     settings.REVISION_MODE_HISTORY):
+            settings.REVISION_MODE = mode
+            with rolled_back():
+                article = create_article(content='x' * content_size)
+                revisions = ArticleRevision.objects.filter(article=article)
+                changes = models.MilestoneChange.objects.filter(
+                    article=article)
+                revision_count = revisions.count()
+
+                with timer(results, 'revision_%s_write_%d' % (mode, saves)):
+                    for i in range(saves):
+                        history.save_milestone(
+                            models.Milestone(article=article, owner=owner,
+                                             title='Milestone %d' % i,
+                                             date=datetime.date.today()),
+                            owner, '127.0.0.1', 'Milestone created')
+
+                results['revision_%s_rows' % mode] = (
+                    revisions.count() - revision_count + changes.count())
+                results['revision_%s_bytes' % mode] = (
+                    _text_bytes(revisions.exclude(revision_number=1),
+                                'title', 'content', 'automatic_log') +
+                    _text_bytes(changes, 'message'))
+    finally:
+        settings.REVISION_MODE = original_mode
+    return results
+
+
+BENCHMARKS = {
+    'batch': bench_batch,
+    'calendar': bench_calendar,
+    'digest': bench_digest,
+    'macro': bench_macro,
+    'range_create': bench_range_create,
+    'revision_modes': bench_revision_modes,
+    'view': bench_view,
+}
+
+
+def run(names, users=10, articles=10, milestones=10000):
+    """
+    Generate a fixture and run the named benchmarks against it. Returns a
+    dict with the run's parameters under ``meta`` and the timings, in
+    seconds, and counts under ``results``.
+    """
+    fixture = Fixture(users, articles, milestones)
+    results = {}
+    try:
+        with rolled_back():
+            with timer(results, 'fixture_generate'):
+                fixture.generate()
+            for name in names:
+                with rolled_back():
+                    results.update(BENCHMARKS[name](fixture))
+    finally:
+        # The cache is not rolled back: pages must not show fixture rows.
+        cache.bump_versions()
+        colors.invalidate_calendar_users()
+    return {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(),
+            'vendor': connection.vendor,
+            'users': users,
+            'articles': articles,
+            'milestones': milestones,
+            'benchmarks': list(names),
+        },
+        'results': results,
+    }
@@ -0,0 +1,136 @@
+"""
+Cache helpers for the milestones plugin.
+
+Milestone writes are tracked as version numbers in three scopes: global,
+per article and per owner. Every write bumps the global version and the
+versions of the article and owner it touches.
+
+Rendered ``[milestones]`` fragments are stored under a key built from the
+tag parameters, the current date and the global version, so a bump orphans
+all cached fragments at once without having to know which keys exist. The
+versions double as validators for conditional GET (see
+``milestones.conditional``).
+"""
+import datetime
+import hashlib
+import time
+
+from django.core.cache import cache
+
+from milestones import settings
+
+GLOBAL = 'global'
+
+
+def _key(*parts):
+    return ':'.join([settings.CACHE_PREFIX] + [str(p) for p in parts])
+
+
+def _new_version():
+    # Versions are derived from the clock so that a version key evicted
+    # from the cache never restarts at a value used by older fragments,
+    # and so that they can be turned into Last-Modified dates.
+    return int(time.time() * 1000)
+
+
+def article_scope(article_id):
+    return 'article:%s' % article_id
+
+
+def owner_scope(owner_id):
+    return 'owner:%s' % owner_id
+
+
+def get_versions(scopes):
+    """ Return a dict mapping each scope to its current version. """
+    keys = dict((_key('version', scope), scope) for scope in scopes)
+    found = cache.get_many(keys.keys())
+    versions = {}
+    missing = {}
+    for key, scope in keys.items():
+        if key in found:
+            versions[scope] = found[key]
+        else:
+            versions[scope] = missing[key] = _new_version()
+    if missing:
+        cache.set_many(missing, settings.CACHE_TIMEOUT)
+    return versions
+
+
+def get_version(scope=GLOBAL):
+    return get_versions([scope])[scope]
+
+
+def bump_versions(article_ids=(), owner_ids=()):
+    """
+    Record a milestone write. The global scope is always bumped, along with
+    the given article and owner scopes.
+    """
+    scopes = ([GLOBAL] + [article_scope(pk) for pk in set(article_ids)] +
+              [owner_scope(pk) for pk in set(owner_ids)])
+    keys = [_key('version', scope) for scope in scopes]
+    current = cache.get_many(keys)
+    version = max([_new_version()] + [v + 1 for v in current.values()])
+    cache.set_many(dict((key, version) for key in keys),
+                   settings.CACHE_TIMEOUT)
+    return version
+
+
+def bump_for_queryset(queryset):
+    """ Bump the scopes of every milestone matched by ``queryset``. """
+    rows = list(queryset.order_by().values_list('article_id', 'owner_id')
+                .distinct())
+    return bump_versions(article_ids=[row[0] for row in rows],
+                         owner_ids=[row[1] for row in rows])
+
+
+def get_validators(scopes, *extra):
+    """
+    Return an ``(etag, last_modified)`` pair for a response that depends on
+    the given scopes. ``extra`` holds anything else the response varies on,
+    e.g. the requested date window.
+    """
+    versions = get_versions(scopes)
+    raw = repr((sorted(versions.items()), extra)).encode('utf-8')
+    last_modified = datetime.datetime.utcfromtimestamp(
+        max(versions.values()) // 1000)
+    return hashlib.md5(raw).hexdigest(), last_modified
+
+
+def fragment_key(params, today, version=None):
+    """
+    Return the cache key for a rendered fragment. ``params`` must be the
+    normalized tag parameters, as returned by ``get_tag_params``.
+    """
+    if version is None:
+        version = get_version()
+    raw = repr((tuple(params), today.isoformat())).encode('utf-8')
+    return _key('fragment', version, hashlib.md5(raw).hexdigest())
+
+
+def get_fragments(params_list, today):
+    """
+    Return a dict mapping each of ``params_list`` that has a cached
+    fragment to its HTML, with one cache round trip.
+    """
+    version = get_version()
+    keys = dict((fragment_key(params, today, version), params)
+                for params in params_list)
+    found = cache.get_many(keys.keys())
+    return dict((keys[key], html) for key, html in found.items())
+
+
+def set_fragments(fragments, today):
+    """ Cache a dict mapping tag parameters to rendered HTML. """
+    version = get_version()
+    cache.set_many(dict((fragment_key(params, today, version), html)
+                        for params, html in fragments.items()),
+                   settings.CACHE_TIMEOUT)
+
+
+def get_fragment(params, today):
+    return get_fragments([params], today).get(tuple(params))
+
+
+def set_fragment(params, today, html):
+    set_fragments({tuple(params): html}, today)
@@ -0,0 +1,47 @@
+"""
+Calendar colors for milestone owners.
+
+A user's color is a function of their primary key, so it never shifts when
+other users join or leave, and the calendar feed can color events without
+looking at the user table.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from milestones import settings
+
+PALETTE = ('#555555', '#cccccc', '#56a83c', '#a73111', '#10845a', '#003366',
+           '#511000', '#0000ff', '#336699', '#918010', '#9999ff', '#99ccff',
+           '#cc0000', '#6699cc', '#123456', '#906090', '#ff6600', '#ff8d8d',
+           '#ff9900', '#82cccd', '#3b5998', '#0066cc', '#00dd00', '#00cbcd',
+           '#9999cc', '#333366', '#006600', '#9c00ff', '#d900dc', '#dc8c00',
+           '#4cc6ff', '#9c4cff', '#bf5b5b', '#bfb95b', '#9dbf5b', '#640005')
+
+USERS_KEY = '%s:calendar-users' % settings.CACHE_PREFIX
+
+
+def get_user_color(user_id):
+    return PALETTE[int(user_id) % len(PALETTE)]
+
+
+def get_calendar_users():
+    """
+    Return the users listed in the calendar filter, with their colors.
+    The list is cached until a user is saved or deleted.
+    """
+    users = cache.get(USERS_KEY)
+    if users is None:
+        users = [
+            {'pk': pk, 'username': username, 'first_name': first_name,
+             'last_name': last_name, 'color': get_user_color(pk)}
+            for pk, username, first_name, last_name in
+            User.objects.filter(is_active=True, is_staff=False)
+            .order_by('first_name')
+            .values_list('pk', 'username', 'first_name', 'last_name')
+        ]
+        cache.set(USERS_KEY, users, settings.CACHE_TIMEOUT)
+    return users
+
+
+def invalidate_calendar_users():
+    cache.delete(USERS_KEY)
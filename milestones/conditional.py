@@ -0,0 +1,47 @@
+"""
+Conditional GET support for milestone responses, driven by the write
+versions kept in ``milestones.cache``.
+"""
+import calendar
+
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import (http_date, parse_etags, parse_http_date_safe,
+                               quote_etag)
+
+
+def not_modified(request, etag, last_modified, private=False):
+    """
+    Return an HttpResponseNotModified if the client's copy is still current,
+    otherwise None. If-None-Match takes precedence over If-Modified-Since.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        if etag not in etags and '*' not in etags:
+            return None
+    else:
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if (if_modified_since is None or
+                calendar.timegm(last_modified.utctimetuple()) >
+                if_modified_since):
+            return None
+
+    return set_validators(HttpResponseNotModified(), etag, last_modified,
+                          private)
+
+
+def set_validators(response, etag, last_modified, private=False):
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(
+        calendar.timegm(last_modified.utctimetuple()))
+    # Clients must revalidate on every use; the validators make that cheap.
+    patch_cache_control(response, max_age=0, must_revalidate=True)
+    if private:
+        patch_cache_control(response, private=True)
+        patch_vary_headers(response, ('Cookie',))
+    return response
@@ -0,0 +1,141 @@
+"""
+Digests of milestones that are due soon or overdue, grouped per owner.
+
+A run reports the open milestones dated within DIGEST_DAYS_AHEAD days, and
+those whose date passed since the previous run or within
+DIGEST_DAYS_BEHIND days, that it has not reported yet. What was reported
+is kept per milestone and date as MilestoneDigestEntry rows, so a
+milestone moved into a window is reported however late it was moved,
+running twice reports only what changed in between, and a run after a
+missed day catches up. The date of the last run is kept as a
+MilestoneDigestMark. All milestones of a run are fetched with a single
+range query on the date.
+"""
+import datetime
+
+from django.core.mail import get_connection, send_mass_mail
+from django.db import transaction
+from django.template.loader import render_to_string
+
+from milestones import models, recurrence, settings, signals
+
+DEFAULT_MARK = 'digest'
+
+DUE = models.MilestoneDigestEntry.DUE_KIND
+OVERDUE = models.MilestoneDigestEntry.OVERDUE_KIND
+
+
+def get_windows(since, today, days_ahead, days_behind=None):
+    """
+    Return the ``(due, overdue)`` date windows of a run on ``today`` after
+    one on ``since``, as inclusive ``(start, end)`` pairs.
+    """
+    if days_behind is None:
+        days_behind = settings.DIGEST_DAYS_BEHIND
+    one_day = datetime.timedelta(days=1)
+    behind = today - datetime.timedelta(days=days_behind)
+    return ((today, today + datetime.timedelta(days=days_ahead)),
+            (min(since, behind), today - one_day))
+
+
+def collect(since, today, days_ahead=None, name=DEFAULT_MARK, using=None):
+    """
+    Return a list of ``(owner, due, overdue)`` for the owners with open
+    milestones due soon or overdue on ``today`` that the schedule ``name``
+    has not reported yet.
+    """
+    if days_ahead is None:
+        days_ahead = settings.DIGEST_DAYS_AHEAD
+    due_window, overdue_window = get_windows(since, today, days_ahead)
+    start, end = overdue_window[0], due_window[1]
+
+    milestones = (models.Milestone.objects.db_manager(using)
+                  .select_related('owner', 'article_revision', 'recurrence')
+                  .filter(status__in=models.Milestone.OPEN_STATUSES,
+                          deleted=False)
+                  .overlapping(start, end)
+                  .order_by('date', 'time'))
+    reported = set(models.MilestoneDigestEntry.objects.using(using)
+                   .filter(name=name, date__range=(start, end))
+                   .values_list('milestone_id', 'date', 'kind'))
+
+    digests = {}
+    for milestone in recurrence.expand(milestones, start, end):
+        if milestone.status not in models.Milestone.OPEN_STATUSES:
+            continue
+        if due_window[0] <= milestone.date <= due_window[1]:
+            kind = DUE
+        elif overdue_window[0] <= milestone.date <= overdue_window[1]:
+            kind = OVERDUE
+        else:
+            continue
+        if (milestone.pk, milestone.date, kind) in reported:
+            continue
+        digest = digests.setdefault(milestone.owner_id, {
+            'owner': milestone.owner, DUE: [], OVERDUE: []})
+        digest[kind].append(milestone)
+    return [(d['owner'], d[DUE], d[OVERDUE])
+            for _, d in sorted(digests.items())]
+
+
+def get_email(owner, due, overdue, today):
+    context = {'owner': owner, 'due': due, 'overdue': overdue,
+               'today': today}
+    subject = render_to_string('milestones/digest_subject.txt',
+                               context).strip()
+    body = render_to_string('milestones/digest_email.txt', context)
+    return subject, body, settings.DIGEST_FROM_EMAIL, [owner.email]
+
+
+def record(name, due, overdue, using=None):
+    """ Record ``due`` and ``overdue`` as reported by the schedule ``name``. """
+    entries = models.MilestoneDigestEntry.objects.db_manager(using)
+    with transaction.atomic(using=using):
+        entries.bulk_create(
+            [models.MilestoneDigestEntry(name=name, milestone_id=m.pk,
+                                         date=m.date, kind=kind)
+             for kind, milestones in ((DUE, due), (OVERDUE, overdue))
+             for m in milestones],
+            batch_size=settings.BULK_BATCH_SIZE)
+
+
+def run(today=None, name=DEFAULT_MARK, days_ahead=None, dry_run=False,
+        using=None):
+    """
+    Report what the schedule ``name`` has not reported yet: for each owner
+    send ``signals.digest_ready`` and an email, over a single mail
+    connection, and record what was sent, so that a run failing half way
+    is resumed without repeating itself. Then move the mark to ``today``.
+    The first run only catches up DIGEST_DAYS_BEHIND days of overdue
+    milestones. Returns the digests.
+    """
+    today = today or datetime.date.today()
+    marks = models.MilestoneDigestMark.objects.db_manager(using)
+    mark = marks.filter(name=name).first()
+    since = mark.date if mark else today
+
+    digests = collect(since, today, days_ahead, name, using)
+    if dry_run:
+        return digests
+
+    connection = get_connection()
+    connection.open()
+    try:
+        for owner, due, overdue in digests:
+            signals.digest_ready.send(sender=name, owner=owner, due=due,
+                                      overdue=overdue, date=today)
+            if owner.email:
+                send_mass_mail([get_email(owner, due, overdue, today)],
+                               connection=connection)
+            record(name, due, overdue, using)
+    finally:
+        connection.close()
+
+    # Later runs look no further back than this.
+    oldest = today - datetime.timedelta(days=settings.DIGEST_DAYS_BEHIND)
+    with transaction.atomic(using=using):
+        (models.MilestoneDigestEntry.objects.using(using)
+         .filter(name=name, date__lt=oldest).delete())
+        if not marks.filter(name=name).update(date=today):
+            marks.create(name=name, date=today)
+    return digests
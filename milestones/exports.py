@@ -0,0 +1,173 @@
+"""
+Export of milestones across articles to CSV or, when xlsxwriter is
+installed, XLSX.
+
+Exports take the filters of the ``[milestones]`` tag (owner, days,
+start_date, end_date) plus statuses and an article. Rows are read in
+keyset-ordered chunks of EXPORT_CHUNK_SIZE ``values()`` rows, joined with
+the owner and the article's current title, and written out as they come,
+so neither the queryset nor the file is ever held in memory whole. Plain
+``iterator()`` would not be enough: the PostgreSQL driver fetches a whole
+result set at once.
+
+The ``title``, ``owner``, ``status``, ``date`` and ``time`` columns are the
+ones ``milestones.imports`` reads. Recurring milestones are exported once,
+with their rule in the ``repeat`` columns.
+"""
+import csv
+import datetime
+import tempfile
+
+from django.utils import six
+
+from milestones import models, pagination, recurrence, settings
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+CSV = 'csv'
+XLSX = 'xlsx'
+
+CONTENT_TYPES = {
+    CSV: 'text/csv; charset=utf-8',
+    XLSX: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+EXPORT_FIELDS = ('id', 'title', 'owner__username', 'status', 'date', 'time',
+                 'article_id', 'article__current_revision__title',
+                 'recurrence__frequency', 'recurrence__interval',
+                 'recurrence__until', 'recurrence__count')
+
+HEADER = ('id', 'title', 'owner', 'status', 'date', 'time', 'article',
+          'article_title', 'repeat', 'repeat_interval', 'repeat_until',
+          'repeat_count')
+
+STATUS_NAMES = dict(models.Milestone.STATUS_CHOICES)
+FREQUENCY_NAMES = dict((frequency, name.lower()) for frequency, name in
+                       recurrence.FREQUENCY_CHOICES)
+
+# Bytes read at a time when streaming a finished XLSX file.
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def get_formats():
+    """ Return the export formats available on this installation. """
+    if xlsxwriter is None:
+        return (CSV,)
+    return (CSV, XLSX)
+
+
+def filter_milestones(queryset, owner=None, days=None, start_date=None,
+                      end_date=None, statuses=None, article_id=None,
+                      today=None):
+    """
+    Restrict ``queryset`` as a ``[milestones]`` tag with the same
+    parameters would, without its default window: ``days`` ends the window
+    that many days after ``today`` and, as in the tag, is ignored when a
+    start or end date is given. Deleted milestones are left out.
+    """
+    queryset = queryset.filter(deleted=False)
+    if days is not None and not start_date and not end_date:
+        end_date = ((today or datetime.date.today()) +
+                    datetime.timedelta(days=days))
+    if start_date or end_date:
+        queryset = queryset.overlapping(start_date, end_date)
+    if owner:
+        queryset = queryset.filter(owner__username=owner)
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    if article_id is not None:
+        queryset = queryset.filter(article_id=article_id)
+    return queryset
+
+
+def iter_rows(queryset, chunk_size=None):
+    """
+    Yield a tuple of HEADER columns for every milestone in ``queryset``,
+    ordered by date and time. Costs one query per ``chunk_size`` rows.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    cursor = None
+    while True:
+        rows, cursor = pagination.get_page(queryset, cursor, size=chunk_size,
+                                           values=EXPORT_FIELDS)
+        for row in rows:
+            yield export_row(row)
+        if cursor is None:
+            break
+
+
+def export_row(row):
+    frequency = row['recurrence__frequency']
+    repeat = (None, None, None, None)
+    if frequency is not None:
+        repeat = (FREQUENCY_NAMES[frequency], row['recurrence__interval'],
+                  row['recurrence__until'], row['recurrence__count'])
+    return (row['id'], row['title'], row['owner__username'],
+            STATUS_NAMES[row['status']], row['date'], row['time'],
+            row['article_id'], row['article__current_revision__title']) + \
+        repeat
+
+
+def _text(value):
+    if value is None:
+        return u''
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return six.text_type(value)
+
+
+class _Echo(object):
+    """ A file that hands back what is written to it, for csv.writer. """
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """ Yield the lines of a CSV file of HEADER and ``rows``. """
+    writer = csv.writer(_Echo())
+    for row in _with_header(rows):
+        values = [_text(value) for value in row]
+        if six.PY2:
+            values = [value.encode('utf-8') for value in values]
+        yield writer.writerow(values)
+
+
+def _with_header(rows):
+    yield HEADER
+    for row in rows:
+        yield row
+
+
+def iter_xlsx(rows):
+    """
+    Yield the chunks of an XLSX file of HEADER and ``rows``. The workbook
+    is written row by row to a temporary file in xlsxwriter's constant
+    memory mode, then streamed from it.
+    """
+    if xlsxwriter is None:
+        raise ValueError('XLSX export needs xlsxwriter.')
+    with tempfile.TemporaryFile() as fileobj:
+        workbook = xlsxwriter.Workbook(fileobj, {'constant_memory': True})
+        sheet = workbook.add_worksheet('Milestones')
+        for index, row in enumerate(_with_header(rows)):
+            sheet.write_row(index, 0, [_text(value) for value in row])
+        workbook.close()
+        fileobj.seek(0)
+        for chunk in iter(lambda: fileobj.read(FILE_CHUNK_SIZE), b''):
+            yield chunk
+
+
+def iter_export(queryset, format=CSV):
+    """ Yield the chunks of an export of ``queryset`` in ``format``. """
+    rows = iter_rows(queryset)
+    if format == XLSX:
+        return iter_xlsx(rows)
+    return iter_csv(rows)
+
+
+def get_filename(format, today=None):
+    return 'milestones-%s.%s' % (
+        (today or datetime.date.today()).isoformat(), format)
@@ -1,16 +1,51 @@
 from django import forms
 from django.contrib.auth.models import User
 
-from milestones import models
+from milestones import exports, models, recurrence
 from custom.fields import UserFullNameChoiceField
 
 
+def clean_schedule(cleaned_data):
+    """
+    Check the end date and repetition of a milestone, as entered in
+    MilestoneForm or imported from a file.
+    """
+    if (
+        cleaned_data.get('end_date')
+        and cleaned_data.get('date')
+        and cleaned_data.get('end_date')
+        <= cleaned_data.get('date')
+    ):
+        raise forms.ValidationError("End date must be greater than "
+                                    "start date.")
+
+    if cleaned_data.get('repeat') is not None:
+        if cleaned_data.get('end_date'):
+            raise forms.ValidationError("Use either an end date or a "
+                                        "repetition, not both.")
+        if (
+            cleaned_data.get('repeat_until')
+            and cleaned_data.get('date')
+            and cleaned_data.get('repeat_until')
+            <= cleaned_data.get('date')
+        ):
+            raise forms.ValidationError("Repeat until must be greater "
+                                        "than start date.")
+
+
 class MilestoneForm(forms.ModelForm):
     owner = UserFullNameChoiceField(
         queryset=User.objects.filter(is_active=True).order_by('first_name',
                                                               'last_name')
     )
     end_date = forms.DateField(required=False)
+    repeat = forms.TypedChoiceField(
+        choices=(('', '---------'),) + recurrence.FREQUENCY_CHOICES,
+        coerce=int, empty_value=None, required=False)
+    repeat_interval = forms.IntegerField(min_value=1, initial=1,
+                                         required=False)
+    repeat_until = forms.DateField(required=False)
+    repeat_count = forms.IntegerField(min_value=1, required=False)
 
     def __init__(self, *args, **kwargs):
         self.article = kwargs.pop('article', None)
@@ -29,22 +64,28 @@ class MilestoneForm(forms.ModelForm):
 
     def clean(self):
         cleaned_data = super(MilestoneForm, self).clean()
-
-        if (
-            self.cleaned_data.get('end_date')
-            and self.cleaned_data.get('end_date')
-            <= self.cleaned_data.get('date')
-        ):
-            raise forms.ValidationError("End date must be greater than "
-                                        "start date.")
-
+        clean_schedule(cleaned_data)
         return cleaned_data
 
+    def save_recurrence(self, milestone):
+        """ Attach the repetition rule, if any, to a saved milestone. """
+        if self.cleaned_data.get('repeat') is None:
+            return None
+        return models.MilestoneRecurrence.objects.create(
+            milestone=milestone,
+            frequency=self.cleaned_data['repeat'],
+            interval=self.cleaned_data.get('repeat_interval') or 1,
+            until=self.cleaned_data.get('repeat_until'),
+            count=self.cleaned_data.get('repeat_count'),
+        )
+
 
 class MilestoneEditForm(MilestoneForm):
     def __init__(self, *args, **kwargs):
         super(MilestoneEditForm, self).__init__(*args, **kwargs)
-        del self.fields['end_date']
+        for name in ('end_date', 'repeat', 'repeat_interval', 'repeat_until',
+                     'repeat_count'):
+            del self.fields[name]
 
     class Meta:
         model = models.Milestone
@@ -56,6 +97,12 @@ class MilestoneEditForm(MilestoneForm):
                   'date', 'time', 'deleted')
 
 
+class MilestoneOccurrenceForm(forms.Form):
+    """ Status of one occurrence of a recurring milestone. """
+    status = forms.TypedChoiceField(choices=models.Milestone.STATUS_CHOICES,
+                                    coerce=int)
+
+
 class MilestonesBatchForm(forms.Form):
     ACTION_CHOICES = (
         (models.Milestone.PENDING_STATUS, 'Set to Pending'),
@@ -70,3 +117,107 @@ class MilestonesBatchForm(forms.Form):
         super(MilestonesBatchForm, self).__init__(*args, **kwargs)
 
     action = forms.ChoiceField(choices=ACTION_CHOICES)
+    # Apply the action to every milestone matching the listing filters
+    # rather than to the selected ones.
+    select_across = forms.BooleanField(required=False)
+
+
+class MilestonesBatchFilterForm(forms.Form):
+    """ Filters of the batch page listing, read from the query string. """
+    status = forms.TypedChoiceField(
+        choices=(('', 'Open'),) + models.Milestone.STATUS_CHOICES,
+        coerce=int, empty_value=None, required=False)
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+
+    def filter(self, queryset):
+        """ Apply the filters to ``queryset``; call after is_valid(). """
+        status = self.cleaned_data.get('status')
+        if status is None:
+            queryset = queryset.filter(
+                status__in=models.Milestone.OPEN_STATUSES)
+        else:
+            queryset = queryset.filter(status=status)
+        start = self.cleaned_data.get('start')
+        end = self.cleaned_data.get('end')
+        if start or end:
+            queryset = queryset.overlapping(start, end)
+        return queryset
+
+
+class MilestonesExportForm(forms.Form):
+    """
+    Filters of a milestone export, named as the [milestones] tag names
+    them; read from the query string or the command line options.
+    """
+    owner = forms.CharField(required=False)
+    days = forms.IntegerField(required=False, min_value=0)
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+    status = forms.TypedMultipleChoiceField(
+        choices=models.Milestone.STATUS_CHOICES, coerce=int, required=False)
+    article = forms.IntegerField(required=False)
+    format = forms.ChoiceField(required=False)
+
+    def __init__(self, *args, **kwargs):
+        super(MilestonesExportForm, self).__init__(*args, **kwargs)
+        self.fields['format'].choices = [
+            (name, name.upper()) for name in exports.get_formats()]
+
+    def clean_format(self):
+        return self.cleaned_data['format'] or exports.CSV
+
+    def filter(self, queryset, today=None):
+        """ Apply the filters to ``queryset``; call after is_valid(). """
+        data = self.cleaned_data
+        return exports.filter_milestones(
+            queryset, owner=data['owner'], days=data['days'],
+            start_date=data['start_date'], end_date=data['end_date'],
+            statuses=data['status'], article_id=data['article'], today=today)
+
+
+class MilestoneImportForm(forms.Form):
+    """ Upload of a CSV file of milestones, see milestones.imports. """
+    file = forms.FileField(label='CSV file')
+
+
+class MilestoneImportRowForm(forms.Form):
+    """
+    One row of a milestone import. Owners are given by username and
+    resolved from the ``owners`` dict, which the importer fills for a
+    whole chunk of rows at once; statuses by number or name.
+    """
+    title = forms.CharField(max_length=200)
+    owner = forms.CharField()
+    status = forms.CharField(required=False)
+    date = forms.DateField()
+    time = forms.TimeField(required=False)
+    end_date = forms.DateField(required=False)
+
+    STATUS_NAMES = dict((name.lower(), status) for status, name in
+                        models.Milestone.STATUS_CHOICES)
+
+    def __init__(self, *args, **kwargs):
+        self.owners = kwargs.pop('owners')
+        super(MilestoneImportRowForm, self).__init__(*args, **kwargs)
+
+    def clean_owner(self):
+        username = self.cleaned_data['owner'].strip()
+        if username not in self.owners:
+            raise forms.ValidationError("Unknown user %s." % username)
+        return self.owners[username]
+
+    def clean_status(self):
+        value = self.cleaned_data['status'].strip().lower()
+        if not value:
+            return models.Milestone.ACTIVE_STATUS
+        if value in self.STATUS_NAMES:
+            return self.STATUS_NAMES[value]
+        if value.isdigit() and int(value) in self.STATUS_NAMES.values():
+            return int(value)
+        raise forms.ValidationError("Unknown status %s." % value)
+
+    def clean(self):
+        cleaned_data = super(MilestoneImportRowForm, self).clean()
+        clean_schedule(cleaned_data)
+        return cleaned_data
@@ -0,0 +1,285 @@
+"""
+Recording of milestone writes.
+
+Every write is recorded as a MilestoneChange row holding the old and new
+value of each changed field. By default the write also adds an article
+revision, as any other django-wiki plugin does; with
+``MILESTONES_REVISION_MODE = 'history'`` the MilestoneChange row is the only
+record and the article's content is not copied.
+"""
+import datetime
+
+from django.db import transaction
+from django.utils.translation import ugettext as _
+from wiki.models.article import ArticleRevision
+
+from milestones import cache, models, settings
+
+
+def get_ip_address(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+def _user_or_none(user):
+    return user if user is not None and user.is_authenticated() else None
+
+
+def _tracked_values(milestone):
+    return dict((field, getattr(milestone, field))
+                for field in models.MilestoneChange.TRACKED_FIELDS)
+
+
+def _action(old_values, new_values):
+    if old_values is None:
+        return models.MilestoneChange.CREATED_ACTION
+    if new_values.get('deleted') and not old_values.get('deleted'):
+        return models.MilestoneChange.DELETED_ACTION
+    return models.MilestoneChange.UPDATED_ACTION
+
+
+def save_milestone(milestone, user, ip_address, message):
+    """
+    Save ``milestone`` and record the change described by ``message``.
+    Call inside transaction.atomic().
+    """
+    article = milestone.article
+    if settings.REVISION_MODE == settings.REVISION_MODE_ARTICLE:
+        new_revision = ArticleRevision()
+        new_revision.inherit_predecessor(article)
+        new_revision.automatic_log = message
+        new_revision.user = user
+        new_revision.ip_address = ip_address
+        article.add_revision(new_revision)
+        milestone.article_revision = article.current_revision
+    elif milestone.article_revision_id is None:
+        milestone.article_revision = article.current_revision
+
+    milestone.save()
+
+    # Set by the pre_save handler in milestones.models.
+    old_values = milestone._previous_values
+    new_values = _tracked_values(milestone)
+    change = models.MilestoneChange(
+        milestone=milestone,
+        article_id=milestone.article_id,
+        user=_user_or_none(user),
+        ip_address=ip_address,
+        action=_action(old_values, new_values),
+        message=message,
+    )
+    change.set_changes(old_values, new_values)
+    change.save()
+    return milestone
+
+
+def record_created(milestones, user, ip_address, message):
+    """
+    Record milestones created without save(), e.g. by bulk_insert(), with
+    a single INSERT.
+    """
+    changes = []
+    for milestone in milestones:
+        change = models.MilestoneChange(
+            milestone_id=milestone.pk,
+            article_id=milestone.article_id,
+            user=_user_or_none(user),
+            ip_address=ip_address,
+            action=models.MilestoneChange.CREATED_ACTION,
+            message=message,
+        )
+        change.set_changes(None, _tracked_values(milestone))
+        changes.append(change)
+    models.MilestoneChange.objects.bulk_create(
+        changes, batch_size=settings.BULK_BATCH_SIZE)
+
+
+def _lock(queryset, pks):
+    """
+    Lock the milestones with primary keys ``pks``. They are locked by
+    primary key alone: the filters of ``queryset`` may outer join the
+    recurrence rules, and PostgreSQL refuses FOR UPDATE on the nullable
+    side of an outer join.
+    """
+    list(models.Milestone.objects.using(queryset.db).filter(pk__in=pks)
+         .order_by().select_for_update().values_list('pk', flat=True))
+
+
+def update_milestones(queryset, user, ip_address, message, **values):
+    """
+    Run ``queryset.update(**values)`` and record one MilestoneChange for
+    every milestone it actually changed, with a single INSERT. Returns the
+    number of rows updated. Runs in its own transaction, after which the
+    cache versions of the milestones are bumped; called inside another
+    transaction, the caller must bump them again once it commits.
+    """
+    fields = list(values)
+    columns = ['pk', 'article_id', 'owner_id', 'date', 'status', 'deleted']
+    with transaction.atomic(using=queryset.db):
+        # Lock the candidate rows so concurrent writes cannot change them
+        # between the read and the update, then read and update them
+        # through ``queryset`` again: rows changed out of its filters,
+        # e.g. reassigned to another owner, before they were locked are
+        # left alone.
+        pks = list(queryset.order_by().values_list('pk', flat=True))
+        rows = []
+        recurring = set()
+        updated = 0
+        for start in range(0, len(pks), settings.BULK_BATCH_SIZE):
+            chunk = pks[start:start + settings.BULK_BATCH_SIZE]
+            _lock(queryset, chunk)
+            matching = queryset.filter(pk__in=chunk)
+            rows.extend(matching.order_by().values(
+                *(columns + [field for field in fields
+                             if field not in columns])))
+            updated += matching.update(**values)
+            recurring.update(models.MilestoneRecurrence.objects
+                             .using(queryset.db).filter(milestone__in=chunk)
+                             .values_list('milestone_id', flat=True))
+
+        changes = []
+        deltas = {}
+        for row in rows:
+            old_values = dict((field, row[field]) for field in fields)
+            if old_values == values:
+                continue
+            change = models.MilestoneChange(
+                milestone_id=row['pk'],
+                article_id=row['article_id'],
+                user=_user_or_none(user),
+                ip_address=ip_address,
+                action=_action(old_values, values),
+                message=message,
+            )
+            change.set_changes(old_values, values)
+            changes.append(change)
+            if row['pk'] in recurring:
+                # Left out of the counters, see MilestoneSummary.
+                continue
+            new_row = dict(row, **values)
+            for sign, counted in ((-1, row), (1, new_row)):
+                models.count_milestone(deltas, counted['article_id'],
+                                       counted['owner_id'], counted['date'],
+                                       counted['status'], counted['deleted'],
+                                       sign)
+        models.MilestoneChange.objects.bulk_create(
+            changes, batch_size=settings.BULK_BATCH_SIZE)
+
+        # Queryset updates bypass the post_save handlers.
+        models.MilestoneSummary.objects.db_manager(queryset.db).add(deltas)
+
+    # Bumped once the rows are committed: a render between a bump and the
+    # commit would cache the old rows under the new version.
+    cache.bump_versions(article_ids=[row['article_id'] for row in rows],
+                        owner_ids=[row['owner_id'] for row in rows])
+    return updated
+
+
+def save_form(form, user, ip_address, message):
+    """
+    Save a valid MilestoneForm or MilestoneEditForm in one transaction,
+    with its repetition rule and the daily copies of a date range, and
+    record it. Returns the milestone.
+    """
+    milestone = form.save(commit=False)
+    copies = []
+    if form.cleaned_data.get('end_date'):
+        copies = milestone.get_range_copies(form.cleaned_data['end_date'])
+    # Notify once for the whole range rather than once per copy.
+    milestone.range_count = len(copies) + 1
+
+    with transaction.atomic():
+        save_milestone(milestone, user, ip_address, message)
+        form.save_m2m()
+        form.save_recurrence(milestone)
+
+        for copy in copies:
+            copy.article_revision = milestone.article_revision
+        models.Milestone.objects.bulk_insert(copies)
+        record_created(copies, user, ip_address, message)
+
+    # The post_save handlers bumped the versions before the commit, so a
+    # render in between may have cached the old rows under them. The
+    # copies bypassed post_save altogether.
+    owner_ids = [milestone.owner_id]
+    if milestone._previous_values:
+        owner_ids.append(milestone._previous_values['owner_id'])
+    cache.bump_versions(article_ids=[milestone.article_id],
+                        owner_ids=owner_ids)
+    return milestone
+
+
+def save_occurrence_status(milestone, date, status, user, ip_address):
+    """
+    Set the status of one occurrence of a recurring milestone, leaving the
+    rest of the series as it is, and record it.
+    """
+    milestone.set_occurrence_status(date, status, _user_or_none(user),
+                                    ip_address)
+
+
+def latest_change(using=None):
+    """
+    Return the id of the latest MilestoneChange, 0 if there is none.
+    Change ids only grow, so they version the milestones for delta feeds.
+    """
+    latest = (models.MilestoneChange.objects.using(using).order_by('-pk')
+              .values_list('pk', flat=True)[:1])
+    return latest[0] if latest else 0
+
+
+def changed_since(version, article_id=None, limit=None, using=None):
+    """
+    Return the set of ids of the milestones changed after ``version``, a
+    latest_change() value, or None if there are more than ``limit`` or
+    ``version`` is unknown.
+
+    A write committed after a later one has an id below the version a
+    client may already hold, so the changes recorded up to
+    MILESTONES_CALENDAR_DELTA_MARGIN seconds before ``version`` are
+    included again.
+    """
+    changes = models.MilestoneChange.objects.using(using)
+    stamp = changes.filter(pk=version).values_list('created',
+                                                   flat=True).first()
+    if stamp is None:
+        return None
+    # Read back from ``version`` along the primary key, through the
+    # margin only.
+    margin = datetime.timedelta(seconds=settings.CALENDAR_DELTA_MARGIN)
+    floor = (changes.filter(pk__lte=version, created__lt=stamp - margin)
+             .order_by('-pk').values_list('pk', flat=True).first())
+    changes = changes.filter(pk__gt=floor or 0)
+    if article_id is not None:
+        changes = changes.filter(article_id=article_id)
+    ids = changes.order_by().values_list('milestone_id', flat=True).distinct()
+    if limit is not None:
+        ids = ids[:limit + 1]
+    ids = set(ids)
+    if limit is not None and len(ids) > limit:
+        return None
+    return ids
+
+
+DELETE_ACTION = 'delete_action'
+
+
+def batch_update(queryset, user, ip_address, action):
+    """
+    Apply a batch action, either DELETE_ACTION or a status to set, to the
+    milestones in ``queryset``. Returns the number of rows updated. Runs
+    in its own transaction, see update_milestones().
+    """
+    name = user.get_full_name()
+    if action == DELETE_ACTION:
+        return update_milestones(queryset, user, ip_address,
+                                 _(u"Milestone deleted by %s.") % name,
+                                 deleted=True)
+    status = int(action)
+    return update_milestones(
+        queryset, user, ip_address,
+        _(u"Milestone status set to %s by %s.") % (
+            dict(models.Milestone.STATUS_CHOICES)[status], name),
+        status=status)
@@ -0,0 +1,196 @@
+"""
+iCalendar (RFC 5545) feeds of milestones.
+
+Feeds are addressed by signed tokens, since calendar clients cannot log
+in: a token names the feed (an owner's milestones or an article's) and the
+user it was issued to, whose permissions are checked on every request.
+
+Recurring milestones are written once with an RRULE, plus one component
+per occurrence whose status was changed, so a feed stays small however
+long the series. Milestones with a time become timed components in
+floating local time, the others all-day ones. By default every milestone
+is a VEVENT; with ``todo`` the non-informational ones become VTODOs,
+whose STATUS can express pending and completed work.
+
+Every component carries the time of the latest recorded change of its
+milestone as DTSTAMP and LAST-MODIFIED, and the number of changes since
+its creation as SEQUENCE, so clients replace the copies they hold.
+"""
+import datetime
+
+from django.core import signing
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from milestones import models, recurrence
+
+OWNER_FEED = 'owner'
+ARTICLE_FEED = 'article'
+
+_signer = signing.Signer(salt='milestones.ical')
+
+# Milestone.status to the STATUS of a VEVENT and of a VTODO.
+EVENT_STATUS = {
+    models.Milestone.PENDING_STATUS: 'TENTATIVE',
+    models.Milestone.ACTIVE_STATUS: 'CONFIRMED',
+    models.Milestone.COMPLETED_STATUS: 'CONFIRMED',
+    models.Milestone.CANCELLED_STATUS: 'CANCELLED',
+    models.Milestone.INFORMATIONAL_STATUS: 'CONFIRMED',
+}
+TODO_STATUS = {
+    models.Milestone.PENDING_STATUS: 'NEEDS-ACTION',
+    models.Milestone.ACTIVE_STATUS: 'IN-PROCESS',
+    models.Milestone.COMPLETED_STATUS: 'COMPLETED',
+    models.Milestone.CANCELLED_STATUS: 'CANCELLED',
+}
+
+FREQUENCIES = {
+    recurrence.DAILY: 'DAILY',
+    recurrence.WEEKLY: 'WEEKLY',
+    recurrence.MONTHLY: 'MONTHLY',
+}
+
+FEED_FIELDS = ('id', 'title', 'status', 'date', 'time', 'created',
+               'article_id', 'owner__username', 'recurrence__frequency',
+               'recurrence__interval', 'recurrence__until',
+               'recurrence__count')
+
+
+def make_token(kind, pk, user):
+    return _signer.sign('%s.%d.%d' % (kind, int(pk), user.pk))
+
+
+def read_token(token):
+    """
+    Return the ``(kind, pk, user_id)`` named by ``token``, or None if it
+    was not issued by this site.
+    """
+    try:
+        kind, pk, user_id = _signer.unsign(token).split('.')
+        return kind, int(pk), int(user_id)
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def escape(text):
+    return (text.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold(line):
+    """ Fold a content line to 75 octets, as RFC 5545 requires. """
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    while encoded:
+        size = 75 if not parts else 74
+        # Do not split a multi-byte character.
+        while size < len(encoded) and (ord(encoded[size:size + 1]) &
+                                       0xC0) == 0x80:
+            size -= 1
+        parts.append(encoded[:size])
+        encoded = encoded[size:]
+    return (b'\r\n '.join(parts) + b'\r\n').decode('utf-8')
+
+
+def format_start(date, time):
+    if time is None:
+        return ';VALUE=DATE:' + date.strftime('%Y%m%d')
+    return ':' + datetime.datetime.combine(date, time).strftime(
+        '%Y%m%dT%H%M%S')
+
+
+def format_stamp(value):
+    if timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.utc)
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def format_rrule(row):
+    rule = ['FREQ=%s' % FREQUENCIES[row['recurrence__frequency']]]
+    if row['recurrence__interval'] != 1:
+        rule.append('INTERVAL=%d' % row['recurrence__interval'])
+    if row['recurrence__count']:
+        rule.append('COUNT=%d' % row['recurrence__count'])
+    if row['recurrence__until']:
+        until = row['recurrence__until'].strftime('%Y%m%d')
+        rule.append('UNTIL=' + (until if row['time'] is None
+                                else until + 'T235959'))
+    if (row['recurrence__frequency'] == recurrence.MONTHLY and
+            row['date'].day > 28):
+        # Occurrences falling on a day a month lacks move to its last day;
+        # the first of the two candidate days is the one that exists.
+        rule.append('BYMONTHDAY=%d,-1;BYSETPOS=1' % row['date'].day)
+    return ';'.join(rule)
+
+
+def iter_component(row, domain, todo, date=None, status=None,
+                   modified=None, sequence=0):
+    """
+    Yield the lines of one milestone, or of one of its occurrences.
+    ``modified`` is the time of its latest change, defaulting to its
+    creation, and ``sequence`` the number of changes since.
+    """
+    status = row['status'] if status is None else status
+    is_todo = todo and status in TODO_STATUS
+    name = 'VTODO' if is_todo else 'VEVENT'
+    stamp = format_stamp(modified or row['created'])
+    yield 'BEGIN:%s' % name
+    yield 'UID:milestone-%d@%s' % (row['id'], domain)
+    yield 'DTSTAMP:%s' % stamp
+    yield 'LAST-MODIFIED:%s' % stamp
+    yield 'SEQUENCE:%d' % sequence
+    yield 'DTSTART%s' % format_start(row['date'], row['time'])
+    if date is not None:
+        yield 'RECURRENCE-ID%s' % format_start(date, row['time'])
+    elif row['recurrence__frequency'] is not None:
+        yield 'RRULE:%s' % format_rrule(row)
+    if is_todo:
+        yield 'DUE%s' % format_start(date or row['date'], row['time'])
+        yield 'STATUS:%s' % TODO_STATUS[status]
+    else:
+        yield 'STATUS:%s' % EVENT_STATUS[status]
+        if status == models.Milestone.INFORMATIONAL_STATUS:
+            yield 'TRANSP:TRANSPARENT'
+    yield 'SUMMARY:%s' % escape(row['title'])
+    yield 'CATEGORIES:%s' % escape(row['owner__username'])
+    yield 'END:%s' % name
+
+
+def iter_calendar(queryset, name, domain, todo=False):
+    """
+    Yield an iCalendar document for the milestones in ``queryset`` in
+    chunks of content lines. Costs three queries, whose rows are streamed.
+    """
+    changes = dict(
+        (row['milestone_id'], (row['modified'], row['sequence'])) for row in
+        models.MilestoneChange.objects
+        .filter(milestone__in=queryset.values('pk'))
+        .exclude(action=models.MilestoneChange.CREATED_ACTION)
+        .values('milestone_id')
+        .annotate(modified=Max('created'), sequence=Count('pk'))
+        .order_by().iterator())
+
+    overrides = {}
+    for milestone_id, date, status in (
+            models.MilestoneOccurrence.objects
+            .filter(milestone__in=queryset.filter(recurrence__isnull=False)
+                    .values('pk'))
+            .values_list('milestone_id', 'date', 'status').iterator()):
+        overrides.setdefault(milestone_id, []).append((date, status))
+
+    yield fold('BEGIN:VCALENDAR') + fold('VERSION:2.0') + fold(
+        'PRODID:-//django-wiki//milestones//EN') + fold(
+        'X-WR-CALNAME:%s' % escape(name))
+    for row in queryset.order_by('date', 'time').values(*FEED_FIELDS).iterator():
+        modified, sequence = changes.get(row['id'], (None, 0))
+        lines = list(iter_component(row, domain, todo, modified=modified,
+                                    sequence=sequence))
+        for date, status in overrides.get(row['id'], ()):
+            occurrence = dict(row, date=date)
+            lines.extend(iter_component(occurrence, domain, todo, date=date,
+                                        status=status, modified=modified,
+                                        sequence=sequence))
+        yield ''.join([fold(line) for line in lines])
+    yield fold('END:VCALENDAR')
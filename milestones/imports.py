@@ -0,0 +1,176 @@
+"""
+Import of milestones from CSV files.
+
+The file needs a header row naming its columns: ``title``, ``owner`` (a
+username) and ``date`` are required, ``status`` (a number or name),
+``time`` and ``end_date`` optional. Rows are read and validated in chunks
+of BULK_BATCH_SIZE, with the owners of a chunk resolved in one query, and
+every valid chunk is inserted with bulk_insert() before the next one is
+read, so memory use does not grow with the file.
+
+An import adds a single article revision (in the default revision mode)
+that all imported milestones point to.
+"""
+import codecs
+import csv
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import six
+from django.utils.translation import ugettext as _
+from wiki.models.article import ArticleRevision
+
+from milestones import cache, forms, history, models, settings
+
+COLUMNS = ('title', 'owner', 'status', 'date', 'time', 'end_date')
+REQUIRED_COLUMNS = ('title', 'owner', 'date')
+
+# Row errors kept for the report; the rest are only counted.
+MAX_ERRORS = 100
+
+
+class ImportFileError(Exception):
+    """ The file cannot be imported at all, e.g. it lacks a column. """
+    pass
+
+
+class _Rollback(Exception):
+    pass
+
+
+class ImportResult(object):
+    def __init__(self):
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def read_rows(fileobj):
+    """
+    Yield ``(line number, {column: value})`` for every row of a CSV file
+    opened in binary mode.
+    """
+    lines = fileobj
+    if six.PY3:
+        lines = codecs.iterdecode(fileobj, 'utf-8-sig')
+    reader = csv.reader(lines)
+    try:
+        header = [_decode(name).lstrip(u'\ufeff').strip().lower()
+                  for name in next(reader)]
+    except StopIteration:
+        raise ImportFileError(_(u"The file is empty."))
+    missing = [name for name in REQUIRED_COLUMNS if name not in header]
+    if missing:
+        raise ImportFileError(_(u"Missing columns: %s.") %
+                              u', '.join(missing))
+
+    for row in reader:
+        if not any(row):
+            continue
+        yield reader.line_num, dict(
+            (name, _decode(value).strip()) for name, value in zip(header, row)
+            if name in COLUMNS)
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validate_chunk(chunk, owners, result):
+    """
+    Validate a list of rows, resolving their owners into ``owners`` with
+    one query, and return the cleaned data of the valid ones.
+    """
+    unknown = set(row.get('owner', '') for line, row in chunk) - set(owners)
+    owners.update(User.objects.filter(username__in=unknown, is_active=True)
+                  .values_list('username', 'pk'))
+    valid = []
+    for line, row in chunk:
+        form = forms.MilestoneImportRowForm(row, owners=owners)
+        if form.is_valid():
+            valid.append(form.cleaned_data)
+            continue
+        for field, messages in form.errors.items():
+            name = u'' if field == '__all__' else u'%s: ' % field
+            result.add_error(line, name + u' '.join(messages))
+    return valid
+
+
+def build_milestones(article, revision, rows):
+    milestones = []
+    for data in rows:
+        milestone = models.Milestone(
+            article=article, article_revision=revision,
+            owner_id=data['owner'], title=data['title'],
+            status=data['status'], date=data['date'], time=data['time'])
+        milestones.append(milestone)
+        if data['end_date']:
+            milestones.extend(milestone.get_range_copies(data['end_date']))
+    return milestones
+
+
+def import_milestones(fileobj, article, user, ip_address, strict=True):
+    """
+    Import the milestones of a CSV file into ``article`` and return an
+    ImportResult. With ``strict``, nothing is imported if any row is
+    invalid; otherwise invalid rows are skipped. ``user`` may be None for
+    imports made outside a request.
+    """
+    result = ImportResult()
+    owners = {}
+    if user is None:
+        message = _(u"Milestones imported.")
+    else:
+        message = _(u"Milestones imported by %s.") % (
+            user.get_full_name() or user.username)
+    try:
+        with transaction.atomic():
+            revision = article.current_revision
+            if settings.REVISION_MODE == settings.REVISION_MODE_ARTICLE:
+                revision = ArticleRevision()
+                revision.inherit_predecessor(article)
+                revision.automatic_log = message
+                revision.user = user
+                revision.ip_address = ip_address
+                article.add_revision(revision)
+
+            for chunk in _chunks(read_rows(fileobj),
+                                 settings.BULK_BATCH_SIZE):
+                valid = validate_chunk(chunk, owners, result)
+                if result.error_count and strict:
+                    # Keep validating to report every error, but stop
+                    # writing.
+                    continue
+                milestones = models.Milestone.objects.bulk_insert(
+                    build_milestones(article, revision, valid))
+                history.record_created(milestones, user, ip_address,
+                                       message)
+                result.created += len(milestones)
+
+            if not result.created or result.error_count and strict:
+                raise _Rollback
+    except _Rollback:
+        result.created = 0
+        return result
+
+    # Bulk inserted rows bypass the post_save handlers.
+    cache.bump_versions(article_ids=[article.pk], owner_ids=owners.values())
+    return result
@@ -0,0 +1,60 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from milestones import benchmarks
+
+
+class Command(BaseCommand):
+    args = '[benchmark ...]'
+    help = ("Time the milestones plugin hot paths against a synthetic "
+            "fixture. Runs every benchmark unless names are given. Changes "
+            "are rolled back.")
+    option_list = BaseCommand.option_list + (
+        make_option('--users', dest='users', type='int', default=10,
+                    help='Users in the fixture.'),
+        make_option('--articles', dest='articles', type='int', default=10,
+                    help='Articles in the fixture.'),
+        make_option('--milestones', dest='milestones', type='int',
+                    default=10000, help='Milestones in the fixture.'),
+        make_option('--json', dest='json', default=None,
+                    help='Also write the results as JSON to this file, for '
+                         'comparing runs; - for standard output.'),
+        make_option('--label', dest='label', default=None,
+                    help='Label stored with the JSON results, e.g. the '
+                         'commit being measured.'),
+    )
+
+    def handle(self, *args, **options):
+        names = args or sorted(benchmarks.BENCHMARKS)
+        for name in names:
+            if name not in benchmarks.BENCHMARKS:
+                raise CommandError("Unknown benchmark %s, choose from: %s" % (
+                    name, ', '.join(sorted(benchmarks.BENCHMARKS))))
+
+        # As in tests: the views are requested through the test client.
+        setup_test_environment()
+        try:
+            run = benchmarks.run(names, users=options['users'],
+                                 articles=options['articles'],
+                                 milestones=options['milestones'])
+        finally:
+            teardown_test_environment()
+        run['meta']['label'] = options['label']
+
+        if options['json'] == '-':
+            self.stdout.write(json.dumps(run, indent=2, sort_keys=True))
+            return
+        if options['json']:
+            with open(options['json'], 'w') as output:
+                json.dump(run, output, indent=2, sort_keys=True)
+
+        results = run['results']
+        for key in sorted(results):
+            if isinstance(results[key], float):
+                self.stdout.write('%-40s %12.4fs' % (key, results[key]))
+            else:
+                self.stdout.write('%-40s %12d' % (key, results[key]))
@@ -0,0 +1,50 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.dateparse import parse_date
+
+from milestones import digest
+
+
+class Command(BaseCommand):
+    help = ("Send each owner a digest of their milestones that are due "
+            "soon or overdue and were not reported yet. Meant to be run "
+            "from cron; running it again sends only what changed since.")
+    option_list = BaseCommand.option_list + (
+        make_option('--date', dest='date', default=None,
+                    help='Run as if today were this YYYY-MM-DD date.'),
+        make_option('--days-ahead', dest='days_ahead', type='int',
+                    default=None,
+                    help='Days before its date a milestone is due soon.'),
+        make_option('--name', dest='name', default=digest.DEFAULT_MARK,
+                    help='Name of the schedule, to keep separate '
+                         'schedules apart.'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False,
+                    help='Print the digests without sending or recording '
+                         'them.'),
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Database to read the milestones from.'),
+    )
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = parse_date(options['date'])
+            except ValueError:
+                today = None
+            if today is None:
+                raise CommandError("Invalid date %s" % options['date'])
+
+        digests = digest.run(today=today or datetime.date.today(),
+                             name=options['name'],
+                             days_ahead=options['days_ahead'],
+                             dry_run=options['dry_run'],
+                             using=options['database'])
+        for owner, due, overdue in digests:
+            self.stdout.write('%s: %d due soon, %d overdue' % (
+                owner.username, len(due), len(overdue)))
+        self.stdout.write('%d digests' % len(digests))
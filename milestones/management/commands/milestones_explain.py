@@ -0,0 +1,71 @@
+import datetime
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from milestones import models
+
+
+class Command(BaseCommand):
+    help = ("Print the database query plan of each hot milestone query, to "
+            "check that the milestone indexes are used.")
+    option_list = BaseCommand.option_list + (
+        make_option('--owner', dest='owner', default=None,
+                    help='Username to use for the per-owner queries.'),
+        make_option('--analyze', action='store_true', dest='analyze',
+                    default=False,
+                    help='Run EXPLAIN ANALYZE (PostgreSQL only).'),
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Database to explain the queries on.'),
+    )
+
+    def get_queries(self, owner):
+        today = datetime.date.today()
+        milestones = models.Milestone.objects.using(self.database)
+        return [
+            ('macro', milestones.upcoming(today).filter(
+                date__lte=today + datetime.timedelta(days=30))),
+            ('macro (owner)', milestones.upcoming(today).filter(
+                owner=owner, date__lte=today + datetime.timedelta(days=30))),
+            ('batch', milestones.open_for_owner(owner)),
+            ('digest', milestones.filter(
+                status__in=models.Milestone.OPEN_STATUSES, deleted=False)
+                .overlapping(today - datetime.timedelta(days=1),
+                             today + datetime.timedelta(days=3))),
+            ('calendar', milestones.in_window(
+                today.replace(day=1), today + datetime.timedelta(days=42))),
+        ]
+
+    def get_explain_prefix(self, connection, analyze):
+        if connection.vendor == 'sqlite':
+            return 'EXPLAIN QUERY PLAN'
+        if connection.vendor == 'postgresql' and analyze:
+            return 'EXPLAIN ANALYZE'
+        return 'EXPLAIN'
+
+    def handle(self, *args, **options):
+        self.database = options['database']
+        connection = connections[self.database]
+
+        if options['owner']:
+            try:
+                owner = User.objects.using(self.database).get(
+                    username=options['owner'])
+            except User.DoesNotExist:
+                raise CommandError("No user named %s" % options['owner'])
+        else:
+            owner = User.objects.using(self.database).order_by('pk')[:1]
+            owner = owner[0] if owner else User(pk=0)
+
+        prefix = self.get_explain_prefix(connection, options['analyze'])
+        cursor = connection.cursor()
+        for name, queryset in self.get_queries(owner):
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute('%s %s' % (prefix, sql), params)
+            self.stdout.write('== %s ==' % name)
+            self.stdout.write(sql % tuple(params))
+            for row in cursor.fetchall():
+                self.stdout.write(' '.join([unicode(col) for col in row]))
+            self.stdout.write('')
@@ -0,0 +1,59 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from milestones import exports, forms, models
+
+
+class Command(BaseCommand):
+    help = ("Export milestones to a CSV or XLSX file, filtered as the "
+            "[milestones] tag filters them. Rows are streamed, so whole "
+            "histories can be exported in constant memory.")
+    option_list = BaseCommand.option_list + (
+        make_option('--owner', dest='owner', default=None,
+                    help='Username of the owner.'),
+        make_option('--days', dest='days', default=None,
+                    help='Only milestones up to this many days from today.'),
+        make_option('--start-date', dest='start_date', default=None,
+                    help='Only milestones on or after this YYYY-MM-DD date.'),
+        make_option('--end-date', dest='end_date', default=None,
+                    help='Only milestones on or before this YYYY-MM-DD '
+                         'date.'),
+        make_option('--status', action='append', dest='status', default=[],
+                    help='Only milestones with this status number; '
+                         'repeatable.'),
+        make_option('--article', dest='article', default=None,
+                    help='Only milestones of this article id.'),
+        make_option('--format', dest='format', default=exports.CSV,
+                    help='csv, or xlsx if xlsxwriter is installed.'),
+        make_option('--output', dest='output', default=None,
+                    help='File to write to instead of standard output.'),
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Database to read the milestones from.'),
+    )
+
+    def handle(self, *args, **options):
+        form = forms.MilestonesExportForm(dict(
+            (name, options[name]) for name in
+            ('owner', 'days', 'start_date', 'end_date', 'status', 'article',
+             'format') if options[name] is not None))
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+
+        milestones = form.filter(
+            models.Milestone.objects.using(options['database']).all())
+        chunks = exports.iter_export(milestones, form.cleaned_data['format'])
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                self.write_chunks(output, chunks)
+        else:
+            self.write_chunks(getattr(sys.stdout, 'buffer', sys.stdout),
+                              chunks)
+
+    def write_chunks(self, output, chunks):
+        for chunk in chunks:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode('utf-8')
+            output.write(chunk)
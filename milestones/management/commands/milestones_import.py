@@ -0,0 +1,48 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from wiki.models import Article
+
+from milestones import imports
+
+
+class Command(BaseCommand):
+    args = '<article id> <file.csv>'
+    help = ("Import milestones into an article from a CSV file with title, "
+            "owner, date and optionally status, time and end_date columns.")
+    option_list = BaseCommand.option_list + (
+        make_option('--user', dest='user', default=None,
+                    help='Username to record the import under.'),
+        make_option('--skip-errors', action='store_false', dest='strict',
+                    default=True,
+                    help='Import the valid rows even if some are invalid.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: milestones_import %s" % self.args)
+        try:
+            article = Article.objects.get(pk=args[0])
+        except (Article.DoesNotExist, ValueError):
+            raise CommandError("No article with id %s" % args[0])
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError("No user named %s" % options['user'])
+
+        try:
+            with open(args[1], 'rb') as fileobj:
+                result = imports.import_milestones(fileobj, article, user,
+                                                   None, options['strict'])
+        except (IOError, imports.ImportFileError) as e:
+            raise CommandError(e)
+
+        for line, message in result.errors:
+            self.stderr.write('line %d: %s' % (line, message))
+        if result.error_count > len(result.errors):
+            self.stderr.write('... and %d more errors' % (
+                result.error_count - len(result.errors)))
+        self.stdout.write('%d milestones imported' % result.created)
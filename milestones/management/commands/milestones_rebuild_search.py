@@ -0,0 +1,19 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from milestones import search
+
+
+class Command(BaseCommand):
+    help = ("Rewrite the search tokens of every milestone title, to backfill "
+            "them or repair drift. PostgreSQL needs no tokens.")
+    option_list = BaseCommand.option_list + (
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Database to rebuild the search tokens in.'),
+    )
+
+    def handle(self, *args, **options):
+        indexed = search.rebuild(using=options['database'])
+        self.stdout.write('%d milestones indexed' % indexed)
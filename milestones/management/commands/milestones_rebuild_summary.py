@@ -0,0 +1,19 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from milestones import summary
+
+
+class Command(BaseCommand):
+    help = ("Recompute the milestone summary counters from the milestones, "
+            "to backfill them or repair drift.")
+    option_list = BaseCommand.option_list + (
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Database to rebuild the counters in.'),
+    )
+
+    def handle(self, *args, **options):
+        written = summary.rebuild(using=options['database'])
+        self.stdout.write('%d counters written' % written)
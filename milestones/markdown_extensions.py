@@ -3,15 +3,20 @@ import datetime
 import markdown
 import re
 
-from django.db.models import Q
 from django.template.loader import render_to_string
 from django.template import Context
-from milestones import models
+from django.utils.dateparse import parse_date
+from milestones import cache, models, recurrence, search, stats
 
 
-MILESTONE_RE = re.compile(r'.*(\[milestones(\s+owner\:(?P<owner>\w+))?(\s+days\:(?P<days>\d+))?(\s+start_date\:(?P<start_date>[-\w]+))?(\s+end_date\:(?P<end_date>[-\w]+))?\s*\]).*',
+MILESTONE_RE = re.compile(r'\[milestones(\s+owner\:(?P<owner>\w+))?(\s+days\:(?P<days>\d+))?(\s+start_date\:(?P<start_date>[-\w]+))?(\s+end_date\:(?P<end_date>[-\w]+))?(\s+q\:(?:"(?P<q_quoted>[^"\]]*)"|(?P<q>[^\s"\]]+)))?\s*\]',
                           re.IGNORECASE)
 
+# Cheap test run before any regex work; tags are matched case-insensitively.
+TAG_MARKER = '[milestones'
+
+DEFAULT_DAYS = 30
+
 
 class MilestoneExtension(markdown.Extension):
     """ Milestones plugin markdown extension for django-wiki. """
@@ -22,60 +27,182 @@ class MilestoneExtension(markdown.Extension):
                              '>html_block')
 
 
+def _parse_date(value):
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        return None
+
+
+def get_tag_params(match):
+    """
+    Normalize the parameters of a [milestones] tag into an
+    ``(owner, days, start_date, end_date, q)`` tuple. ``days`` is only kept
+    when no explicit date range is given, since it is ignored otherwise.
+    Malformed dates are ignored. ``q`` is kept as its search terms, so
+    that queries differing only in case or punctuation share a fragment.
+    """
+    owner = match.group('owner')
+    if owner:
+        owner = owner.strip()
+    start_date = _parse_date(match.group('start_date'))
+    end_date = _parse_date(match.group('end_date'))
+    days = None
+    if not start_date and not end_date:
+        days = int(match.group('days') or DEFAULT_DAYS)
+    q = match.group('q_quoted') or match.group('q')
+    if q is not None:
+        q = u' '.join(search.get_terms(q))
+    return (owner, days, start_date, end_date, q)
+
+
+def format_tag(params):
+    """ Write tag parameters back in tag syntax, e.g. ``owner:bob days:30``. """
+    names = ('owner', 'days', 'start_date', 'end_date', 'q')
+    q = params[4]
+    if q is not None and (u' ' in q or not q):
+        params = params[:4] + (u'"%s"' % q,)
+    return u' '.join([u'%s:%s' % (name, value) for name, value in
+                      zip(names, params) if value is not None])
+
+
+def _get_window(params, today):
+    """
+    Return the ``(start, end, expand_start, expand_end)`` window of a tag.
+    Past occurrences of recurring milestones are not shown as overdue, so
+    without an explicit start their expansion begins today. Endless series
+    are expanded over the default horizon.
+    """
+    owner, days, start_date, end_date, q = params
+    if days is not None:
+        end_date = today + datetime.timedelta(days=days)
+    expand_start = start_date or today
+    expand_end = end_date or (max(expand_start, today) +
+                              datetime.timedelta(days=DEFAULT_DAYS))
+    return start_date, end_date, expand_start, expand_end
+
+
+def _in_window(milestone, start_date, end_date):
+    return ((start_date is None or milestone.date >= start_date) and
+            (end_date is None or milestone.date <= end_date))
+
+
+def _shown(milestone, params, window, today):
+    owner = params[0]
+    start_date, end_date, expand_start, expand_end = window
+    if owner and milestone.owner.username != owner:
+        return False
+    if getattr(milestone, 'occurrence_of', None) is not None:
+        if not _in_window(milestone, expand_start, expand_end):
+            return False
+    elif not _in_window(milestone, start_date, end_date):
+        return False
+    return (milestone.status in models.Milestone.UPCOMING_STATUSES and not (
+        milestone.status == models.Milestone.INFORMATIONAL_STATUS and
+        milestone.date < today))
+
+
+def _union(values, pick):
+    # The union of the windows is unbounded on a side where any is.
+    if None in values:
+        return None
+    return pick(values)
+
+
+def render_many(params_list, today):
+    """
+    Render the fragments for several tags, returning a dict keyed by tag
+    parameters. Cached fragments are fetched in one round trip; the rest
+    share a single query per search, over the union of their windows, and
+    are split apart in memory.
+    """
+    params_list = list(set(params_list))
+    fragments = cache.get_fragments(params_list, today)
+    missing = [params for params in params_list if params not in fragments]
+    if not missing:
+        return fragments
+
+    windows = dict((params, _get_window(params, today)) for params in missing)
+    searches = {}
+    for params in missing:
+        searches.setdefault(params[4], []).append(params)
+
+    rendered = {}
+    for q, group in searches.items():
+        milestones = _load(group, windows, q, today)
+        _render_group(rendered, group, windows, milestones, today)
+    cache.set_fragments(rendered, today)
+    fragments.update(rendered)
+    return fragments
+
+
+def _load(params_list, windows, q, today):
+    # The milestones shown by any of the tags, which share the search q.
+    group_windows = [windows[params] for params in params_list]
+    start_date = _union([w[0] for w in group_windows], min)
+    end_date = _union([w[1] for w in group_windows], max)
+    owners = _union([params[0] for params in params_list], set)
+
+    milestones = (models.Milestone.objects.for_listing().upcoming(today)
+                  .overlapping(start_date, end_date))
+    if owners is not None:
+        milestones = milestones.filter(owner__username__in=owners)
+    if q is not None:
+        milestones = search.search(milestones, q)
+    return recurrence.expand(milestones, min([w[2] for w in group_windows]),
+                             max([w[3] for w in group_windows]))
+
+
+def _render_group(rendered, params_list, windows, milestones, today):
+    for params in params_list:
+        with stats.measure('macro.tag', label=format_tag(params)) as tag:
+            shown = [m for m in milestones
+                     if _shown(m, params, windows[params], today)]
+            tag.rows = len(shown)
+            with tag.rendering():
+                rendered[params] = render_to_string(
+                    "wiki/plugins/milestones/fragments/milestones.html",
+                    Context({'milestones': shown,
+                             'display_milestone_page_title': True})
+                )
+
+
+def render_milestones(params, today):
+    """ Render the fragment for one tag, using the fragment cache. """
+    return render_many([params], today)[params]
+
+
 class MilestonePreprocessor(markdown.preprocessors.Preprocessor):
     """
     django-wiki milestone preprocessor - parse text for
-    [milestones owner:username days:30] references.
+    [milestones owner:username days:30 q:"release notes"] references.
     """
 
     def run(self, lines):
-        new_text = []
-        milestones = None
-        owner = None
-        days = 30
-        start_date = None
+        if TAG_MARKER not in '\n'.join(lines).lower():
+            return lines
+
+        with stats.measure('macro'):
+            return self.render_tags(lines)
+
+    def render_tags(self, lines):
+        # First pass: find every tag, parsing each one on its own.
         today = datetime.date.today()
-        filter_kwargs = {'deleted': False}
-        for line in lines:
-            m = MILESTONE_RE.match(line)
-            if m:
-                owner = m.group('owner')
-                if owner:
-                    filter_kwargs.update({'owner__username': owner.strip()})
-
-                start_date = m.group('start_date')
-                if start_date:
-                    filter_kwargs.update({'date__gte': start_date})
-
-                end_date = m.group('end_date')
-                if end_date:
-                    filter_kwargs.update({'date__lte': end_date})
-
-                if not start_date and not end_date:
-                    if m.group('days'):
-                        days = int(m.group('days'))
-                    filter_kwargs.update({
-                        'date__lte': today + datetime.timedelta(days=days)
-                    })
-
-                milestones = (
-                    models.Milestone.objects
-                    .filter(
-                        Q(status=models.Milestone.PENDING_STATUS) |
-                        Q(status=models.Milestone.ACTIVE_STATUS) |
-                        Q(status=models.Milestone.INFORMATIONAL_STATUS),
-                        **filter_kwargs)
-                    .exclude(
-                        status=models.Milestone.INFORMATIONAL_STATUS,
-                        date__lt=today)
-                    .order_by('date', 'time'))
-
-                html = render_to_string(
-                    "wiki/plugins/milestones/fragments/milestones.html",
-                    Context({'milestones': milestones,
-                    'display_milestone_page_title': True})
-                )
-                html_stash = self.markdown.htmlStash.store(html, safe=True)
-                line = line.replace(m.group(1), html_stash)
-            new_text.append(line)
+        tags = []
+        for index, line in enumerate(lines):
+            if TAG_MARKER in line.lower():
+                for m in MILESTONE_RE.finditer(line):
+                    tags.append((index, m.span(), get_tag_params(m)))
+        if not tags:
+            return lines
+
+        # Second pass: render all tags at once and splice them in, from
+        # the right so that earlier spans stay valid.
+        fragments = render_many([params for _, _, params in tags], today)
+        new_text = list(lines)
+        for index, (start, end), params in reversed(tags):
+            html_stash = self.markdown.htmlStash.store(fragments[params],
+                                                       safe=True)
+            line = new_text[index]
+            new_text[index] = line[:start] + html_stash + line[end:]
         return new_text
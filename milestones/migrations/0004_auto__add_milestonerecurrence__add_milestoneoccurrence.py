@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'MilestoneRecurrence'
+        db.create_table(u'milestones_milestonerecurrence', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('milestone', self.gf('django.db.models.fields.related.OneToOneField')(related_name='recurrence', unique=True, to=orm['milestones.Milestone'])),
+            ('frequency', self.gf('django.db.models.fields.SmallIntegerField')()),
+            ('interval', self.gf('django.db.models.fields.PositiveSmallIntegerField')(default=1)),
+            ('until', self.gf('django.db.models.fields.DateField')(null=True, blank=True)),
+            ('count', self.gf('django.db.models.fields.PositiveIntegerField')(null=True, blank=True)),
+            ('last_date', self.gf('django.db.models.fields.DateField')(null=True, blank=True)),
+        ))
+        db.send_create_signal(u'milestones', ['MilestoneRecurrence'])
+
+        # Adding model 'MilestoneOccurrence'
+        db.create_table(u'milestones_milestoneoccurrence', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('milestone', self.gf('django.db.models.fields.related.ForeignKey')(related_name='occurrences', to=orm['milestones.Milestone'])),
+            ('date', self.gf('django.db.models.fields.DateField')()),
+            ('status', self.gf('django.db.models.fields.SmallIntegerField')()),
+        ))
+        db.send_create_signal(u'milestones', ['MilestoneOccurrence'])
+
+        # Adding unique constraint on 'MilestoneOccurrence', fields ['milestone', 'date']
+        db.create_unique(u'milestones_milestoneoccurrence', ['milestone_id', 'date'])
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'MilestoneOccurrence', fields ['milestone', 'date']
+        db.delete_unique(u'milestones_milestoneoccurrence', ['milestone_id', 'date'])
+
+        # Deleting model 'MilestoneOccurrence'
+        db.delete_table(u'milestones_milestoneoccurrence')
+
+        # Deleting model 'MilestoneRecurrence'
+        db.delete_table(u'milestones_milestonerecurrence')
+
+    models = {
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'milestones.milestone': {
+            'Meta': {'object_name': 'Milestone', 'index_together': "[['date', 'time'], ['status', 'date', 'time'], ['owner', 'status', 'date', 'time']]", '_ormbases': ['wiki.SimplePlugin']},
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'owner': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']"}),
+            u'simpleplugin_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['wiki.SimplePlugin']", 'unique': 'True', 'primary_key': 'True'}),
+            'status': ('django.db.models.fields.SmallIntegerField', [], {'default': '1'}),
+            'time': ('django.db.models.fields.TimeField', [], {'null': 'True', 'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200'})
+        },
+        u'milestones.milestoneoccurrence': {
+            'Meta': {'unique_together': "((u'milestone', u'date'),)", 'object_name': 'MilestoneOccurrence'},
+            'date': ('django.db.models.fields.DateField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'milestone': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'occurrences'", 'to': u"orm['milestones.Milestone']"}),
+            'status': ('django.db.models.fields.SmallIntegerField', [], {})
+        },
+        u'milestones.milestonerecurrence': {
+            'Meta': {'object_name': 'MilestoneRecurrence'},
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'frequency': ('django.db.models.fields.SmallIntegerField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'interval': ('django.db.models.fields.PositiveSmallIntegerField', [], {'default': '1'}),
+            'last_date': ('django.db.models.fields.DateField', [], {'null': 'True', 'blank': 'True'}),
+            'milestone': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'recurrence'", 'unique': 'True', 'to': u"orm['milestones.Milestone']"}),
+            'until': ('django.db.models.fields.DateField', [], {'null': 'True', 'blank': 'True'})
+        },
+        'wiki.article': {
+            'Meta': {'object_name': 'Article'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'current_revision': ('django.db.models.fields.related.OneToOneField', [], {'blank': 'True', 'related_name': "'current_set'", 'unique': 'True', 'null': 'True', 'to': "orm['wiki.ArticleRevision']"}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.Group']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'}),
+            'group_read': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'group_write': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'other_read': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'other_write': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'owner': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'owned_articles'", 'null': 'True', 'on_delete': 'models.SET_NULL', 'to': u"orm['auth.User']"})
+        },
+        'wiki.articleplugin': {
+            'Meta': {'object_name': 'ArticlePlugin'},
+            'article': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['wiki.Article']"}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'deleted': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'wiki.articlerevision': {
+            'Meta': {'ordering': "('created',)", 'unique_together': "(('article', 'revision_number'),)", 'object_name': 'ArticleRevision'},
+            'article': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['wiki.Article']"}),
+            'automatic_log': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'content': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'deleted': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.IPAddressField', [], {'max_length': '15', 'null': 'True', 'blank': 'True'}),
+            'locked': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'previous_revision': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['wiki.ArticleRevision']", 'null': 'True', 'blank': 'True'}),
+            'revision_number': ('django.db.models.fields.IntegerField', [], {}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '512'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'}),
+            'user_message': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        'wiki.simpleplugin': {
+            'Meta': {'object_name': 'SimplePlugin', '_ormbases': ['wiki.ArticlePlugin']},
+            'article_revision': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['wiki.ArticleRevision']"}),
+            u'articleplugin_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['wiki.ArticlePlugin']", 'unique': 'True', 'primary_key': 'True'})
+        }
+    }
+
+    complete_apps = ['milestones']
\ No newline at end of file
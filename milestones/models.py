@@ -1,9 +1,206 @@
 import datetime
+import json
+import re
 
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, transaction, IntegrityError
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
-from wiki.models.pluginbase import SimplePlugin, SimplePluginCreateError
+from django.contrib.auth.models import User
+from wiki.models.pluginbase import (ArticlePlugin, SimplePlugin,
+                                    SimplePluginCreateError)
+
+from milestones import cache, colors, recurrence
+from milestones import settings as settings_milestones
+
+
+class MilestoneQuerySet(models.query.QuerySet):
+    # Columns rendered by fragments/milestones.html and batch.html, plus
+    # the recurrence rule needed to expand series.
+    LISTING_FIELDS = ('title', 'status', 'date', 'time', 'deleted', 'article',
+                      'article_revision', 'article_revision__title', 'owner',
+                      'owner__username', 'owner__first_name',
+                      'owner__last_name', 'recurrence__milestone',
+                      'recurrence__frequency', 'recurrence__interval',
+                      'recurrence__until', 'recurrence__count',
+                      'recurrence__last_date')
+
+    def for_listing(self):
+        """
+        Load exactly what the milestone listings display, joining owner,
+        revision title and recurrence rule so rendering a row costs no
+        further queries.
+        """
+        return (self.select_related('owner', 'article_revision', 'recurrence')
+                .only(*self.LISTING_FIELDS)
+                .order_by('date', 'time'))
+
+    # The filters below are the hot query shapes; the indexes declared in
+    # Milestone.Meta.index_together are matched to them, and the
+    # milestones_explain command prints their plans.
+
+    def upcoming(self, today):
+        """ Open and current informational milestones, as the macro shows. """
+        return (self.filter(status__in=Milestone.UPCOMING_STATUSES,
+                            deleted=False)
+                .filter(~Q(status=Milestone.INFORMATIONAL_STATUS) |
+                        Q(date__gte=today) |
+                        Q(recurrence__isnull=False))
+                .order_by('date', 'time'))
+
+    def open_for_owner(self, owner):
+        """ Pending and active milestones of one owner, as batch lists. """
+        return (self.filter(status__in=Milestone.OPEN_STATUSES, owner=owner,
+                            deleted=False)
+                .order_by('date', 'time'))
+
+    def visible(self, today):
+        """
+        Milestones shown by default in the article tab: the complement of
+        what Milestone.get_status_class() marks ``default-hide``.
+        """
+        return self.filter(Milestone.visible_q(today))
+
+    def hidden(self, today):
+        """ Completed, cancelled, deleted and past informational ones. """
+        return self.exclude(Milestone.visible_q(today))
+
+    def in_window(self, start_date, end_date):
+        """ Calendar events between two dates, inclusive. """
+        return (self.overlapping(start_date, end_date)
+                .exclude(status=Milestone.CANCELLED_STATUS)
+                .exclude(deleted=True)
+                .order_by('date', 'time'))
+
+    def readable_by(self, user):
+        """ Milestones of the articles ``user`` may read. """
+        from wiki.models import Article
+        return self.filter(article__in=Article.objects.can_read(user))
+
+    def overlapping(self, start_date, end_date):
+        """
+        Single milestones dated within ``[start_date, end_date]`` and
+        recurring milestones whose series overlaps it. Either bound may be
+        None. Expand the result with ``milestones.recurrence.expand``.
+        """
+        single = Q(recurrence__isnull=True)
+        series = Q(recurrence__isnull=False)
+        if start_date:
+            single &= Q(date__gte=start_date)
+            series &= (Q(recurrence__last_date__isnull=True) |
+                       Q(recurrence__last_date__gte=start_date))
+        if end_date:
+            single &= Q(date__lte=end_date)
+            series &= Q(date__lte=end_date)
+        return self.filter(single | series)
+
+
+class MilestoneManager(models.Manager):
+    def get_queryset(self):
+        return MilestoneQuerySet(self.model, using=self._db)
+
+    def for_listing(self):
+        return self.get_queryset().for_listing()
+
+    def upcoming(self, today):
+        return self.get_queryset().upcoming(today)
+
+    def open_for_owner(self, owner):
+        return self.get_queryset().open_for_owner(owner)
+
+    def visible(self, today):
+        return self.get_queryset().visible(today)
+
+    def hidden(self, today):
+        return self.get_queryset().hidden(today)
+
+    def in_window(self, start_date, end_date):
+        return self.get_queryset().in_window(start_date, end_date)
+
+    def readable_by(self, user):
+        return self.get_queryset().readable_by(user)
+
+    def overlapping(self, start_date, end_date):
+        return self.get_queryset().overlapping(start_date, end_date)
+
+    def bulk_insert(self, milestones, batch_size=None):
+        """
+        Insert unsaved milestones with multi-row INSERTs and return them.
+
+        QuerySet.bulk_create() refuses multi-table inherited models, so the
+        wiki_articleplugin, wiki_simpleplugin and milestones_milestone rows
+        are inserted table by table, with primary keys reserved up front.
+        Where keys cannot be reserved safely the milestones are saved one
+        by one. Must be called inside transaction.atomic(); model signals
+        are not sent for bulk inserted rows.
+        """
+        milestones = list(milestones)
+        if not milestones:
+            return milestones
+        connection = connections[self.db]
+        pks = _reserve_pks(connection, len(milestones))
+        if pks is None:
+            for milestone in milestones:
+                milestone.skip_notification = True
+                milestone.save(using=self.db)
+            return milestones
+
+        chain = []
+        model = self.model
+        while model is not None:
+            chain.insert(0, model)
+            parents = list(model._meta.parents)
+            model = parents[0] if parents else None
+
+        for milestone, pk in zip(milestones, pks):
+            for model in chain:
+                setattr(milestone, model._meta.pk.attname, pk)
+
+        batch_size = batch_size or settings_milestones.BULK_BATCH_SIZE
+        for model in chain:
+            fields = [f for f in model._meta.local_fields if f.column]
+            size = max(min(batch_size, connection.ops.bulk_batch_size(
+                fields, milestones)), 1)
+            for start in range(0, len(milestones), size):
+                model._base_manager._insert(milestones[start:start + size],
+                                            fields=fields, using=self.db)
+        deltas = {}
+        for milestone in milestones:
+            milestone._state.adding = False
+            milestone._state.db = self.db
+            count_milestone(deltas, milestone.article_id, milestone.owner_id,
+                            milestone.date, milestone.status,
+                            milestone.deleted, 1)
+        MilestoneSummary.objects.db_manager(self.db).add(deltas)
+        MilestoneSearchToken.objects.db_manager(self.db).index(milestones)
+        return milestones
+
+
+def _reserve_pks(connection, count):
+    """
+    Reserve ``count`` ArticlePlugin primary keys, or return None if the
+    backend offers no safe way to do so.
+    """
+    table = ArticlePlugin._meta.db_table
+    column = ArticlePlugin._meta.pk.column
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                       'FROM generate_series(1, %s)', [table, column, count])
+        return [row[0] for row in cursor.fetchall()]
+    if connection.vendor == 'sqlite' and connection.in_atomic_block:
+        qn = connection.ops.quote_name
+        # A write statement takes SQLite's reserved lock for the rest of the
+        # transaction, so no other connection can claim the keys after MAX.
+        cursor.execute('UPDATE %s SET %s = %s WHERE 0' % (
+            qn(table), qn(column), qn(column)))
+        cursor.execute('SELECT MAX(%s) FROM %s' % (qn(column), qn(table)))
+        start = (cursor.fetchone()[0] or 0) + 1
+        return range(start, start + count)
+    return None
 
 
 class Milestone(SimplePlugin):
@@ -20,6 +217,8 @@ class Milestone(SimplePlugin):
         (CANCELLED_STATUS, 'Cancelled'),
         (INFORMATIONAL_STATUS, 'Informational'),
     )
+    OPEN_STATUSES = (PENDING_STATUS, ACTIVE_STATUS)
+    UPCOMING_STATUSES = OPEN_STATUSES + (INFORMATIONAL_STATUS,)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL)
     title = models.CharField(max_length=200)
     status = models.SmallIntegerField(choices=STATUS_CHOICES,
@@ -27,9 +226,16 @@ class Milestone(SimplePlugin):
     date = models.DateField()
     time = models.TimeField(blank=True, null=True)
 
+    objects = MilestoneManager()
+
     class Meta:
         verbose_name = _(u'milestone')
         verbose_name_plural = _(u'milestones')
+        index_together = [
+            ['date', 'time'],
+            ['status', 'date', 'time'],
+            ['owner', 'status', 'date', 'time'],
+        ]
 
     def __unicode__(self):
         return "%s" % self.title
@@ -42,6 +248,12 @@ class Milestone(SimplePlugin):
             return 'danger'
         return
 
+    @classmethod
+    def visible_q(cls, today):
+        return Q(deleted=False) & (
+            Q(status__in=cls.OPEN_STATUSES) |
+            Q(status=cls.INFORMATIONAL_STATUS, date__gte=today))
+
     def get_status_class(self):
         today = datetime.date.today()
         append = u''
@@ -73,6 +285,56 @@ class Milestone(SimplePlugin):
 
         return u'%s%s' % (status, append)
 
+    def get_range_copies(self, end_date):
+        """
+        Return unsaved copies of this milestone, one for each day after its
+        date up to and including ``end_date``.
+        """
+        return [
+            Milestone(article_id=self.article_id,
+                      article_revision_id=self.article_revision_id,
+                      owner_id=self.owner_id,
+                      title=self.title,
+                      status=self.status,
+                      date=self.date + datetime.timedelta(days=day))
+            for day in range(1, (end_date - self.date).days + 1)
+        ]
+
+    def has_occurrence(self, date):
+        """ Whether this milestone repeats and one occurrence is on ``date``. """
+        rule = MilestoneRecurrence.objects.filter(milestone=self).first()
+        return rule is not None and date in list(
+            rule.dates(self.date, date, date))
+
+    def get_occurrence_status(self, date):
+        override = (MilestoneOccurrence.objects
+                    .filter(milestone=self, date=date)
+                    .values_list('status', flat=True).first())
+        return self.status if override is None else override
+
+    def set_occurrence_status(self, date, status, user=None,
+                              ip_address=None):
+        """
+        Set the status of the occurrence of this recurring milestone on
+        ``date``. Only statuses differing from the series are stored.
+        """
+        with transaction.atomic():
+            occurrences = MilestoneOccurrence.objects.filter(milestone=self,
+                                                             date=date)
+            if status == self.status:
+                occurrences.delete()
+            elif not occurrences.update(status=status):
+                MilestoneOccurrence.objects.create(milestone=self, date=date,
+                                                   status=status)
+            # Recorded so that calendar deltas pick the occurrence up.
+            MilestoneChange.objects.create(
+                milestone=self, article_id=self.article_id, user=user,
+                ip_address=ip_address,
+                message=u"Occurrence on %s set to %s." % (
+                    date.isoformat(), dict(self.STATUS_CHOICES)[status]))
+        cache.bump_versions(article_ids=[self.article_id],
+                            owner_ids=[self.owner_id])
+
     def get_status(self):
         for c in self.STATUS_CHOICES:
             if self.status == c[0]:
@@ -83,3 +345,447 @@ class Milestone(SimplePlugin):
             if not self.article.current_revision:
                 raise SimplePluginCreateError("Article does not have a current_revision set.")
         super(SimplePlugin, self).save(*args, **kwargs)
+
+
+class MilestoneRecurrence(models.Model):
+    """ Repetition rule of a recurring milestone. """
+    milestone = models.OneToOneField(Milestone, related_name='recurrence')
+    frequency = models.SmallIntegerField(choices=recurrence.FREQUENCY_CHOICES)
+    interval = models.PositiveSmallIntegerField(default=1)
+    until = models.DateField(blank=True, null=True)
+    count = models.PositiveIntegerField(blank=True, null=True)
+    # Date of the final occurrence, None for endless series. Kept so window
+    # queries can skip series that ended before the window.
+    last_date = models.DateField(blank=True, null=True, editable=False)
+
+    class Meta:
+        verbose_name = _(u'milestone recurrence')
+        verbose_name_plural = _(u'milestone recurrences')
+
+    def __unicode__(self):
+        unit = {recurrence.DAILY: _(u'day'),
+                recurrence.WEEKLY: _(u'week'),
+                recurrence.MONTHLY: _(u'month')}[self.frequency]
+        if self.interval == 1:
+            text = _(u'Every %s') % unit
+        else:
+            text = _(u'Every %(interval)d %(unit)ss') % {
+                'interval': self.interval, 'unit': unit}
+        if self.count:
+            text += _(u', %d times') % self.count
+        if self.until:
+            text += _(u' until %s') % self.until.isoformat()
+        return text
+
+    def dates(self, first, start, end):
+        return recurrence.occurrence_dates(first, self.frequency,
+                                           self.interval, self.until,
+                                           self.count, start, end)
+
+    def save(self, *args, **kwargs):
+        self.last_date = recurrence.last_date(self.milestone.date,
+                                              self.frequency, self.interval,
+                                              self.until, self.count)
+        super(MilestoneRecurrence, self).save(*args, **kwargs)
+
+
+class MilestoneOccurrence(models.Model):
+    """
+    Status of one occurrence of a recurring milestone, stored only where it
+    differs from the status of the series.
+    """
+    milestone = models.ForeignKey(Milestone, related_name='occurrences')
+    date = models.DateField()
+    status = models.SmallIntegerField(choices=Milestone.STATUS_CHOICES)
+
+    class Meta:
+        unique_together = (('milestone', 'date'),)
+        verbose_name = _(u'milestone occurrence')
+        verbose_name_plural = _(u'milestone occurrences')
+
+
+class MilestoneChange(models.Model):
+    """
+    Append-only record of a milestone write with the old and new value of
+    every field it changed. ``changes`` holds a JSON object mapping field
+    names to ``[old, new]`` pairs.
+
+    Changes outlive their milestone and article: the foreign keys have no
+    database constraint and deleting a milestone records a DELETED change
+    instead of removing its history.
+    """
+    CREATED_ACTION = 0
+    UPDATED_ACTION = 1
+    DELETED_ACTION = 2
+
+    ACTION_CHOICES = (
+        (CREATED_ACTION, 'Created'),
+        (UPDATED_ACTION, 'Updated'),
+        (DELETED_ACTION, 'Deleted'),
+    )
+    # Fields whose changes are recorded, by attribute name.
+    TRACKED_FIELDS = ('title', 'owner_id', 'status', 'date', 'time',
+                      'deleted')
+
+    milestone = models.ForeignKey(Milestone, related_name='changes',
+                                  on_delete=models.DO_NOTHING,
+                                  db_constraint=False)
+    article = models.ForeignKey('wiki.Article', related_name='+',
+                                on_delete=models.DO_NOTHING,
+                                db_constraint=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, blank=True, null=True,
+                             on_delete=models.SET_NULL, related_name='+')
+    ip_address = models.IPAddressField(blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    action = models.SmallIntegerField(choices=ACTION_CHOICES,
+                                      default=UPDATED_ACTION)
+    changes = models.TextField(blank=True)
+    message = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ('created',)
+        index_together = [
+            ['milestone', 'created'],
+            ['article', 'created'],
+        ]
+        verbose_name = _(u'milestone change')
+        verbose_name_plural = _(u'milestone changes')
+
+    def __unicode__(self):
+        return u"%s" % self.message
+
+    def get_changes(self):
+        return json.loads(self.changes) if self.changes else {}
+
+    def set_changes(self, old_values, new_values):
+        """
+        Store the differences between two ``{field: value}`` dicts and
+        return them. ``old_values`` is None for new milestones.
+        """
+        old_values = old_values or {}
+        diff = dict(
+            (field, [old_values.get(field), new_values.get(field)])
+            for field in self.TRACKED_FIELDS
+            if field in new_values and
+            old_values.get(field) != new_values.get(field))
+        self.changes = json.dumps(diff, cls=DjangoJSONEncoder,
+                                  sort_keys=True)
+        return diff
+
+
+class MilestoneDigestMark(models.Model):
+    """
+    Date of the last digest run of a schedule. What was reported is kept
+    per milestone, as MilestoneDigestEntry rows.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    date = models.DateField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _(u'milestone digest mark')
+        verbose_name_plural = _(u'milestone digest marks')
+
+    def __unicode__(self):
+        return u"%s: %s" % (self.name, self.date)
+
+
+class MilestoneDigestEntry(models.Model):
+    """
+    A milestone, or one occurrence of a recurring one, reported as due soon
+    or overdue by the digest schedule ``name``. Reported again only when
+    its date changes.
+    """
+    DUE_KIND = 0
+    OVERDUE_KIND = 1
+    KIND_CHOICES = (
+        (DUE_KIND, 'Due'),
+        (OVERDUE_KIND, 'Overdue'),
+    )
+
+    name = models.CharField(max_length=50)
+    milestone = models.ForeignKey(Milestone, related_name='+')
+    date = models.DateField()
+    kind = models.SmallIntegerField(choices=KIND_CHOICES)
+
+    class Meta:
+        unique_together = (('name', 'milestone', 'date', 'kind'),)
+        verbose_name = _(u'milestone digest entry')
+        verbose_name_plural = _(u'milestone digest entries')
+
+    def __unicode__(self):
+        return u"%s: %s %s %s" % (self.name, self.milestone_id, self.date,
+                                  self.get_kind_display())
+
+
+def count_milestone(deltas, article_id, owner_id, date, status, deleted,
+                    sign):
+    """
+    Add ``sign`` to the summary buckets of a milestone in ``deltas``, a
+    dict mapping ``(scope, scope_id, date, status)`` to a count change.
+    Deleted milestones are not counted.
+    """
+    if deleted:
+        return deltas
+    for key in ((MilestoneSummary.OWNER_SCOPE, owner_id, date, status),
+                (MilestoneSummary.ARTICLE_SCOPE, article_id, date, status)):
+        deltas[key] = deltas.get(key, 0) + sign
+    return deltas
+
+
+class MilestoneSummaryManager(models.Manager):
+    def add(self, deltas):
+        """
+        Apply the count changes gathered by count_milestone(). Every
+        MILESTONES_BULK_BATCH_SIZE buckets cost one query to find the
+        existing ones, one UPDATE per distinct change and a bulk INSERT of
+        the missing ones, however many milestones were counted.
+        """
+        keys = sorted([key for key, delta in deltas.items() if delta])
+        size = settings_milestones.BULK_BATCH_SIZE
+        for start in range(0, len(keys), size):
+            self._add_chunk(dict((key, deltas[key])
+                                 for key in keys[start:start + size]))
+
+    def _add_chunk(self, deltas):
+        # Narrowed to the chunk's ids and dates, then matched exactly.
+        rows = (self.filter(scope__in=set([key[0] for key in deltas]),
+                            scope_id__in=set([key[1] for key in deltas]),
+                            date__gte=min([key[2] for key in deltas]),
+                            date__lte=max([key[2] for key in deltas]),
+                            status__in=set([key[3] for key in deltas]))
+                .values_list('pk', 'scope', 'scope_id', 'date', 'status'))
+        existing = dict((tuple(row[1:]), row[0]) for row in rows
+                        if tuple(row[1:]) in deltas)
+
+        by_delta = {}
+        for key, pk in existing.items():
+            by_delta.setdefault(deltas[key], []).append(pk)
+        for delta, pks in by_delta.items():
+            self.filter(pk__in=pks).update(count=F('count') + delta)
+
+        # A bucket missing when decrementing means the counters have
+        # drifted; milestones_rebuild_summary repairs them.
+        missing = [MilestoneSummary(scope=scope, scope_id=scope_id, date=date,
+                                    status=status, count=delta)
+                   for (scope, scope_id, date, status), delta in deltas.items()
+                   if delta > 0 and
+                   (scope, scope_id, date, status) not in existing]
+        if not missing:
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                self.bulk_create(missing)
+        except IntegrityError:
+            # Some were created concurrently since the read.
+            for bucket in missing:
+                self._add_one(bucket)
+
+    def _add_one(self, bucket):
+        buckets = self.filter(scope=bucket.scope, scope_id=bucket.scope_id,
+                              date=bucket.date, status=bucket.status)
+        if buckets.update(count=F('count') + bucket.count):
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                bucket.save(using=self.db)
+        except IntegrityError:
+            buckets.update(count=F('count') + bucket.count)
+
+
+class MilestoneSummary(models.Model):
+    """
+    Number of milestones of an owner or article per date and status, kept
+    up to date on every milestone write. Deleted and recurring milestones
+    are left out; ``milestones.summary``, which reads them, counts the
+    occurrences of the latter itself.
+    """
+    OWNER_SCOPE = 0
+    ARTICLE_SCOPE = 1
+    SCOPE_CHOICES = (
+        (OWNER_SCOPE, 'Owner'),
+        (ARTICLE_SCOPE, 'Article'),
+    )
+
+    scope = models.SmallIntegerField(choices=SCOPE_CHOICES)
+    scope_id = models.PositiveIntegerField()
+    date = models.DateField()
+    status = models.SmallIntegerField(choices=Milestone.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    objects = MilestoneSummaryManager()
+
+    class Meta:
+        unique_together = (('scope', 'scope_id', 'date', 'status'),)
+        verbose_name = _(u'milestone summary')
+        verbose_name_plural = _(u'milestone summaries')
+
+    def __unicode__(self):
+        return u"%s %s %s %s: %d" % (self.get_scope_display(), self.scope_id,
+                                     self.date, self.get_status_display(),
+                                     self.count)
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Split ``text`` into the lowercased words it is searched by, in order
+    and without repeats.
+    """
+    tokens = []
+    for match in TOKEN_RE.finditer(text or u''):
+        token = match.group().lower()[:MilestoneSearchToken.TOKEN_LENGTH]
+        if token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+class MilestoneSearchTokenManager(models.Manager):
+    def index(self, milestones, replace=False):
+        """
+        Write the title tokens of saved milestones, first removing their
+        old ones if ``replace`` is set. PostgreSQL searches an expression
+        index on the titles instead, so nothing is written there.
+        """
+        if connections[self.db].vendor == 'postgresql':
+            return
+        milestones = list(milestones)
+        if replace:
+            self.filter(milestone__in=[m.pk for m in milestones]).delete()
+        self.bulk_create([
+            MilestoneSearchToken(milestone_id=milestone.pk, token=token)
+            for milestone in milestones for token in tokenize(milestone.title)
+        ], batch_size=settings_milestones.BULK_BATCH_SIZE)
+
+
+class MilestoneSearchToken(models.Model):
+    """
+    A word of a milestone title, for searching titles on databases without
+    full-text indexes. Read through ``milestones.search``.
+    """
+    TOKEN_LENGTH = 50
+
+    milestone = models.ForeignKey(Milestone, related_name='search_tokens')
+    token = models.CharField(max_length=TOKEN_LENGTH)
+
+    objects = MilestoneSearchTokenManager()
+
+    class Meta:
+        # Leads with the token, so prefix searches are index range scans.
+        unique_together = (('token', 'milestone'),)
+        verbose_name = _(u'milestone search token')
+        verbose_name_plural = _(u'milestone search tokens')
+
+    def __unicode__(self):
+        return u"%s" % self.token
+
+
+@receiver(pre_save, sender=Milestone)
+def remember_previous_values(sender, instance, **kwargs):
+    instance._previous_values = None
+    if instance.pk:
+        previous = (Milestone.objects.filter(pk=instance.pk)
+                    .values(*MilestoneChange.TRACKED_FIELDS))
+        instance._previous_values = previous[0] if previous else None
+
+
+@receiver(post_save, sender=Milestone)
+@receiver(post_delete, sender=Milestone)
+def invalidate_milestone_cache(sender, instance, **kwargs):
+    owner_ids = [instance.owner_id]
+    if getattr(instance, '_previous_values', None):
+        owner_ids.append(instance._previous_values['owner_id'])
+    cache.bump_versions(article_ids=[instance.article_id],
+                        owner_ids=owner_ids)
+
+
+@receiver(post_save, sender=Milestone)
+def update_summary_on_save(sender, instance, created, **kwargs):
+    if not created and MilestoneRecurrence.objects.using(
+            kwargs.get('using')).filter(milestone=instance).exists():
+        return
+    deltas = {}
+    previous = getattr(instance, '_previous_values', None)
+    if previous:
+        count_milestone(deltas, instance.article_id, previous['owner_id'],
+                        previous['date'], previous['status'],
+                        previous['deleted'], -1)
+    count_milestone(deltas, instance.article_id, instance.owner_id,
+                    instance.date, instance.status, instance.deleted, 1)
+    MilestoneSummary.objects.db_manager(kwargs.get('using')).add(deltas)
+
+
+@receiver(post_save, sender=Milestone)
+def update_search_tokens(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_values', None)
+    if created or not previous or previous['title'] != instance.title:
+        MilestoneSearchToken.objects.db_manager(kwargs.get('using')).index(
+            [instance], replace=not created)
+
+
+@receiver(post_delete, sender=Milestone)
+def record_deletion(sender, instance, **kwargs):
+    # Rows deleted outright, e.g. from the admin or with their article;
+    # also tells calendar deltas to drop them.
+    values = dict((field, getattr(instance, field))
+                  for field in MilestoneChange.TRACKED_FIELDS)
+    change = MilestoneChange(milestone_id=instance.pk,
+                             article_id=instance.article_id,
+                             action=MilestoneChange.DELETED_ACTION,
+                             message=u"Milestone removed. Title: %s PK: %d" % (
+                                 instance.title, instance.pk))
+    change.set_changes(values, dict.fromkeys(values))
+    change.save(using=kwargs.get('using'))
+
+
+@receiver(post_save, sender=MilestoneRecurrence)
+@receiver(post_delete, sender=MilestoneRecurrence)
+def update_summary_on_recurrence(sender, instance, **kwargs):
+    # A milestone leaves the counters when it starts repeating and returns
+    # when it stops. Deleting a milestone deletes its rule first, so the
+    # milestone is counted back just before its own post_delete.
+    if not kwargs.get('created', True):
+        return
+    milestone = (Milestone.objects.using(kwargs.get('using'))
+                 .filter(pk=instance.milestone_id)
+                 .values('article_id', 'owner_id', 'date', 'status',
+                         'deleted').first())
+    if milestone is None:
+        return
+    sign = -1 if 'created' in kwargs else 1
+    MilestoneSummary.objects.db_manager(kwargs.get('using')).add(
+        count_milestone({}, milestone['article_id'], milestone['owner_id'],
+                        milestone['date'], milestone['status'],
+                        milestone['deleted'], sign))
+
+
+@receiver(post_delete, sender=Milestone)
+def update_summary_on_delete(sender, instance, **kwargs):
+    MilestoneSummary.objects.db_manager(kwargs.get('using')).add(
+        count_milestone({}, instance.article_id, instance.owner_id,
+                        instance.date, instance.status, instance.deleted, -1))
+
+
+@receiver(post_save, sender=Milestone)
+def update_recurrence_last_date(sender, instance, created, **kwargs):
+    # The end of a count limited series moves with its first date.
+    if not created:
+        for rule in MilestoneRecurrence.objects.filter(milestone=instance):
+            rule.milestone = instance
+            rule.save()
+
+
+@receiver(post_save, sender=MilestoneRecurrence)
+@receiver(post_delete, sender=MilestoneRecurrence)
+def invalidate_recurrence_cache(sender, instance, **kwargs):
+    cache.bump_for_queryset(Milestone.objects.filter(pk=instance.milestone_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_calendar_users(sender, instance, **kwargs):
+    # Logging in only touches last_login, which the calendar does not show.
+    if set(kwargs.get('update_fields') or ()) != set(['last_login']):
+        colors.invalidate_calendar_users()
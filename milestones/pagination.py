@@ -0,0 +1,85 @@
+"""
+Keyset pagination of milestone listings.
+
+Listings are ordered by ``(date, time, id)`` with untimed milestones first
+on their day, as ``recurrence.expand`` sorts them. A page is fetched with a
+filter on the last row of the previous page instead of an OFFSET, so every
+page costs the same however deep it is, and rows written meanwhile never
+shift a page boundary.
+
+A cursor is the key of the last row as an opaque string, e.g.
+``2014-03-01~09:30:00~42``; ``~~`` marks an untimed milestone.
+"""
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_time
+
+from milestones import settings
+
+
+def encode_cursor(milestone):
+    """ Return the cursor of a milestone or of a ``values()`` row. """
+    if isinstance(milestone, dict):
+        date, time, pk = milestone['date'], milestone['time'], milestone['id']
+    else:
+        date, time, pk = milestone.date, milestone.time, milestone.pk
+    return '%s~%s~%d' % (date.isoformat(),
+                         time.strftime('%H:%M:%S') if time else '', pk)
+
+
+def decode_cursor(value):
+    """
+    Return the ``(date, time, pk)`` key encoded in ``value``, or None if
+    it is malformed.
+    """
+    try:
+        date, time, pk = (value or '').split('~')
+        date = parse_date(date)
+        time = parse_time(time) if time else None
+        pk = int(pk)
+    except ValueError:
+        return None
+    if date is None:
+        return None
+    return date, time, pk
+
+
+def ordered(queryset):
+    """ Order ``queryset`` by the pagination key. """
+    qn = connections[queryset.db].ops.quote_name
+    column = '%s.%s' % (qn(queryset.model._meta.db_table), qn('time'))
+    # NULLs sort first on some databases and last on others, so untimed
+    # rows are put first explicitly.
+    return (queryset.extra(select={'has_time': '%s IS NOT NULL' % column})
+            .order_by('date', 'has_time', 'time', 'pk'))
+
+
+def after(queryset, key):
+    """ Restrict ``queryset`` to the rows after ``key`` in key order. """
+    date, time, pk = key
+    if time is None:
+        same_day = Q(time__isnull=False) | Q(time__isnull=True, pk__gt=pk)
+    else:
+        same_day = Q(time__gt=time) | Q(time=time, pk__gt=pk)
+    return queryset.filter(Q(date__gt=date) | Q(date=date) & same_day)
+
+
+def get_page(queryset, cursor=None, size=None, values=None):
+    """
+    Return a ``(milestones, next_cursor)`` pair for the page after
+    ``cursor``, or the first page. ``next_cursor`` is None on the last page.
+    With ``values``, the page holds ``values(*values)`` dicts, which must
+    include ``date``, ``time`` and ``id``. Costs one query.
+    """
+    size = size or settings.PAGE_SIZE
+    queryset = ordered(queryset)
+    key = decode_cursor(cursor)
+    if key is not None:
+        queryset = after(queryset, key)
+    if values:
+        # The ordering column must be among the values to sort on it.
+        queryset = queryset.values('has_time', *values)
+    milestones = list(queryset[:size + 1])
+    if len(milestones) > size:
+        return milestones[:size], encode_cursor(milestones[size - 1])
+    return milestones, None
@@ -0,0 +1,131 @@
+"""
+Date arithmetic and lazy expansion for recurring milestones.
+
+A recurring milestone is stored as one Milestone row (its first occurrence)
+plus a MilestoneRecurrence rule. Occurrences are never stored; they are
+computed for the window being displayed. Only per-occurrence status changes
+are stored, as sparse MilestoneOccurrence rows.
+"""
+import copy
+import datetime
+from calendar import monthrange
+
+DAILY = 0
+WEEKLY = 1
+MONTHLY = 2
+
+FREQUENCY_CHOICES = (
+    (DAILY, 'Daily'),
+    (WEEKLY, 'Weekly'),
+    (MONTHLY, 'Monthly'),
+)
+
+
+def nth_date(first, frequency, interval, n):
+    """ Return the date of occurrence ``n`` (0 being ``first``). """
+    if frequency == DAILY:
+        return first + datetime.timedelta(days=n * interval)
+    if frequency == WEEKLY:
+        return first + datetime.timedelta(days=7 * n * interval)
+    months = first.month - 1 + n * interval
+    year = first.year + months // 12
+    month = months % 12 + 1
+    # Clamp e.g. the 31st to the last day of shorter months.
+    return datetime.date(year, month, min(first.day, monthrange(year, month)[1]))
+
+
+def first_index(first, frequency, interval, start):
+    """ Return the index of the first occurrence on or after ``start``. """
+    if start is None or start <= first:
+        return 0
+    if frequency == MONTHLY:
+        months = (start.year - first.year) * 12 + start.month - first.month
+        n = max(months // interval - 1, 0)
+        while nth_date(first, frequency, interval, n) < start:
+            n += 1
+        return n
+    step = interval * (7 if frequency == WEEKLY else 1)
+    return -(-(start - first).days // step)
+
+
+def occurrence_dates(first, frequency, interval, until, count, start, end):
+    """ Yield the occurrence dates that fall within ``[start, end]``. """
+    n = first_index(first, frequency, interval, start)
+    while count is None or n < count:
+        date = nth_date(first, frequency, interval, n)
+        if date > end or (until is not None and date > until):
+            break
+        yield date
+        n += 1
+
+
+def last_date(first, frequency, interval, until, count):
+    """ Return the date of the last occurrence, or None if it never ends. """
+    if count is None:
+        return until
+    date = nth_date(first, frequency, interval, max(count - 1, 0))
+    if until is not None and until < date:
+        return until
+    return date
+
+
+def _sort_key(milestone):
+    return (milestone.date, milestone.time is not None,
+            milestone.time or datetime.time.min, milestone.pk)
+
+
+def expand(milestones, start=None, end=None):
+    """
+    Return ``milestones`` as a list with each recurring milestone replaced
+    by its occurrences within ``[start, end]``, sorted by date and time.
+
+    Occurrences are shallow copies of the series milestone with ``date``
+    and, where overridden, ``status`` changed; ``occurrence_of`` points to
+    the series. Every returned milestone gets a ``recurrence_rule``
+    attribute, None when it does not repeat. Without an ``end`` the series
+    rows are returned as they are, only annotated.
+
+    Costs one query for the rules, unless they were loaded with
+    select_related('recurrence'), and, when expanding series, one for the
+    status overrides in the window.
+    """
+    from milestones.models import (Milestone, MilestoneOccurrence,
+                                   MilestoneRecurrence)
+
+    milestones = list(milestones)
+    # Querysets from for_listing() carry the rules already.
+    cache_name = Milestone.recurrence.cache_name
+    if all([hasattr(m, cache_name) for m in milestones]):
+        rules = dict((m.pk, getattr(m, cache_name)) for m in milestones
+                     if getattr(m, cache_name) is not None)
+    else:
+        rules = dict(
+            (rule.milestone_id, rule) for rule in
+            MilestoneRecurrence.objects.filter(
+                milestone__in=[m.pk for m in milestones]))
+    for milestone in milestones:
+        milestone.recurrence_rule = rules.get(milestone.pk)
+    if end is None or not rules:
+        return milestones
+
+    overrides = dict(
+        ((o.milestone_id, o.date), o.status) for o in
+        MilestoneOccurrence.objects.filter(milestone__in=rules.keys(),
+                                           date__lte=end,
+                                           date__gte=start or datetime.date.min))
+
+    result = []
+    for milestone in milestones:
+        rule = milestone.recurrence_rule
+        if rule is None:
+            result.append(milestone)
+            continue
+        for date in rule.dates(milestone.date, start, end):
+            occurrence = copy.copy(milestone)
+            occurrence.date = date
+            occurrence.status = overrides.get((milestone.pk, date),
+                                              milestone.status)
+            occurrence.occurrence_of = milestone
+            result.append(occurrence)
+    result.sort(key=_sort_key)
+    return result
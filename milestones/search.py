@@ -0,0 +1,79 @@
+"""
+Full-text search over milestone titles.
+
+A search matches the milestones whose titles contain every word of the
+query, the last word also matching as a prefix so that results can follow
+typing. Words are what ``models.tokenize`` splits a title into.
+
+On PostgreSQL titles are matched with ``to_tsvector``, served by the GIN
+expression index created by migration 0009, which PostgreSQL keeps up to
+date itself. Other databases read the MilestoneSearchToken table, which
+holds every word of every title and is rewritten as titles are saved or
+bulk inserted; ``manage.py milestones_rebuild_search`` fills it for the
+milestones that existed before the table, and repairs it after writes that
+bypassed the model.
+"""
+from django.db import connections, transaction
+
+from milestones import models, settings
+
+# The text search configuration of the expression index: lowercasing only,
+# no stemming or stop words, like models.tokenize.
+CONFIG = 'simple'
+
+
+def get_terms(query):
+    """ Return the words of ``query`` as searched for. """
+    return models.tokenize(query)
+
+
+def search(queryset, query):
+    """
+    Restrict ``queryset`` of milestones to those matching ``query``. A
+    query without words matches nothing.
+    """
+    terms = get_terms(query)
+    if not terms:
+        return queryset.none()
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        # Spelled as in the index definition, so that the index is used.
+        column = '%s.%s' % (
+            connection.ops.quote_name(models.Milestone._meta.db_table),
+            connection.ops.quote_name('title'))
+        return queryset.extra(
+            where=["to_tsvector('%s', %s) @@ to_tsquery('%s', %%s)" % (
+                CONFIG, column, CONFIG)],
+            params=[u' & '.join(terms[:-1] + [terms[-1] + u':*'])])
+
+    tokens = models.MilestoneSearchToken.objects.using(queryset.db)
+    for term in terms[:-1]:
+        queryset = queryset.filter(
+            pk__in=tokens.filter(token=term).values('milestone'))
+    last = terms[-1]
+    return queryset.filter(pk__in=tokens.filter(
+        token__gte=last, token__lt=last + u'\uffff').values('milestone'))
+
+
+def rebuild(using=None):
+    """
+    Rewrite the search tokens of every milestone. Returns the number of
+    milestones indexed, 0 on PostgreSQL where there is nothing to rebuild.
+    """
+    tokens = models.MilestoneSearchToken.objects.db_manager(using)
+    if connections[tokens.db].vendor == 'postgresql':
+        return 0
+    milestones = models.Milestone.objects.using(using).order_by('pk')
+    indexed = 0
+    with transaction.atomic(using=using):
+        tokens.all().delete()
+        batch = []
+        for milestone in milestones.only('title').iterator():
+            batch.append(milestone)
+            if len(batch) >= settings.BULK_BATCH_SIZE:
+                tokens.index(batch)
+                indexed += len(batch)
+                batch = []
+        tokens.index(batch)
+        indexed += len(batch)
+    return indexed
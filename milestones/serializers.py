@@ -0,0 +1,315 @@
+"""
+Lean serialization of milestones for the machine readable endpoints. These
+work from ``values()`` rows rather than model instances and never go
+through the template engine.
+"""
+import datetime
+import json
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.db.models import Count, Q
+from wiki.models.urlpath import URLPath
+
+from milestones import colors, recurrence, settings
+
+
+def get_article_urls(article_ids, using='default'):
+    """
+    Return a dict mapping article ids to their wiki URLs.
+
+    The URL of an article is made from the slugs of its URLPath ancestors,
+    which are fetched with one nested set query per
+    MILESTONES_BULK_BATCH_SIZE articles instead of one ``urlpath_set.get``
+    per article.
+    """
+    article_ids = [int(pk) for pk in set(article_ids)]
+    if not article_ids:
+        return {}
+
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = URLPath._meta
+    mptt = URLPath._mptt_meta
+
+    def col(name):
+        return qn(opts.get_field(name).column)
+
+    sql = ('SELECT node.{article}, ancestor.{slug}, ancestor.{parent} '
+           'FROM {table} node INNER JOIN {table} ancestor '
+           'ON ancestor.{tree} = node.{tree} '
+           'AND ancestor.{left} <= node.{left} '
+           'AND ancestor.{right} >= node.{right} '
+           'WHERE node.{article} IN ({ids}) '
+           'ORDER BY node.{article}, ancestor.{left}').format(
+        table=qn(opts.db_table),
+        article=col('article'),
+        slug=col('slug'),
+        parent=col('parent'),
+        tree=col(mptt.tree_id_attr),
+        left=col(mptt.left_attr),
+        right=col(mptt.right_attr),
+        ids='{ids}',
+    )
+    cursor = connection.cursor()
+    slugs = {}
+    size = settings.BULK_BATCH_SIZE
+    for start in range(0, len(article_ids), size):
+        chunk = article_ids[start:start + size]
+        cursor.execute(sql.format(ids=', '.join(['%s'] * len(chunk))), chunk)
+        for article_id, slug, parent_id in cursor.fetchall():
+            # The root URLPath has no slug and is not part of any path.
+            if parent_id is not None:
+                slugs.setdefault(article_id, []).append(slug or '')
+            else:
+                slugs.setdefault(article_id, [])
+
+    urls = {}
+    for article_id in article_ids:
+        if article_id in slugs:
+            path = '/'.join(slugs[article_id])
+            urls[article_id] = reverse('wiki:get', kwargs={
+                'path': path + '/' if path else ''})
+        else:
+            urls[article_id] = reverse('wiki:get',
+                                       kwargs={'article_id': article_id})
+    return urls
+
+
+CALENDAR_FIELDS = ('pk', 'title', 'date', 'article_id', 'owner_id',
+                   'owner__username', 'owner__first_name', 'owner__last_name')
+
+
+def _outside(loaded, changed):
+    """
+    Return a predicate telling whether an event is missing from a client
+    that holds the events dated within ``loaded`` and is told to drop
+    those of the ``changed`` milestones.
+    """
+    if loaded is None:
+        return lambda pk, date: True
+    return lambda pk, date: (pk in changed or date < loaded[0] or
+                             date > loaded[1])
+
+
+def calendar_rows(queryset, start_date, end_date, loaded=None, changed=()):
+    """
+    Return the article URLs and an iterator over the
+    ``CALENDAR_FIELDS`` tuples of the events in ``queryset`` between
+    ``start_date`` and ``end_date``, with recurring milestones expanded
+    into their occurrences; an occurrence's ``pk`` is ``<pk>-<date>``.
+
+    With a ``loaded`` ``(start, end)`` window, events dated within it are
+    left out unless they belong to one of the ``changed`` milestones.
+    """
+    changed = set(changed)
+    missing = _outside(loaded, changed)
+    singles = queryset.filter(recurrence__isnull=True)
+    if loaded is not None:
+        outside = Q(date__lt=loaded[0]) | Q(date__gt=loaded[1])
+        if changed:
+            outside |= Q(pk__in=list(changed))
+        singles = singles.filter(outside)
+    series = [
+        occurrence for occurrence in recurrence.expand(
+            queryset.filter(recurrence__isnull=False).select_related('owner'),
+            start_date, end_date)
+        if occurrence.status != occurrence.CANCELLED_STATUS and
+        missing(occurrence.pk, occurrence.date)
+    ]
+
+    article_ids = list(singles.order_by().values_list('article_id', flat=True)
+                       .distinct())
+    article_ids.extend([occurrence.article_id for occurrence in series])
+    article_urls = get_article_urls(article_ids, using=queryset.db)
+
+    def rows():
+        for row in singles.values_list(*CALENDAR_FIELDS).iterator():
+            yield row
+        for occurrence in series:
+            owner = occurrence.owner
+            yield ('%s-%s' % (occurrence.pk, occurrence.date.isoformat()),
+                   occurrence.title, occurrence.date, occurrence.article_id,
+                   owner.pk, owner.username, owner.first_name,
+                   owner.last_name)
+    return article_urls, rows()
+
+
+def calendar_events(queryset, start_date, end_date):
+    """
+    Yield FullCalendar event dicts for ``queryset`` one row at a time.
+    Recurring milestones are expanded into their occurrences between
+    ``start_date`` and ``end_date``.
+    """
+    article_urls, rows = calendar_rows(queryset, start_date, end_date)
+    for pk, title, date, article_id, owner_id, username, first, last in rows:
+        yield {
+            'id': str(pk),
+            'title': u'%s - %s%s' % (title, first[:1], last[:1]),
+            'start': date.isoformat(),
+            'url': article_urls.get(article_id, ''),
+            'color': colors.get_user_color(owner_id),
+            'className': username,
+        }
+
+
+def iter_compact_calendar(queryset, start_date, end_date, version,
+                          loaded=None, changed=None):
+    """
+    Encode the events of ``queryset`` in the compact calendar format, a
+    JSON object streamed one event at a time:
+
+    ``version``
+        Client-held version to pass as ``since`` in the next request.
+    ``window``
+        The ``[start, end]`` dates the events cover.
+    ``full``
+        False for a delta: the client keeps the events it holds within
+        ``window``, except those of the ``changed`` milestone ids, and
+        adds ``events``.
+    ``events``
+        ``[id, title, date, owner, article]`` lists, where ``owner`` and
+        ``article`` are indexes into ``owners``, ``[username, initials,
+        color]`` lists, and ``articles``, URLs.
+    """
+    article_urls, rows = calendar_rows(queryset, start_date, end_date,
+                                       loaded, changed or ())
+    article_ids = sorted(article_urls)
+    article_index = dict((pk, i) for i, pk in enumerate(article_ids))
+    owners = []
+    owner_index = {}
+
+    def events():
+        for pk, title, date, article_id, owner_id, username, first, last \
+                in rows:
+            if owner_id not in owner_index:
+                owner_index[owner_id] = len(owners)
+                owners.append([username, first[:1] + last[:1],
+                               colors.get_user_color(owner_id)])
+            yield [str(pk), title, date.isoformat(), owner_index[owner_id],
+                   article_index.get(article_id)]
+
+    header = {
+        'version': version,
+        'window': [start_date.isoformat(), end_date.isoformat()],
+        'full': loaded is None,
+    }
+    if loaded is not None:
+        header['changed'] = sorted(changed or ())
+    yield json.dumps(header)[:-1] + ', "events": '
+    for chunk in iter_json_list(events()):
+        yield chunk
+    # Owners are gathered while the events stream, so they come last.
+    yield ', "owners": %s, "articles": %s}' % (
+        json.dumps(owners),
+        json.dumps([article_urls[pk] for pk in article_ids]))
+
+
+DAY_GROUP = 'day'
+WEEK_GROUP = 'week'
+GROUPS = (DAY_GROUP, WEEK_GROUP)
+
+
+def get_group(days):
+    """
+    Return the group in which a calendar range of ``days`` days is
+    counted, or None to show its milestones one by one.
+    """
+    if days > settings.CALENDAR_AGGREGATE_WEEK_DAYS:
+        return WEEK_GROUP
+    if days > settings.CALENDAR_AGGREGATE_DAYS:
+        return DAY_GROUP
+    return None
+
+
+def _bucket(date, group):
+    if group == WEEK_GROUP:
+        return date - datetime.timedelta(days=date.weekday())
+    return date
+
+
+def calendar_buckets(queryset, start_date, end_date, group=DAY_GROUP):
+    """
+    Count the events of ``queryset`` between ``start_date`` and
+    ``end_date`` per day or per week (starting on Monday), owner and
+    status, for calendar views too long to show every milestone.
+
+    Single milestones are counted per day by one grouped query, so the
+    rows read are bounded by days times owners times statuses whatever the
+    number of milestones; days are folded into weeks in Python. Recurring
+    milestones are expanded and counted one occurrence at a time. Returns
+    a dict with the ``owners`` as ``[username, initials, color]`` lists
+    and the ``buckets`` as ``[date, owner index, status, count]`` lists.
+    """
+    counts = {}
+
+    def add(date, owner_id, status, count):
+        key = (_bucket(date, group), owner_id, status)
+        counts[key] = counts.get(key, 0) + count
+
+    rows = (queryset.filter(recurrence__isnull=True).order_by()
+            .values_list('date', 'owner_id', 'status')
+            .annotate(count=Count('pk')))
+    for date, owner_id, status, count in rows:
+        add(date, owner_id, status, count)
+    for occurrence in recurrence.expand(
+            queryset.filter(recurrence__isnull=False), start_date, end_date):
+        if occurrence.status != occurrence.CANCELLED_STATUS:
+            add(occurrence.date, occurrence.owner_id, occurrence.status, 1)
+
+    owner_ids = sorted(set([key[1] for key in counts]))
+    names = dict((pk, (username, first[:1] + last[:1])) for
+                 pk, username, first, last in
+                 User.objects.using(queryset.db).filter(pk__in=owner_ids)
+                 .values_list('pk', 'username', 'first_name', 'last_name'))
+    owner_index = dict((pk, i) for i, pk in enumerate(owner_ids))
+    return {
+        'group': group,
+        'window': [start_date.isoformat(), end_date.isoformat()],
+        'owners': [list(names.get(pk, ('', ''))) +
+                   [colors.get_user_color(pk)] for pk in owner_ids],
+        'buckets': [[date.isoformat(), owner_index[owner_id], status, count]
+                    for (date, owner_id, status), count
+                    in sorted(counts.items())],
+    }
+
+
+def iter_json_list(items):
+    """ Encode an iterable as a JSON array, one chunk per item. """
+    yield '['
+    first = True
+    for item in items:
+        yield (json.dumps(item) if first else ',\n' + json.dumps(item))
+        first = False
+    yield ']'
+
+
+API_FIELDS = ('id', 'article_id', 'title', 'owner_id', 'owner__username',
+              'status', 'date', 'time', 'deleted', 'recurrence__frequency',
+              'recurrence__interval', 'recurrence__until',
+              'recurrence__count')
+
+
+def api_milestone(row):
+    """ Return the API representation of a ``values(*API_FIELDS)`` row. """
+    repeat = None
+    if row['recurrence__frequency'] is not None:
+        repeat = {
+            'frequency': row['recurrence__frequency'],
+            'interval': row['recurrence__interval'],
+            'until': row['recurrence__until'],
+            'count': row['recurrence__count'],
+        }
+    return {
+        'id': row['id'],
+        'article': row['article_id'],
+        'title': row['title'],
+        'owner': row['owner_id'],
+        'owner_username': row['owner__username'],
+        'status': row['status'],
+        'date': row['date'],
+        'time': row['time'],
+        'deleted': row['deleted'],
+        'repeat': repeat,
+    }
@@ -1,4 +1,73 @@
+from django.conf import settings as django_settings
+
 ANONYMOUS = False
 SLUG = 'milestones'
 APP_LABEL = 'milestones'
 METHODS = ('milestones',)
+
+# Seconds a rendered [milestones] fragment is kept in the cache. Fragments
+# are invalidated on every milestone write, so this only bounds how long
+# orphaned entries linger in the cache backend.
+CACHE_TIMEOUT = getattr(django_settings, 'MILESTONES_CACHE_TIMEOUT',
+                        60 * 60 * 24)
+CACHE_PREFIX = getattr(django_settings, 'MILESTONES_CACHE_PREFIX',
+                       'milestones')
+
+# Rows per INSERT statement when milestones are created in bulk, e.g. when
+# a date range is expanded into daily copies.
+BULK_BATCH_SIZE = getattr(django_settings, 'MILESTONES_BULK_BATCH_SIZE', 500)
+
+# How milestone writes are recorded. Every write gets a MilestoneChange
+# row; 'article' also adds an article revision, copying the article content,
+# while 'history' leaves the article revisions alone.
+REVISION_MODE_ARTICLE = 'article'
+REVISION_MODE_HISTORY = 'history'
+REVISION_MODE = getattr(django_settings, 'MILESTONES_REVISION_MODE',
+                        REVISION_MODE_ARTICLE)
+
+# Milestones per page in the article tab, the batch page and the API.
+PAGE_SIZE = getattr(django_settings, 'MILESTONES_PAGE_SIZE', 50)
+
+# Days before its date a milestone is reported as due soon by the
+# milestones_digest command.
+DIGEST_DAYS_AHEAD = getattr(django_settings, 'MILESTONES_DIGEST_DAYS_AHEAD', 3)
+# Days back a run looks for milestones that became overdue, beyond the
+# previous run; older ones are not reported.
+DIGEST_DAYS_BEHIND = getattr(django_settings, 'MILESTONES_DIGEST_DAYS_BEHIND',
+                             7)
+DIGEST_FROM_EMAIL = getattr(django_settings, 'MILESTONES_DIGEST_FROM_EMAIL',
+                            None)
+
+# Days of past milestones included in the iCalendar feeds.
+ICAL_DAYS_BEHIND = getattr(django_settings, 'MILESTONES_ICAL_DAYS_BEHIND', 90)
+
+# Rows read per query by the CSV and XLSX exports.
+EXPORT_CHUNK_SIZE = getattr(django_settings, 'MILESTONES_EXPORT_CHUNK_SIZE',
+                            2000)
+
+# Seconds of changes before the version held by a compact calendar client
+# that are included again in its delta, to catch writes committed out of
+# order. Should exceed the longest transaction that writes milestones.
+CALENDAR_DELTA_MARGIN = getattr(django_settings,
+                                'MILESTONES_CALENDAR_DELTA_MARGIN', 600)
+
+# Calendar ranges longer than this many days show daily counts per owner
+# and status instead of milestones, and weekly counts above the second.
+CALENDAR_AGGREGATE_DAYS = getattr(django_settings,
+                                  'MILESTONES_CALENDAR_AGGREGATE_DAYS', 62)
+CALENDAR_AGGREGATE_WEEK_DAYS = getattr(
+    django_settings, 'MILESTONES_CALENDAR_AGGREGATE_WEEK_DAYS', 186)
+
+# Where milestones.stats sends the query count and timings of the views and
+# the [milestones] tag: a dotted path to a backend class, e.g.
+# 'milestones.stats.MemoryBackend' in tests, or None to only send the
+# ``measured`` signal.
+STATS_BACKEND = getattr(django_settings, 'MILESTONES_STATS_BACKEND', None)
+# Whether to measure at all; measuring logs every query for the duration.
+# On by default only when a backend is set.
+STATS_ENABLED = getattr(django_settings, 'MILESTONES_STATS_ENABLED',
+                        bool(STATS_BACKEND))
+STATSD_HOST = getattr(django_settings, 'MILESTONES_STATSD_HOST', 'localhost')
+STATSD_PORT = getattr(django_settings, 'MILESTONES_STATSD_PORT', 8125)
+STATSD_PREFIX = getattr(django_settings, 'MILESTONES_STATSD_PREFIX',
+                        'milestones')
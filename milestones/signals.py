@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+# Sent by milestones.digest for every owner with something to report, with
+# the lists of milestones ``due`` soon and newly ``overdue``. The sender is
+# the digest mark name.
+digest_ready = Signal(providing_args=['owner', 'due', 'overdue', 'date'])
+
+# Sent by milestones.stats for every finished Measurement of a view or a
+# [milestones] tag. The sender is the measurement name.
+measured = Signal(providing_args=['measurement'])
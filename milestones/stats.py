@@ -0,0 +1,330 @@
+"""
+Instrumentation of the milestone views and the ``[milestones]`` tag.
+
+Each entry point runs inside a Measurement that records its query count,
+database time, template render time, row count and total time; times are
+in milliseconds. Finished measurements are sent with the ``measured``
+signal and handed to the backend named by MILESTONES_STATS_BACKEND:
+MemoryBackend, which keeps the latest ones for tests and the shell, or
+StatsdBackend to ship them to statsd. Nothing is measured unless
+MILESTONES_STATS_ENABLED is set, which it is by default when a backend is.
+
+Queries are counted from ``connection.queries``, whose logging is turned
+on for the duration of a measurement; queries logged only for that are
+dropped again afterwards, so memory use does not grow with DEBUG off.
+
+Add StatsHeaderMiddleware to MIDDLEWARE_CLASSES to see the measurements
+of a request in its X-Milestones-Stats response header, e.g. to find the
+wiki pages whose tags are expensive.
+"""
+import collections
+import socket
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings as django_settings
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_by_path
+
+from milestones import settings, signals
+
+HEADER = 'X-Milestones-Stats'
+
+_local = threading.local()
+
+
+def _now():
+    return time.time() * 1000
+
+
+class Measurement(object):
+    """
+    Counters of one entry point run. ``label`` tells apart runs of the
+    same entry point, e.g. the parameters of a tag. Rows and render time
+    of a measurement are added to the one it runs within.
+    """
+    def __init__(self, name, label=None, using=DEFAULT_DB_ALIAS):
+        self.name = name
+        self.label = label
+        self.using = using
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.rows = 0
+        self.duration = 0.0
+        self.parent = None
+        self.finished = False
+
+    def start(self):
+        connection = connections[self.using]
+        forced = getattr(_local, 'forced', 0)
+        logging = (connection.use_debug_cursor or
+                   connection.use_debug_cursor is None and
+                   django_settings.DEBUG)
+        if not forced and not logging:
+            _local.saved_debug_cursor = connection.use_debug_cursor
+            _local.forced_using = self.using
+            _local.base = len(connection.queries)
+            connection.use_debug_cursor = True
+            forced = 1
+        elif forced:
+            forced += 1
+        _local.forced = forced
+        self.first_query = len(connection.queries)
+        self.started = _now()
+        self.resume()
+        return self
+
+    def resume(self):
+        self.parent = getattr(_local, 'current', None)
+        _local.current = self
+
+    def pause(self):
+        if getattr(_local, 'current', None) is self:
+            _local.current = self.parent
+
+    def stop(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.pause()
+        self.duration = _now() - self.started
+        connection = connections[self.using]
+        queries = connection.queries[self.first_query:]
+        self.queries = len(queries)
+        self.db_time = sum([float(query['time']) for query in queries]) * 1000
+        forced = getattr(_local, 'forced', 0)
+        if forced:
+            _local.forced = forced - 1
+            if forced == 1:
+                # The queries were only logged for this measurement.
+                connection.use_debug_cursor = _local.saved_debug_cursor
+                del connection.queries[_local.base:]
+        if self.parent is not None and not self.parent.finished:
+            self.parent.rows += self.rows
+            self.parent.render_time += self.render_time
+        record(self)
+
+    def rendering(self):
+        return _Timer(self)
+
+    def count(self, items):
+        """ Yield ``items``, counting them as rows. """
+        for item in items:
+            self.rows += 1
+            yield item
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'label': self.label,
+            'queries': self.queries,
+            'db_time': self.db_time,
+            'render_time': self.render_time,
+            'rows': self.rows,
+            'duration': self.duration,
+        }
+
+    def __str__(self):
+        name = self.name if self.label is None else '%s[%s]' % (self.name,
+                                                                self.label)
+        return ('%s queries=%d db=%.1f render=%.1f rows=%d total=%.1f' % (
+            name, self.queries, self.db_time, self.render_time, self.rows,
+            self.duration))
+
+
+class _NullMeasurement(Measurement):
+    """ Stands in for a Measurement while stats are turned off. """
+    def start(self):
+        return self
+
+    def resume(self):
+        pass
+
+    def pause(self):
+        pass
+
+    def stop(self):
+        self.finished = True
+
+
+class _Timer(object):
+    def __init__(self, measurement):
+        self.measurement = measurement
+
+    def __enter__(self):
+        self.started = _now()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.measurement.render_time += _now() - self.started
+
+
+def measure(name, label=None, using=DEFAULT_DB_ALIAS):
+    """
+    Return a Measurement to use as a context manager around an entry
+    point, e.g. ``with stats.measure('macro') as measurement:``. While
+    stats are turned off it measures nothing.
+    """
+    if not settings.STATS_ENABLED:
+        return _NullMeasurement(name, label, using)
+    return Measurement(name, label, using)
+
+
+def current():
+    """ Return the innermost running Measurement, or None. """
+    return getattr(_local, 'current', None)
+
+
+def add_rows(count):
+    """ Add ``count`` rows to the running Measurement, if any. """
+    measurement = current()
+    if measurement is not None:
+        measurement.rows += count
+
+
+def count_rows(items):
+    """ Count the items of ``items`` as rows of the running Measurement. """
+    measurement = current()
+    if measurement is None:
+        return items
+    return measurement.count(items)
+
+
+def measured(name):
+    """
+    Measure a view. Template responses are rendered within the
+    measurement; for streaming responses it ends when the content has
+    been consumed.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.STATS_ENABLED:
+                return view(request, *args, **kwargs)
+            measurement = measure(name).start()
+            try:
+                response = view(request, *args, **kwargs)
+                if (hasattr(response, 'render') and
+                        not getattr(response, 'is_rendered', True)):
+                    with measurement.rendering():
+                        response.render()
+            except Exception:
+                measurement.stop()
+                raise
+            if getattr(response, 'streaming', False):
+                measurement.pause()
+                response.streaming_content = _stream(
+                    measurement, response.streaming_content)
+            else:
+                measurement.stop()
+            return response
+        return wrapper
+    return decorator
+
+
+def _stream(measurement, content):
+    measurement.resume()
+    try:
+        for chunk in content:
+            yield chunk
+    finally:
+        measurement.stop()
+
+
+def _reset(**kwargs):
+    # The measurement of a streamed response whose content was never
+    # consumed is left open; close the books on it before the next request.
+    if getattr(_local, 'forced', 0):
+        connection = connections[_local.forced_using]
+        connection.use_debug_cursor = _local.saved_debug_cursor
+    _local.forced = 0
+    _local.current = None
+
+request_started.connect(_reset)
+
+
+class MemoryBackend(object):
+    """ Keeps the latest measurements in memory. """
+    size = 1000
+
+    def __init__(self):
+        self.measurements = collections.deque(maxlen=self.size)
+
+    def record(self, measurement):
+        self.measurements.append(measurement)
+
+    def reset(self):
+        self.measurements.clear()
+
+
+class StatsdBackend(object):
+    """
+    Sends every measurement to statsd over UDP as timers named
+    ``<prefix>.<name>.<counter>``, plus a ``calls`` counter.
+    """
+    def __init__(self):
+        self.address = (settings.STATSD_HOST, settings.STATSD_PORT)
+        self.prefix = settings.STATSD_PREFIX
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, measurement):
+        name = '%s.%s' % (self.prefix, measurement.name)
+        lines = ['%s.calls:1|c' % name] + [
+            '%s.%s:%s|ms' % (name, counter,
+                             int(round(getattr(measurement, counter))))
+            for counter in ('queries', 'db_time', 'render_time', 'rows',
+                            'duration')]
+        try:
+            self.socket.sendto('\n'.join(lines).encode('ascii'),
+                               self.address)
+        except socket.error:
+            # Stats must never break a page.
+            pass
+
+
+_backends = {}
+
+
+def get_backend():
+    """ Return the configured backend, None if there is none. """
+    path = settings.STATS_BACKEND
+    if not path:
+        return None
+    if path not in _backends:
+        _backends[path] = import_by_path(path)()
+    return _backends[path]
+
+
+def record(measurement):
+    backend = get_backend()
+    if backend is not None:
+        backend.record(measurement)
+    collected = getattr(_local, 'request_measurements', None)
+    if collected is not None:
+        collected.append(measurement)
+    signals.measured.send(sender=measurement.name, measurement=measurement)
+
+
+class StatsHeaderMiddleware(object):
+    """
+    Lists the measurements taken while handling a request in its
+    X-Milestones-Stats header. Measurements of streamed content end after
+    the headers are sent and are left out.
+    """
+    def process_request(self, request):
+        _local.request_measurements = []
+
+    def process_response(self, request, response):
+        collected = getattr(_local, 'request_measurements', None)
+        _local.request_measurements = None
+        if collected:
+            response[HEADER] = ', '.join([str(m) for m in collected])
+        return response
@@ -0,0 +1,146 @@
+"""
+Open, overdue and completed milestone counts per owner and per article.
+
+The counts are read from the MilestoneSummary counters, which the
+milestone signal handlers and bulk write paths keep up to date, so they
+cost one small query however many milestones there are. ``rebuild()``
+recomputes the counters from the milestones, for backfills and to repair
+drift.
+
+Recurring milestones are left out of the counters, since their
+occurrences are not stored: they are expanded when counting instead, up
+to the end of the current week, which costs one more query.
+"""
+import datetime
+
+from django.db import connections, transaction
+from django.db.models import Count, Q, Sum
+
+from milestones import models, recurrence, settings
+
+OWNER_SCOPE = models.MilestoneSummary.OWNER_SCOPE
+ARTICLE_SCOPE = models.MilestoneSummary.ARTICLE_SCOPE
+
+
+def get_week(today):
+    """ Return the Monday and Sunday of the week of ``today``. """
+    monday = today - datetime.timedelta(days=today.weekday())
+    return monday, monday + datetime.timedelta(days=6)
+
+
+def get_occurrences(scope, scope_ids, until, using=None):
+    """
+    Return ``(scope_id, date, status)`` for every occurrence up to
+    ``until`` of the recurring milestones of ``scope_ids``.
+    """
+    field = 'owner_id' if scope == OWNER_SCOPE else 'article_id'
+    series = (models.Milestone.objects.using(using)
+              .filter(deleted=False, recurrence__isnull=False,
+                      **{field + '__in': scope_ids})
+              .select_related('recurrence'))
+    return [(getattr(occurrence, field), occurrence.date, occurrence.status)
+            for occurrence in recurrence.expand(series, None, until)]
+
+
+def get_counts(scope, scope_ids, today=None, using=None):
+    """
+    Return a dict mapping each of ``scope_ids`` to its ``open``,
+    ``overdue`` and ``completed_this_week`` counts. Completed milestones
+    are counted by their date, not by when they were completed.
+    """
+    today = today or datetime.date.today()
+    scope_ids = [int(pk) for pk in scope_ids]
+    week = get_week(today)
+    counts = dict((pk, {'open': 0, 'overdue': 0, 'completed_this_week': 0})
+                  for pk in scope_ids)
+    if not scope_ids:
+        return counts
+
+    rows = (models.MilestoneSummary.objects.using(using)
+            .filter(scope=scope, scope_id__in=scope_ids)
+            .filter(Q(status__in=models.Milestone.OPEN_STATUSES) |
+                    Q(status=models.Milestone.COMPLETED_STATUS,
+                      date__range=week))
+            .values_list('scope_id', 'date', 'status', 'count'))
+    occurrences = [row + (1,) for row in
+                   get_occurrences(scope, scope_ids, week[1], using)]
+    for scope_id, date, status, count in list(rows) + occurrences:
+        if status == models.Milestone.COMPLETED_STATUS:
+            if week[0] <= date <= week[1]:
+                counts[scope_id]['completed_this_week'] += count
+            continue
+        counts[scope_id]['open'] += count
+        if date < today:
+            counts[scope_id]['overdue'] += count
+    return counts
+
+
+def get_open_counts(scope, scope_ids, today=None, using=None):
+    """
+    Return a dict mapping each of ``scope_ids`` to its ``open`` and
+    ``overdue`` counts, summed in one grouped query that returns at most
+    two rows per id, for badges and listings of many articles.
+    """
+    today = today or datetime.date.today()
+    scope_ids = [int(pk) for pk in scope_ids]
+    counts = dict((pk, {'open': 0, 'overdue': 0}) for pk in scope_ids)
+    if not scope_ids:
+        return counts
+
+    summaries = models.MilestoneSummary.objects.using(using)
+    qn = connections[summaries.db].ops.quote_name
+    overdue = '%s.%s < %%s' % (qn(models.MilestoneSummary._meta.db_table),
+                               qn('date'))
+    rows = (summaries.filter(scope=scope, scope_id__in=scope_ids,
+                             status__in=models.Milestone.OPEN_STATUSES)
+            .extra(select={'overdue': overdue}, select_params=(today,))
+            .values('scope_id', 'overdue').annotate(total=Sum('count'))
+            .order_by())
+    for row in rows:
+        counts[row['scope_id']]['open'] += row['total']
+        if row['overdue']:
+            counts[row['scope_id']]['overdue'] += row['total']
+    for scope_id, date, status in get_occurrences(
+            scope, scope_ids, get_week(today)[1], using):
+        if status in models.Milestone.OPEN_STATUSES:
+            counts[scope_id]['open'] += 1
+            if date < today:
+                counts[scope_id]['overdue'] += 1
+    return counts
+
+
+def get_owner_counts(owner, today=None):
+    return get_counts(OWNER_SCOPE, [owner.pk], today)[owner.pk]
+
+
+def get_article_counts(article, today=None):
+    return get_counts(ARTICLE_SCOPE, [article.pk], today)[article.pk]
+
+
+def rebuild(using=None):
+    """
+    Recompute every counter from the milestones table with one grouped
+    query per scope. Returns the number of counters written.
+    """
+    summaries = models.MilestoneSummary.objects.db_manager(using)
+    milestones = (models.Milestone.objects.using(using)
+                  .filter(deleted=False, recurrence__isnull=True).order_by())
+    written = 0
+    with transaction.atomic(using=using):
+        summaries.all().delete()
+        for scope, field in ((OWNER_SCOPE, 'owner_id'),
+                             (ARTICLE_SCOPE, 'article_id')):
+            batch = []
+            rows = (milestones.values(field, 'date', 'status')
+                    .annotate(count=Count('pk')).iterator())
+            for row in rows:
+                batch.append(models.MilestoneSummary(
+                    scope=scope, scope_id=row[field], date=row['date'],
+                    status=row['status'], count=row['count']))
+                if len(batch) >= settings.BULK_BATCH_SIZE:
+                    summaries.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+            summaries.bulk_create(batch)
+            written += len(batch)
+    return written
@@ -1,13 +1,45 @@
 from django import template
 
-from milestones import models
+from milestones import models, summary
 
 register = template.Library()
 
 @register.filter
 def milestones_for_article(article):
-    return models.Milestone.objects.filter(article=article).order_by('date', 'time')
+    return models.Milestone.objects.for_listing().filter(article=article)
 
 @register.filter
 def milestones_can_add(article, user):
     return article.can_write(user)
+
+@register.filter
+def milestone_owner_summary(user):
+    """ Open, overdue and completed this week counts of a user. """
+    return summary.get_owner_counts(user)
+
+@register.filter
+def milestone_article_summary(article):
+    """ Open, overdue and completed this week counts of an article. """
+    return summary.get_article_counts(article)
+
+@register.filter
+def milestone_counts(article):
+    """
+    Open and overdue counts of an article, from the summary counters
+    rather than the milestones themselves; for badges.
+    """
+    return summary.get_open_counts(summary.ARTICLE_SCOPE,
+                                   [article.pk])[article.pk]
+
+@register.filter
+def with_milestone_counts(articles):
+    """
+    Set ``milestone_counts`` on each of a list of articles with one
+    query, e.g. ``{% for article in articles|with_milestone_counts %}``.
+    """
+    articles = list(articles)
+    counts = summary.get_open_counts(summary.ARTICLE_SCOPE,
+                                     [article.pk for article in articles])
+    for article in articles:
+        article.milestone_counts = counts[article.pk]
+    return articles
@@ -4,8 +4,27 @@ when you run "manage.py test".
 
 Replace this with more appropriate tests for your application.
 """
+import datetime
+import io
+import json
+import time
 
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache as django_cache
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.template.loader import render_to_string
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from wiki.models import Article, ArticleRevision
+
+from milestones import (benchmarks, colors, digest, exports, history, ical,
+                        imports, models, pagination, recurrence, search,
+                        settings, signals, stats, summary)
+from milestones.markdown_extensions import (get_tag_params, render_many,
+                                            render_milestones, MILESTONE_RE)
+from milestones.templatetags import milestone_tags
 
 
 class SimpleTest(TestCase):
@@ -14,3 +33,934 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class MilestoneTestCase(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.today = datetime.date.today()
+        self.user = User.objects.create_user('owner', 'owner@example.com',
+                                             'secret')
+        self.user.first_name = 'Owen'
+        self.user.last_name = 'Owner'
+        self.user.save()
+        self.article = Article.objects.create()
+        self.article.add_revision(ArticleRevision(title='Project'), save=True)
+
+    def create_milestone(self, **kwargs):
+        defaults = {
+            'article': self.article,
+            'article_revision': self.article.current_revision,
+            'owner': self.user,
+            'title': 'Milestone',
+            'date': self.today,
+        }
+        defaults.update(kwargs)
+        return models.Milestone.objects.create(**defaults)
+
+
+class FragmentCacheTest(MilestoneTestCase):
+    def render(self, tag):
+        return render_milestones(get_tag_params(MILESTONE_RE.match(tag)),
+                                 self.today)
+
+    def test_cached_render_does_no_queries(self):
+        self.create_milestone(title='Kickoff')
+        html = self.render('[milestones days:7]')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render('[milestones days:7]'), html)
+
+    def test_milestone_write_invalidates(self):
+        self.render('[milestones days:7]')
+        self.create_milestone(title='Launch')
+        self.assertIn('Launch', self.render('[milestones days:7]'))
+
+    def test_tags_do_not_share_filters(self):
+        self.create_milestone(title='Launch')
+        self.render('[milestones owner:nobody]')
+        self.assertIn('Launch', self.render('[milestones days:7]'))
+
+    def test_many_tags_cost_one_query(self):
+        other = User.objects.create_user('other')
+        self.create_milestone(title='Launch')
+        self.create_milestone(title='Review', owner=other,
+                              date=self.today + datetime.timedelta(days=20))
+        tags = ['[milestones days:%d]' % days for days in range(1, 9)]
+        tags += ['[milestones owner:owner]', '[milestones owner:other]']
+        params = [get_tag_params(MILESTONE_RE.match(tag)) for tag in tags]
+        with self.assertNumQueries(1):
+            fragments = render_many(params, self.today)
+        self.assertNotIn('Review', fragments[params[0]])
+        self.assertIn('Launch', fragments[params[8]])
+        self.assertNotIn('Review', fragments[params[8]])
+        self.assertIn('Review', fragments[params[9]])
+        self.assertNotIn('Launch', fragments[params[9]])
+
+
+class ListingQueryCountTest(MilestoneTestCase):
+    """ Listings must cost a constant number of queries per render. """
+
+    def count_queries(self, func):
+        django_cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return len(context)
+
+    def assertConstantQueries(self, func):
+        self.create_milestone()
+        baseline = self.count_queries(func)
+        for i in range(5):
+            other = User.objects.create_user('user%d' % i)
+            self.create_milestone(owner=other, title='Milestone %d' % i)
+        self.assertEqual(self.count_queries(func), baseline)
+
+    def test_fragment(self):
+        self.assertConstantQueries(lambda: render_to_string(
+            'wiki/plugins/milestones/fragments/milestones.html',
+            {'milestones': models.Milestone.objects.for_listing(),
+             'display_milestone_page_title': True}))
+
+    def test_macro(self):
+        self.assertConstantQueries(lambda: render_milestones(
+            get_tag_params(MILESTONE_RE.match('[milestones]')), self.today))
+
+    def test_milestone_view(self):
+        self.client.login(username='owner', password='secret')
+        url = reverse('wiki:milestone', kwargs={'article_id': self.article.pk})
+        self.assertConstantQueries(lambda: self.client.get(url))
+
+    def test_batch_view(self):
+        self.client.login(username='owner', password='secret')
+        url = reverse('milestones_batch')
+        self.assertConstantQueries(lambda: self.client.get(url))
+
+    def test_calendar_json(self):
+        self.client.login(username='owner', password='secret')
+        url = reverse('milestones_calendar_json')
+        start = time.mktime((self.today - datetime.timedelta(days=7)).timetuple())
+        end = time.mktime((self.today + datetime.timedelta(days=7)).timetuple())
+
+        def fetch():
+            response = self.client.get(url, {'start': start, 'end': end})
+            return json.loads(''.join(response.streaming_content))
+
+        self.assertConstantQueries(fetch)
+        self.assertEqual(len(fetch()), 6)
+
+
+class ConditionalGetTest(MilestoneTestCase):
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.client.login(username='owner', password='secret')
+        self.url = reverse('milestones_calendar_json')
+        self.params = {
+            'start': time.mktime(self.today.timetuple()),
+            'end': time.mktime((self.today + datetime.timedelta(days=7)).timetuple()),
+        }
+
+    def test_calendar_not_modified(self):
+        etag = self.client.get(self.url, self.params)['ETag']
+        response = self.client.get(self.url, self.params,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_calendar_modified_after_write(self):
+        etag = self.client.get(self.url, self.params)['ETag']
+        self.create_milestone()
+        response = self.client.get(self.url, self.params,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_calendar_modified_after_batch_update(self):
+        milestone = self.create_milestone()
+        etag = self.client.get(self.url, self.params)['ETag']
+        self.client.post(reverse('milestones_batch'), {
+            'action': models.Milestone.COMPLETED_STATUS,
+            '_selected_action': [milestone.pk],
+        })
+        response = self.client.get(self.url, self.params,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+    def test_article_tab_not_modified_reads_no_milestones(self):
+        self.create_milestone()
+        url = reverse('wiki:milestone', kwargs={'article_id': self.article.pk})
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([
+            query for query in context.captured_queries
+            if '"%s"' % models.Milestone._meta.db_table in query['sql']])
+
+
+class CompactCalendarTest(MilestoneTestCase):
+    def setUp(self):
+        super(CompactCalendarTest, self).setUp()
+        self.client.login(username='owner', password='secret')
+
+    def fetch(self, start_days, end_days, **params):
+        params.update({
+            'format': 'compact',
+            'start': time.mktime((self.today + datetime.timedelta(
+                days=start_days)).timetuple()),
+            'end': time.mktime((self.today + datetime.timedelta(
+                days=end_days)).timetuple()),
+        })
+        response = self.client.get(reverse('milestones_calendar_json'),
+                                   params)
+        return json.loads(b''.join(response.streaming_content)
+                          .decode('utf-8'))
+
+    def titles(self, feed):
+        return sorted([event[1] for event in feed['events']])
+
+    def test_owners_and_articles_are_sent_once(self):
+        self.create_milestone(title='Launch')
+        self.create_milestone(title='Review',
+                              date=self.today + datetime.timedelta(days=1))
+        feed = self.fetch(-7, 7)
+        self.assertTrue(feed['full'])
+        self.assertEqual(feed['owners'], [['owner', 'OO',
+                                           colors.get_user_color(
+                                               self.user.pk)]])
+        self.assertEqual(len(feed['articles']), 1)
+        self.assertEqual([event[3:] for event in feed['events']],
+                         [[0, 0], [0, 0]])
+
+    def test_delta(self):
+        self.create_milestone(title='Launch')
+        self.create_milestone(title='Later',
+                              date=self.today + datetime.timedelta(days=10))
+        feed = self.fetch(-7, 7)
+        self.assertEqual(self.titles(feed), ['Launch'])
+
+        history.save_milestone(
+            models.Milestone(article=self.article, owner=self.user,
+                             title='Added', date=self.today),
+            self.user, '127.0.0.1', 'Added')
+        delta = self.fetch(0, 14, since=feed['version'],
+                           loaded_start=feed['window'][0],
+                           loaded_end=feed['window'][1])
+        self.assertFalse(delta['full'])
+        self.assertEqual(self.titles(delta), ['Added', 'Later'])
+        self.assertEqual(len(delta['changed']), 1)
+        self.assertTrue(delta['version'] > feed['version'])
+
+
+class AggregateCalendarTest(MilestoneTestCase):
+    def test_week_buckets(self):
+        monday = self.today - datetime.timedelta(days=self.today.weekday())
+        for days in (0, 2, 4):
+            self.create_milestone(date=monday + datetime.timedelta(days=days))
+        self.create_milestone(date=monday,
+                              status=models.Milestone.PENDING_STATUS)
+        self.create_milestone(date=monday,
+                              status=models.Milestone.CANCELLED_STATUS)
+        weekly = self.create_milestone(date=monday)
+        models.MilestoneRecurrence.objects.create(
+            milestone=weekly, frequency=recurrence.WEEKLY)
+
+        self.client.login(username='owner', password='secret')
+        response = self.client.get(reverse('milestones_calendar_json'), {
+            'group': 'week',
+            'start': time.mktime(monday.timetuple()),
+            'end': time.mktime((monday + datetime.timedelta(
+                days=13)).timetuple()),
+        })
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['owners'][0][0], 'owner')
+        next_monday = (monday + datetime.timedelta(days=7)).isoformat()
+        self.assertEqual(data['buckets'], [
+            [monday.isoformat(), 0, models.Milestone.PENDING_STATUS, 1],
+            [monday.isoformat(), 0, models.Milestone.ACTIVE_STATUS, 4],
+            [next_monday, 0, models.Milestone.ACTIVE_STATUS, 1],
+        ])
+
+    def test_range_views_request_groups(self):
+        self.client.login(username='owner', password='secret')
+        response = self.client.get(reverse('milestones_calendar'))
+        self.assertContains(response, 'data-days="91" data-group="day"')
+        self.assertContains(response, 'data-days="364" data-group="week"')
+
+
+class RangeCreateTest(MilestoneTestCase):
+    def test_bulk_insert_copies(self):
+        first = self.create_milestone(title='Standup')
+        end_date = self.today + datetime.timedelta(days=30)
+        with transaction.atomic():
+            models.Milestone.objects.bulk_insert(
+                first.get_range_copies(end_date))
+        dates = list(models.Milestone.objects.filter(title='Standup')
+                     .order_by('date').values_list('date', flat=True))
+        self.assertEqual(len(dates), 31)
+        self.assertEqual(dates[-1], end_date)
+        copy = models.Milestone.objects.get(date=end_date)
+        self.assertEqual(copy.article, self.article)
+        self.assertEqual(copy.owner, self.user)
+
+    def test_bulk_insert_queries_do_not_grow_per_day(self):
+        first = self.create_milestone(title='Standup')
+        copies = first.get_range_copies(
+            self.today + datetime.timedelta(days=365))
+        # Multi-row INSERTs, and a few queries per batch of summary
+        # buckets rather than a few per bucket.
+        with CaptureQueriesContext(connection) as context:
+            with transaction.atomic():
+                models.Milestone.objects.bulk_insert(copies)
+        self.assertLess(len(context), 40)
+        self.assertEqual(summary.get_owner_counts(self.user, self.today)
+                         ['open'], 366)
+
+
+class BatchTest(MilestoneTestCase):
+    def setUp(self):
+        super(BatchTest, self).setUp()
+        self.client.login(username='owner', password='secret')
+
+    def test_select_across_updates_filtered_milestones(self):
+        soon = self.create_milestone()
+        later = self.create_milestone(
+            date=self.today + datetime.timedelta(days=60))
+        other = self.create_milestone(owner=User.objects.create_user('other'))
+        url = '%s?end=%s' % (reverse('milestones_batch'),
+                             (self.today + datetime.timedelta(days=7)))
+        self.client.post(url, {'action': models.Milestone.COMPLETED_STATUS,
+                               'select_across': 'on'})
+        statuses = dict(models.Milestone.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[soon.pk], models.Milestone.COMPLETED_STATUS)
+        self.assertEqual(statuses[later.pk], later.status)
+        self.assertEqual(statuses[other.pk], other.status)
+
+
+class ImportTest(MilestoneTestCase):
+    def run_import(self, text, **kwargs):
+        return imports.import_milestones(io.BytesIO(text.encode('utf-8')),
+                                         self.article, self.user,
+                                         '127.0.0.1', **kwargs)
+
+    def test_import(self):
+        result = self.run_import(
+            u'title,owner,date,status,end_date\n'
+            u'Kickoff,owner,2014-03-03,pending,\n'
+            u'Sprint,owner,2014-03-04,,2014-03-06\n')
+        self.assertEqual(result.created, 4)
+        self.assertEqual(models.Milestone.objects.filter(
+            status=models.Milestone.PENDING_STATUS).count(), 1)
+        self.assertEqual(ArticleRevision.objects.filter(
+            article=self.article).count(), 2)
+
+    def test_row_errors(self):
+        text = (u'title,owner,date\n'
+                u'Kickoff,owner,2014-03-03\n'
+                u'Launch,nobody,2014-03-04\n'
+                u'Review,owner,someday\n')
+        result = self.run_import(text)
+        self.assertEqual(result.created, 0)
+        self.assertEqual([line for line, message in result.errors], [3, 4])
+        self.assertFalse(models.Milestone.objects.exists())
+        self.assertEqual(self.run_import(text, strict=False).created, 1)
+
+    def test_import_without_user(self):
+        result = imports.import_milestones(
+            io.BytesIO(b'title,owner,date\nKickoff,owner,2014-03-03\n'),
+            self.article, None, None)
+        self.assertEqual(result.created, 1)
+        self.assertEqual(self.article.current_revision.user, None)
+        self.assertEqual(models.MilestoneChange.objects.get().user, None)
+
+
+class ExportTest(MilestoneTestCase):
+    def test_rows_are_read_in_chunks(self):
+        for days in range(5):
+            self.create_milestone(
+                title='M%d' % days,
+                date=self.today + datetime.timedelta(days=days))
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(exports.iter_rows(models.Milestone.objects.all(),
+                                          chunk_size=2))
+        self.assertEqual(len(queries), 3)
+        self.assertEqual([row[1] for row in rows],
+                         ['M0', 'M1', 'M2', 'M3', 'M4'])
+        self.assertEqual(rows[0][2:8], ('owner', 'Active', self.today, None,
+                                        self.article.pk, 'Project'))
+
+    def test_export_view(self):
+        self.create_milestone(title='Soon')
+        self.create_milestone(title='Later',
+                              date=self.today + datetime.timedelta(days=60))
+        self.create_milestone(title='Done',
+                              status=models.Milestone.COMPLETED_STATUS)
+        self.client.login(username='owner', password='secret')
+        response = self.client.get(reverse('milestones_export'), {
+            'owner': 'owner', 'days': 30,
+            'status': models.Milestone.ACTIVE_STATUS})
+        content = b''.join(response.streaming_content).decode('utf-8')
+        lines = content.splitlines()
+        self.assertEqual(lines[0], ','.join(exports.HEADER))
+        self.assertEqual(len(lines), 2)
+        self.assertIn(',Soon,owner,Active,', lines[1])
+
+        # An export can be imported again.
+        result = imports.import_milestones(
+            io.BytesIO(content.encode('utf-8')), self.article, self.user,
+            '127.0.0.1')
+        self.assertEqual(result.created, 1)
+
+    def test_export_leaves_out_unreadable_articles(self):
+        private = Article.objects.create(other_read=False, other_write=False)
+        private.add_revision(ArticleRevision(title='Private'), save=True)
+        self.create_milestone(title='Layoffs', article=private,
+                              article_revision=private.current_revision)
+        self.client.login(username='owner', password='secret')
+        content = b''.join(self.client.get(
+            reverse('milestones_export')).streaming_content)
+        self.assertNotIn(b'Layoffs', content)
+
+
+class PaginationTest(MilestoneTestCase):
+    def test_pages_cover_every_row_once(self):
+        for hour in (None, 9, None, 14, 9):
+            self.create_milestone(
+                time=datetime.time(hour) if hour is not None else None)
+        self.create_milestone(date=self.today - datetime.timedelta(days=1))
+        seen = []
+        cursor = None
+        while True:
+            with self.assertNumQueries(1):
+                page, cursor = pagination.get_page(
+                    models.Milestone.objects.all(), cursor, size=2)
+            seen.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual([m.pk for m in seen],
+                         [m.pk for m in sorted(seen, key=recurrence._sort_key)])
+        self.assertEqual(len(seen), 6)
+
+    def test_view_hides_closed_milestones(self):
+        self.create_milestone(title='Launch')
+        self.create_milestone(title='Kickoff',
+                              status=models.Milestone.COMPLETED_STATUS)
+        self.client.login(username='owner', password='secret')
+        url = reverse('wiki:milestone', kwargs={'article_id': self.article.pk})
+        titles = lambda response: [m.title for m in
+                                   response.context['milestones']]
+        self.assertEqual(titles(self.client.get(url)), ['Launch'])
+        self.assertEqual(titles(self.client.get(url, {'show': 'hidden'})),
+                         ['Kickoff'])
+
+
+class ApiTest(MilestoneTestCase):
+    def setUp(self):
+        super(ApiTest, self).setUp()
+        self.client.login(username='owner', password='secret')
+
+    def test_list_follows_cursor(self):
+        for i in range(3):
+            self.create_milestone(title='Milestone %d' % i)
+        url = reverse('milestones_api_list')
+        first = json.loads(self.client.get(url, {'limit': 2}).content)
+        self.assertEqual(len(first['results']), 2)
+        second = json.loads(self.client.get(
+            url, {'limit': 2, 'after': first['next']}).content)
+        self.assertEqual(second['next'], None)
+        self.assertEqual([m['title'] for m in second['results']],
+                         ['Milestone 2'])
+
+    def test_create(self):
+        response = self.client.post(
+            reverse('milestones_api_list'),
+            json.dumps({'article': self.article.pk, 'owner': self.user.pk,
+                        'title': 'Launch', 'date': self.today.isoformat(),
+                        'status': models.Milestone.ACTIVE_STATUS}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)['title'], 'Launch')
+        self.assertEqual(models.MilestoneChange.objects.get().action,
+                         models.MilestoneChange.CREATED_ACTION)
+
+    def test_bulk_only_updates_own_milestones(self):
+        mine = self.create_milestone()
+        other = self.create_milestone(owner=User.objects.create_user('other'))
+        response = self.client.post(
+            reverse('milestones_api_bulk'),
+            json.dumps({'action': models.Milestone.COMPLETED_STATUS,
+                        'ids': [mine.pk, other.pk]}),
+            content_type='application/json')
+        self.assertEqual(json.loads(response.content), {'updated': 1})
+        self.assertEqual(models.Milestone.objects.get(pk=other.pk).status,
+                         other.status)
+
+    def test_bulk_rejects_ids_that_are_not_a_list(self):
+        response = self.client.post(
+            reverse('milestones_api_bulk'),
+            json.dumps({'action': models.Milestone.COMPLETED_STATUS,
+                        'ids': '123'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_summary_only_counts_own_milestones(self):
+        other = User.objects.create_user('other')
+        self.create_milestone(owner=other)
+        response = self.client.get(reverse('milestones_api_summary'),
+                                   {'owner': ['owner', 'other']})
+        self.assertEqual(list(json.loads(response.content)['owners']),
+                         ['owner'])
+
+    def test_list_hides_unreadable_articles(self):
+        private = Article.objects.create(other_read=False, other_write=False)
+        private.add_revision(ArticleRevision(title='Private'), save=True)
+        self.create_milestone(title='Launch')
+        self.create_milestone(title='Layoffs', article=private,
+                              article_revision=private.current_revision)
+        for url, params in ((reverse('milestones_api_list'), {}),
+                            (reverse('milestones_api_search'), {'q': 'la'})):
+            results = json.loads(self.client.get(url, params).content)
+            self.assertEqual([m['title'] for m in results['results']],
+                             ['Launch'])
+
+
+class SearchTest(MilestoneTestCase):
+    def titles(self, query):
+        return sorted([m.title for m in search.search(
+            models.Milestone.objects.all(), query)])
+
+    def test_every_word_and_last_as_prefix(self):
+        self.create_milestone(title='Release notes draft')
+        self.create_milestone(title='Release party')
+        self.assertEqual(self.titles('release'),
+                         ['Release notes draft', 'Release party'])
+        self.assertEqual(self.titles('RELEASE, not'), ['Release notes draft'])
+        self.assertEqual(self.titles('notes party'), [])
+        self.assertEqual(self.titles('!!'), [])
+
+    def test_index_follows_writes(self):
+        milestone = self.create_milestone(title='Kickoff')
+        milestone.title = 'Launch'
+        milestone.save()
+        with transaction.atomic():
+            models.Milestone.objects.bulk_insert(
+                milestone.get_range_copies(
+                    self.today + datetime.timedelta(days=1)))
+        self.assertEqual(self.titles('kick'), [])
+        self.assertEqual(self.titles('launch'), ['Launch', 'Launch'])
+        self.assertEqual(search.rebuild(), 2)
+        self.assertEqual(self.titles('launch'), ['Launch', 'Launch'])
+
+    def test_tag_and_endpoint(self):
+        self.create_milestone(title='Release notes')
+        self.create_milestone(title='Review')
+        tag = MILESTONE_RE.match('[milestones days:7 q:"Release  Notes"]')
+        params = get_tag_params(tag)
+        self.assertEqual(params[4], u'release notes')
+        html = render_milestones(params, self.today)
+        self.assertIn('Release notes', html)
+        self.assertNotIn('Review', html)
+
+        self.client.login(username='owner', password='secret')
+        url = reverse('milestones_api_search')
+        self.assertEqual(self.client.get(url).status_code, 400)
+        results = json.loads(self.client.get(url, {'q': 'rev'}).content)
+        self.assertEqual([m['title'] for m in results['results']],
+                         ['Review'])
+
+
+class RecurrenceTest(MilestoneTestCase):
+    def test_monthly_dates_clamp_to_month_end(self):
+        dates = list(recurrence.occurrence_dates(
+            datetime.date(2014, 1, 31), recurrence.MONTHLY, 1, None, None,
+            datetime.date(2014, 2, 1), datetime.date(2014, 4, 30)))
+        self.assertEqual(dates, [datetime.date(2014, 2, 28),
+                                 datetime.date(2014, 3, 31),
+                                 datetime.date(2014, 4, 30)])
+
+    def test_count_limits_series(self):
+        dates = list(recurrence.occurrence_dates(
+            datetime.date(2014, 1, 1), recurrence.WEEKLY, 2, None, 3,
+            datetime.date(2014, 1, 10), datetime.date(2014, 12, 31)))
+        self.assertEqual(dates, [datetime.date(2014, 1, 15),
+                                 datetime.date(2014, 1, 29)])
+
+    def test_daily_series_is_one_row(self):
+        standup = self.create_milestone(
+            title='Standup', date=self.today - datetime.timedelta(days=400))
+        models.MilestoneRecurrence.objects.create(
+            milestone=standup, frequency=recurrence.DAILY)
+        standup.set_occurrence_status(self.today,
+                                      models.Milestone.COMPLETED_STATUS)
+
+        milestones = recurrence.expand(
+            models.Milestone.objects.overlapping(
+                self.today, self.today + datetime.timedelta(days=6)),
+            self.today, self.today + datetime.timedelta(days=6))
+        self.assertEqual(models.Milestone.objects.count(), 1)
+        self.assertEqual(len(milestones), 7)
+        self.assertEqual(milestones[0].status,
+                         models.Milestone.COMPLETED_STATUS)
+        self.assertEqual(milestones[1].status, standup.status)
+
+
+    def test_occurrence_view_sets_one_occurrence(self):
+        standup = self.create_milestone(title='Standup')
+        models.MilestoneRecurrence.objects.create(
+            milestone=standup, frequency=recurrence.DAILY)
+        self.client.login(username='owner', password='secret')
+
+        def url(days):
+            return reverse('wiki:milestone_occurrence', kwargs={
+                'article_id': self.article.pk, 'pk': standup.pk,
+                'date': self.today + datetime.timedelta(days=days)})
+        self.client.post(url(1),
+                         {'status': models.Milestone.COMPLETED_STATUS})
+
+        occurrence = models.MilestoneOccurrence.objects.get()
+        self.assertEqual(occurrence.status, models.Milestone.COMPLETED_STATUS)
+        self.assertEqual(models.Milestone.objects.get(pk=standup.pk).status,
+                         standup.status)
+        self.assertEqual(models.MilestoneChange.objects.get().user, self.user)
+        # Before the first date there is no occurrence.
+        self.assertEqual(self.client.get(url(-1)).status_code, 404)
+
+
+class DigestTest(MilestoneTestCase):
+    def test_reruns_are_incremental(self):
+        self.create_milestone(title='Late',
+                              date=self.today - datetime.timedelta(days=1))
+        self.create_milestone(title='Soon', date=self.today + datetime.timedelta(
+            days=settings.DIGEST_DAYS_AHEAD))
+        self.create_milestone(title='Done',
+                              date=self.today - datetime.timedelta(days=1),
+                              status=models.Milestone.COMPLETED_STATUS)
+        [(owner, due, overdue)] = digest.run(today=self.today)
+        self.assertEqual([m.title for m in due], ['Soon'])
+        self.assertEqual([m.title for m in overdue], ['Late'])
+        self.assertEqual(digest.run(today=self.today), [])
+        self.assertEqual(digest.run(
+            today=self.today + datetime.timedelta(days=1)), [])
+
+    def test_milestones_moved_into_a_window_are_reported(self):
+        later = self.create_milestone(
+            title='Later', date=self.today + datetime.timedelta(days=30))
+        self.assertEqual(digest.run(today=self.today), [])
+        later.date = self.today + datetime.timedelta(days=1)
+        later.save()
+        [(owner, due, overdue)] = digest.run(today=self.today)
+        self.assertEqual([m.title for m in due], ['Later'])
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class SummaryTest(MilestoneTestCase):
+    def assertCounts(self, **expected):
+        counts = summary.get_owner_counts(self.user, self.today)
+        self.assertEqual(counts, dict(counts, **expected))
+        models.MilestoneSummary.objects.all().delete()
+        summary.rebuild()
+        self.assertEqual(summary.get_owner_counts(self.user, self.today),
+                         counts)
+
+    def test_counters_follow_writes(self):
+        late = self.create_milestone(
+            date=self.today - datetime.timedelta(days=7))
+        self.create_milestone()
+        self.assertCounts(open=2, overdue=1)
+
+        history.update_milestones(
+            models.Milestone.objects.filter(pk=late.pk), self.user,
+            '127.0.0.1', 'Completed',
+            status=models.Milestone.COMPLETED_STATUS)
+        self.assertCounts(open=1, overdue=0)
+
+        late = models.Milestone.objects.get(pk=late.pk)
+        late.deleted = True
+        late.save()
+        self.assertCounts(open=1, overdue=0, completed_this_week=0)
+
+    def test_recurring_milestones_count_per_occurrence(self):
+        monday = self.today - datetime.timedelta(days=self.today.weekday())
+        standup = self.create_milestone(
+            date=monday - datetime.timedelta(days=14))
+        models.MilestoneRecurrence.objects.create(
+            milestone=standup, frequency=recurrence.WEEKLY)
+        # Two weeks ago, last week and this week; those before today are
+        # overdue unless completed.
+        overdue = 2 if monday == self.today else 3
+        self.assertCounts(open=3, overdue=overdue, completed_this_week=0)
+
+        standup.set_occurrence_status(monday - datetime.timedelta(days=14),
+                                      models.Milestone.COMPLETED_STATUS)
+        self.assertCounts(open=2, overdue=overdue - 1)
+
+        history.update_milestones(
+            models.Milestone.objects.filter(pk=standup.pk), self.user,
+            '127.0.0.1', 'Completed',
+            status=models.Milestone.COMPLETED_STATUS)
+        self.assertCounts(open=0, overdue=0, completed_this_week=1)
+
+        models.MilestoneRecurrence.objects.filter(milestone=standup).delete()
+        self.assertCounts(open=0, overdue=0, completed_this_week=0)
+        models.Milestone.objects.get(pk=standup.pk).delete()
+        self.assertEqual(
+            models.MilestoneSummary.objects.exclude(count=0).count(), 0)
+
+    def test_article_badges_cost_two_queries(self):
+        other = Article.objects.create()
+        other.add_revision(ArticleRevision(title='Other'), save=True)
+        for days in (-2, -1, 0, 3):
+            self.create_milestone(
+                date=self.today + datetime.timedelta(days=days))
+        self.create_milestone(status=models.Milestone.COMPLETED_STATUS)
+        # The counters, and the recurring milestones of the articles.
+        with self.assertNumQueries(2):
+            articles = milestone_tags.with_milestone_counts(
+                [self.article, other])
+        self.assertEqual(articles[0].milestone_counts,
+                         {'open': 4, 'overdue': 2})
+        self.assertEqual(articles[1].milestone_counts,
+                         {'open': 0, 'overdue': 0})
+
+
+class IcalTest(MilestoneTestCase):
+    def setUp(self):
+        super(IcalTest, self).setUp()
+        self.url = reverse('milestones_ics', kwargs={
+            'token': ical.make_token(ical.OWNER_FEED, self.user.pk,
+                                     self.user)})
+
+    def fetch(self, **params):
+        response = self.client.get(self.url, params)
+        return response, ''.join(getattr(response, 'streaming_content', []))
+
+    def test_feed(self):
+        standup = self.create_milestone(title='Standup, daily',
+                                        date=datetime.date(2014, 1, 31))
+        models.MilestoneRecurrence.objects.create(
+            milestone=standup, frequency=recurrence.MONTHLY)
+        self.create_milestone(title='Launch', time=datetime.time(9, 30))
+        response, body = self.fetch()
+        self.assertIn('SUMMARY:Standup\\, daily\r\n', body)
+        self.assertIn('RRULE:FREQ=MONTHLY;BYMONTHDAY=31,-1;BYSETPOS=1\r\n',
+                      body)
+        self.assertIn('DTSTART:%s\r\n' % self.today.strftime(
+            '%Y%m%dT093000'), body)
+
+    def test_sync_token(self):
+        response, body = self.fetch()
+        response, body = self.fetch(sync=response['X-Sync-Token'])
+        self.assertEqual(response.status_code, 304)
+        self.create_milestone()
+        response, body = self.fetch(sync=response['X-Sync-Token'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_changes_bump_sequence(self):
+        launch = self.create_milestone(title='Launch')
+        self.assertIn('SEQUENCE:0\r\n', self.fetch()[1])
+        history.update_milestones(
+            models.Milestone.objects.filter(pk=launch.pk), self.user,
+            '127.0.0.1', 'Moved', date=self.today + datetime.timedelta(days=1))
+        change = models.MilestoneChange.objects.get(milestone=launch)
+        body = self.fetch()[1]
+        self.assertIn('SEQUENCE:1\r\n', body)
+        self.assertIn('LAST-MODIFIED:%s\r\n' % ical.format_stamp(
+            change.created), body)
+
+    def test_feed_leaves_out_unreadable_articles(self):
+        private = Article.objects.create(other_read=False, other_write=False)
+        private.add_revision(ArticleRevision(title='Private'), save=True)
+        self.create_milestone(title='Launch')
+        self.create_milestone(title='Layoffs', article=private,
+                              article_revision=private.current_revision)
+        body = self.fetch()[1]
+        self.assertIn('SUMMARY:Launch\r\n', body)
+        self.assertNotIn('Layoffs', body)
+
+    def test_forged_token(self):
+        self.url = reverse('milestones_ics', kwargs={
+            'token': 'owner.%d.%d:forged' % (self.user.pk, self.user.pk)})
+        self.assertEqual(self.fetch()[0].status_code, 404)
+
+
+class ColorTest(MilestoneTestCase):
+    def test_colors_are_stable(self):
+        color = colors.get_user_color(self.user.pk)
+        User.objects.create_user('aaron')
+        self.assertEqual(colors.get_user_color(self.user.pk), color)
+
+    def test_calendar_users_invalidated_on_user_change(self):
+        self.assertEqual(len(colors.get_calendar_users()), 1)
+        User.objects.create_user('newcomer')
+        with self.assertNumQueries(1):
+            self.assertEqual(len(colors.get_calendar_users()), 2)
+
+
+class StatsTest(MilestoneTestCase):
+    def setUp(self):
+        super(StatsTest, self).setUp()
+        self.original = settings.STATS_ENABLED, settings.STATS_BACKEND
+        settings.STATS_ENABLED = True
+        settings.STATS_BACKEND = 'milestones.stats.MemoryBackend'
+        self.backend = stats.get_backend()
+        self.backend.reset()
+
+    def tearDown(self):
+        settings.STATS_ENABLED, settings.STATS_BACKEND = self.original
+        super(StatsTest, self).tearDown()
+
+    def measurements(self, name):
+        return [m for m in self.backend.measurements if m.name == name]
+
+    def test_tags_are_measured(self):
+        self.create_milestone(title='Launch')
+        self.create_milestone(title='Review',
+                              date=self.today + datetime.timedelta(days=20))
+        received = []
+
+        def receiver(sender, measurement, **kwargs):
+            received.append(measurement)
+        signals.measured.connect(receiver)
+        try:
+            with stats.measure('macro') as macro:
+                render_many([(None, 7, None, None, None),
+                             (None, 30, None, None, None)],
+                            self.today)
+        finally:
+            signals.measured.disconnect(receiver)
+
+        tags = dict((m.label, m) for m in self.measurements('macro.tag'))
+        self.assertEqual(tags['days:7'].rows, 1)
+        self.assertEqual(tags['days:30'].rows, 2)
+        self.assertEqual(macro.rows, 3)
+        self.assertEqual(macro.queries, 1)
+        self.assertTrue(macro.render_time > 0)
+        self.assertEqual(received[-1], macro)
+
+    def test_turned_off(self):
+        settings.STATS_ENABLED = False
+        debug_cursor = connection.use_debug_cursor
+        with stats.measure('macro'):
+            self.assertEqual(connection.use_debug_cursor, debug_cursor)
+            render_many([(None, 7, None, None, None)], self.today)
+        self.client.login(username='owner', password='secret')
+        self.client.get(reverse('milestones_batch'))
+        self.assertEqual(list(self.backend.measurements), [])
+
+    def test_batch_view_is_measured(self):
+        self.create_milestone()
+        self.client.login(username='owner', password='secret')
+        self.client.get(reverse('milestones_batch'))
+        measurement = self.measurements('view.batch')[-1]
+        self.assertEqual(measurement.rows, 1)
+        self.assertTrue(measurement.queries > 0)
+        self.assertTrue(measurement.duration >= measurement.db_time)
+
+
+class BenchmarkTest(TestCase):
+    def test_small_run(self):
+        run = benchmarks.run(['batch', 'calendar', 'macro', 'view'],
+                             users=2, articles=2, milestones=200)
+        json.dumps(run)
+        self.assertEqual(run['meta']['milestones'], 200)
+        self.assertIn('calendar_365_days', run['results'])
+        self.assertEqual(run['results']['macro_warm_queries'], 0)
+        self.assertFalse(models.Milestone.objects.exists())
+        self.assertNotIn('Benchmark', render_milestones(
+            get_tag_params(MILESTONE_RE.match('[milestones days:7]')),
+            datetime.date.today()))
+
+
+class RevisionModeTest(MilestoneTestCase):
+    def save(self):
+        history.save_milestone(
+            models.Milestone(article=self.article, owner=self.user,
+                             title='Launch', date=self.today),
+            self.user, '127.0.0.1', 'Milestone created')
+
+    def test_article_mode_adds_revision(self):
+        self.save()
+        self.assertEqual(ArticleRevision.objects.filter(
+            article=self.article).count(), 2)
+
+    def test_history_mode_adds_change(self):
+        original_mode = settings.REVISION_MODE
+        settings.REVISION_MODE = settings.REVISION_MODE_HISTORY
+        try:
+            self.save()
+        finally:
+            settings.REVISION_MODE = original_mode
+        self.assertEqual(ArticleRevision.objects.filter(
+            article=self.article).count(), 1)
+        self.assertEqual(models.MilestoneChange.objects.get().message,
+                         'Milestone created')
+
+
+class ChangeHistoryTest(MilestoneTestCase):
+    def test_edit_records_field_diff(self):
+        milestone = self.create_milestone()
+        milestone.date = self.today + datetime.timedelta(days=3)
+        history.save_milestone(milestone, self.user, '127.0.0.1', 'Moved')
+        change = milestone.changes.get()
+        self.assertEqual(change.action, models.MilestoneChange.UPDATED_ACTION)
+        self.assertEqual(change.get_changes(), {
+            'date': [self.today.isoformat(), milestone.date.isoformat()]})
+
+    def test_history_outlives_milestone(self):
+        milestone = self.create_milestone()
+        history.save_milestone(milestone, self.user, '127.0.0.1', 'Edited')
+        pk = milestone.pk
+        version = history.latest_change()
+        milestone.delete()
+        changes = models.MilestoneChange.objects.filter(milestone_id=pk)
+        self.assertEqual(changes.count(), 2)
+        self.assertEqual(changes.latest('pk').action,
+                         models.MilestoneChange.DELETED_ACTION)
+        self.assertIn(pk, history.changed_since(version))
+
+    def test_changed_since_includes_changes_within_margin(self):
+        early, late, old = [self.create_milestone() for i in range(3)]
+        for milestone in (old, early, late):
+            history.save_milestone(milestone, self.user, '127.0.0.1', 'Edit')
+        changes = models.MilestoneChange.objects.order_by('pk')
+        changes.filter(milestone_id=old.pk).update(
+            created=changes.get(milestone_id=late.pk).created -
+            datetime.timedelta(seconds=settings.CALENDAR_DELTA_MARGIN + 1))
+        # ``early`` committed after ``late``, within the margin.
+        self.assertEqual(history.changed_since(history.latest_change()),
+                         set([early.pk, late.pk]))
+        self.assertEqual(history.changed_since(history.latest_change() + 1),
+                         None)
+
+    def test_bulk_update_skips_rows_reassigned_before_lock(self):
+        milestone = self.create_milestone()
+        other = User.objects.create_user('other')
+        original_lock = history._lock
+
+        def reassign_then_lock(queryset, pks):
+            models.Milestone.objects.filter(pk=milestone.pk).update(
+                owner=other)
+            original_lock(queryset, pks)
+        history._lock = reassign_then_lock
+        try:
+            updated = history.update_milestones(
+                models.Milestone.objects.filter(owner=self.user), self.user,
+                '127.0.0.1', 'Completed',
+                status=models.Milestone.COMPLETED_STATUS)
+        finally:
+            history._lock = original_lock
+        self.assertEqual(updated, 0)
+        self.assertEqual(models.Milestone.objects.get(pk=milestone.pk).status,
+                         milestone.status)
+        self.assertFalse(models.MilestoneChange.objects.exists())
+
+    def test_bulk_update_records_one_insert(self):
+        for i in range(3):
+            self.create_milestone()
+        with CaptureQueriesContext(connection) as context:
+            history.update_milestones(
+                models.Milestone.objects.all(), self.user, '127.0.0.1',
+                'Completed', status=models.Milestone.COMPLETED_STATUS)
+        self.assertEqual(len([
+            query for query in context.captured_queries
+            if query['sql'].startswith('INSERT') and
+            models.MilestoneChange._meta.db_table in query['sql']]), 1)
+        self.assertEqual(models.MilestoneChange.objects.filter(
+            action=models.MilestoneChange.UPDATED_ACTION).count(), 3)
@@ -1,7 +1,23 @@
-from django.conf.urls.defaults import patterns, url
+from django.conf.urls import patterns, url
 
 urlpatterns = patterns('milestones.views',
     url(r'^batch/$', 'milestones_batch', name='milestones_batch'),
+    url(r'^export/$', 'milestones_export', name='milestones_export'),
     url(r'^calendar/$', 'milestones_calendar', name='milestones_calendar'),
     url(r'^calendar/json/$', 'milestones_calendar_json', name='milestones_calendar_json'),
+    url(r'^calendar/(?P<token>[-\w.:]+)\.ics$', 'milestones_ics', name='milestones_ics'),
+)
+
+urlpatterns += patterns('milestones.api',
+    url(r'^api/milestones/$', 'milestone_list', name='milestones_api_list'),
+    url(r'^api/milestones/bulk/$', 'milestone_bulk',
+        name='milestones_api_bulk'),
+    url(r'^api/milestones/search/$', 'milestone_search',
+        name='milestones_api_search'),
+    url(r'^api/milestones/(?P<pk>\d+)/$', 'milestone_detail',
+        name='milestones_api_detail'),
+    url(r'^api/milestones/(?P<pk>\d+)/occurrences/'
+        r'(?P<date>\d{4}-\d{2}-\d{2})/$', 'milestone_occurrence',
+        name='milestones_api_occurrence'),
+    url(r'^api/summary/$', 'milestone_summary', name='milestones_api_summary'),
 )
@@ -1,36 +1,144 @@
 import datetime
+import json
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.db.models import Q
-from django.http import HttpResponse
-from django.template.loader import render_to_string
+from django.core.urlresolvers import reverse
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseNotModified, StreamingHttpResponse)
+from django.utils.dateparse import parse_date
+from django.utils.http import urlencode
 from django.shortcuts import redirect, render, get_object_or_404
-from django.utils.translation import ugettext as _
+from django.utils.translation import ugettext as _, ugettext_lazy
 from django.utils.decorators import method_decorator
 from django.views.generic.edit import FormView
 
 from wiki.decorators import get_article, response_forbidden
-from wiki.models.article import ArticleRevision
+from wiki.models import Article
 from wiki.models.urlpath import URLPath
 from wiki.views.mixins import ArticleMixin
-from milestones import models, settings, forms
+from milestones import (cache, colors, conditional, exports, forms, history,
+                        ical, imports, models, pagination, recurrence,
+                        serializers, settings, stats)
+
+
+def _get_date(request, name):
+    try:
+        return parse_date(request.GET.get(name) or '')
+    except ValueError:
+        return None
+
+
+class MilestoneListMixin(object):
+    """
+    Loads one page of the article's milestones. The ``show`` parameter
+    picks the open (default), hidden or all milestones, ``start`` and
+    ``end`` restrict them to a date window and ``after`` is the cursor of
+    the page to show. The page is only read when the listing is rendered,
+    so a conditional GET answered with a 304 costs no milestone query.
+    """
+    SHOW_OPEN = 'open'
+    SHOW_HIDDEN = 'hidden'
+    SHOW_ALL = 'all'
+    # Labels are translated in the template.
+    SHOW_CHOICES = (
+        (SHOW_OPEN, u'Open'),
+        (SHOW_HIDDEN, u'Hidden'),
+        (SHOW_ALL, u'All'),
+    )
+
+    def get_listing_filters(self, request):
+        show = request.GET.get('show')
+        if show not in dict(self.SHOW_CHOICES):
+            show = self.SHOW_OPEN
+        return {
+            'show': show,
+            'start': _get_date(request, 'start'),
+            'end': _get_date(request, 'end'),
+        }
+
+    def load_milestones(self, request, article):
+        filters = self.listing_filters = self.get_listing_filters(request)
+        milestones = models.Milestone.objects.for_listing().filter(
+            article=article)
+        today = datetime.date.today()
+        if filters['show'] == self.SHOW_OPEN:
+            milestones = milestones.visible(today)
+        elif filters['show'] == self.SHOW_HIDDEN:
+            milestones = milestones.hidden(today)
+        if filters['start'] or filters['end']:
+            milestones = milestones.overlapping(filters['start'],
+                                                filters['end'])
+        self.milestones, self.next_cursor = pagination.get_page(
+            milestones, request.GET.get('after'))
+        stats.add_rows(len(self.milestones))
+
+    def get_listing_url(self, **changes):
+        params = dict((key, value) for key, value in
+                      self.listing_filters.items() if value)
+        params.update(changes)
+        return '?' + urlencode(params)
+
+    def get_listing_context(self):
+        self.load_milestones(self.request, self.article)
+        filters = self.listing_filters
+        next_url = None
+        if self.next_cursor:
+            next_url = self.get_listing_url(after=self.next_cursor)
+        return {
+            'milestones': recurrence.expand(self.milestones),
+            'listing_filters': filters,
+            'show_choices': [
+                (value, label, self.get_listing_url(show=value))
+                for value, label in self.SHOW_CHOICES],
+            'first_page_url': (self.get_listing_url()
+                               if self.request.GET.get('after') else None),
+            'next_page_url': next_url,
+        }
 
 
-class MilestoneView(ArticleMixin, FormView):
+class MilestoneView(MilestoneListMixin, ArticleMixin, FormView):
     form_class = forms.MilestoneForm
     template_name = "wiki/plugins/milestones/index.html"
 
+    @method_decorator(stats.measured('view.milestones'))
     @method_decorator(get_article(can_write=True))
     def dispatch(self, request, article, *args, **kwargs):
-        self.milestones = models.Milestone.objects.filter(
-            article=article).order_by('date', 'time')
         # Fixing some weird transaction issue caused by adding
         # commit_manually to form_valid
         return super(MilestoneView, self).dispatch(request, article,
                                                    *args, **kwargs)
 
+    def get_validators(self):
+        """
+        The page shows the article's milestones plus per-user state (the
+        form's initial owner, the CSRF token, write permission), so its
+        validators combine the article scope with those.
+        """
+        return cache.get_validators(
+            [cache.article_scope(self.article.pk)],
+            self.request.get_full_path(),
+            self.request.user.pk,
+            self.request.META.get('CSRF_COOKIE'),
+            self.article.current_revision_id,
+            self.article.can_write(self.request.user),
+        )
+
+    def get(self, request, *args, **kwargs):
+        # Pending flash messages are part of the page, never answer 304.
+        if len(messages.get_messages(request)):
+            return super(MilestoneView, self).get(request, *args, **kwargs)
+
+        etag, last_modified = self.get_validators()
+        response = conditional.not_modified(request, etag, last_modified,
+                                            private=True)
+        if response:
+            return response
+        response = super(MilestoneView, self).get(request, *args, **kwargs)
+        return conditional.set_validators(response, etag, last_modified,
+                                          private=True)
+
     def get_automatic_log(self, milestone):
         name = self.request.user.get_full_name()
         if not milestone.pk:
@@ -44,45 +152,9 @@ class MilestoneView(ArticleMixin, FormView):
             self.article.current_revision.locked):
             return response_forbidden(self.request, self.article, self.urlpath)
 
-        # Get client IP
-        x_forwarded_for = self.request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip_address = x_forwarded_for.split(',')[-1].strip()
-        else:
-            ip_address = self.request.META.get('REMOTE_ADDR')
-
-        milestone = form.save(commit=False)
-        new_revision = ArticleRevision()
-        new_revision.inherit_predecessor(milestone.article)
-        new_revision.automatic_log = self.get_automatic_log(milestone)
-        new_revision.user = self.request.user
-        new_revision.ip_address = ip_address
-        self.article.add_revision(new_revision)
-        milestone.article_revision = self.article.current_revision
-        milestone.save()
-        form.save_m2m()
-
-        num_copy_day_increment = 1
-        start_count = 0
-        num_copy = 0
-        if form.cleaned_data.get('end_date'):
-            num_copy_delta = form.cleaned_data.get('end_date') - form.cleaned_data.get('date')
-            num_copy = abs(num_copy_delta.days)
-
-        if num_copy:
-            orig_milestone = models.Milestone.objects.get(pk=milestone.pk)
-            while start_count < num_copy:
-                start_count += 1
-                day_increment = num_copy_day_increment * start_count
-                new_date = orig_milestone.date + datetime.timedelta(days=day_increment)
-                models.Milestone.objects.create(
-                    article=orig_milestone.article,
-                    article_revision=orig_milestone.article_revision,
-                    owner=orig_milestone.owner,
-                    title=orig_milestone.title,
-                    status=orig_milestone.status,
-                    date=new_date,
-                )
+        milestone = history.save_form(
+            form, self.request.user, history.get_ip_address(self.request),
+            self.get_automatic_log(form.instance))
 
         if isinstance(milestone, list):
             messages.success(self.request, _(u'Successfully added: %s') % (", ".join([m.title for m in milestone])))
@@ -108,11 +180,11 @@ class MilestoneView(ArticleMixin, FormView):
     def get_context_data(self, **kwargs):
         kwargs['selected_tab'] = 'milestones'
         kwargs['anonymous_disallowed'] = self.request.user.is_anonymous() and not settings.ANONYMOUS
-        kwargs['milestones'] = self.milestones
+        kwargs.update(self.get_listing_context())
         return super(MilestoneView, self).get_context_data(**kwargs)
 
 
-class MilestoneEditView(ArticleMixin, FormView):
+class MilestoneEditView(MilestoneListMixin, ArticleMixin, FormView):
     form_class = forms.MilestoneEditForm
     template_name = "wiki/plugins/milestones/index.html"
 
@@ -120,8 +192,6 @@ class MilestoneEditView(ArticleMixin, FormView):
     def dispatch(self, request, article, *args, **kwargs):
         self.milestone = get_object_or_404(models.Milestone, pk=kwargs.get('pk'),
             article=article)
-        self.milestones = models.Milestone.objects.filter(
-            article=article).order_by('date', 'time')
 
         # Fixing some weird transaction issue caused by adding
         # commit_manually to form_valid
@@ -144,23 +214,9 @@ class MilestoneEditView(ArticleMixin, FormView):
             self.article.current_revision.locked):
             return response_forbidden(self.request, self.article, self.urlpath)
 
-        # Get client IP
-        x_forwarded_for = self.request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip_address = x_forwarded_for.split(',')[-1].strip()
-        else:
-            ip_address = self.request.META.get('REMOTE_ADDR')
-
-        milestone = form.save(commit=False)
-        new_revision = ArticleRevision()
-        new_revision.inherit_predecessor(milestone.article)
-        new_revision.automatic_log = self.get_automatic_log(milestone)
-        new_revision.user = self.request.user
-        new_revision.ip_address = ip_address
-        self.article.add_revision(new_revision)
-        milestone.article_revision = self.article.current_revision
-        milestone.save()
-        form.save_m2m()
+        milestone = history.save_form(
+            form, self.request.user, history.get_ip_address(self.request),
+            self.get_automatic_log(form.instance))
 
         if isinstance(milestone, list):
             messages.success(self.request, _(u'Successfully updated: %s') % (", ".join([m.title for m in milestone])))
@@ -184,106 +240,342 @@ class MilestoneEditView(ArticleMixin, FormView):
     def get_context_data(self, **kwargs):
         kwargs['selected_tab'] = 'milestones'
         kwargs['anonymous_disallowed'] = self.request.user.is_anonymous() and not settings.ANONYMOUS
-        kwargs['milestones'] = self.milestones
+        kwargs.update(self.get_listing_context())
         return super(MilestoneEditView, self).get_context_data(**kwargs)
 
 
+class MilestoneOccurrenceView(ArticleMixin, FormView):
+    """
+    Set the status of one occurrence of a recurring milestone, e.g. to
+    complete one standup without completing the series.
+    """
+    form_class = forms.MilestoneOccurrenceForm
+    template_name = "wiki/plugins/milestones/occurrence.html"
+
+    @method_decorator(get_article(can_write=True))
+    def dispatch(self, request, article, *args, **kwargs):
+        self.milestone = get_object_or_404(models.Milestone,
+                                           pk=kwargs.get('pk'),
+                                           article=article, deleted=False)
+        try:
+            self.date = parse_date(kwargs.get('date'))
+        except ValueError:
+            self.date = None
+        if self.date is None or not self.milestone.has_occurrence(self.date):
+            raise Http404
+        return super(MilestoneOccurrenceView, self).dispatch(
+            request, article, *args, **kwargs)
+
+    def get_initial(self):
+        return {'status': self.milestone.get_occurrence_status(self.date)}
+
+    def form_valid(self, form):
+        if (self.request.user.is_anonymous() and not settings.ANONYMOUS or
+            not self.article.can_write(self.request.user) or
+            self.article.current_revision.locked):
+            return response_forbidden(self.request, self.article, self.urlpath)
+
+        history.save_occurrence_status(
+            self.milestone, self.date, form.cleaned_data['status'],
+            self.request.user, history.get_ip_address(self.request))
+        messages.success(self.request, _(u'%s on %s was updated.') % (
+            self.milestone.title, self.date.isoformat()))
+        return redirect('wiki:milestone', article_id=self.article.pk)
+
+    def get_context_data(self, **kwargs):
+        kwargs['selected_tab'] = 'milestones'
+        kwargs['milestone'] = self.milestone
+        kwargs['occurrence_date'] = self.date
+        return super(MilestoneOccurrenceView, self).get_context_data(**kwargs)
+
+
+class MilestoneImportView(ArticleMixin, FormView):
+    form_class = forms.MilestoneImportForm
+    template_name = "wiki/plugins/milestones/import.html"
+
+    @method_decorator(get_article(can_write=True))
+    def dispatch(self, request, article, *args, **kwargs):
+        return super(MilestoneImportView, self).dispatch(request, article,
+                                                         *args, **kwargs)
+
+    def form_valid(self, form):
+        if (self.request.user.is_anonymous() and not settings.ANONYMOUS or
+            not self.article.can_write(self.request.user) or
+            self.article.current_revision.locked):
+            return response_forbidden(self.request, self.article, self.urlpath)
+
+        try:
+            result = imports.import_milestones(
+                form.cleaned_data['file'], self.article, self.request.user,
+                history.get_ip_address(self.request))
+        except (imports.ImportFileError, UnicodeDecodeError) as e:
+            form.errors['file'] = form.error_class([u'%s' % e])
+            return self.form_invalid(form)
+
+        if result.error_count:
+            return self.render_to_response(self.get_context_data(
+                form=form, result=result))
+        messages.success(self.request, _(u'%d milestones were imported.') %
+                         result.created)
+        return redirect('wiki:milestone', article_id=self.article.pk)
+
+    def get_context_data(self, **kwargs):
+        kwargs['selected_tab'] = 'milestones'
+        return super(MilestoneImportView, self).get_context_data(**kwargs)
+
+
 @login_required
+@stats.measured('view.batch')
 def milestones_batch(request):
-    form = forms.MilestonesBatchForm(user=request.user)
-    milestones = models.Milestone.objects.filter(
-        Q(status=models.Milestone.PENDING_STATUS) |
-        Q(status=models.Milestone.ACTIVE_STATUS),
-        owner=request.user,
-        deleted=False,
-    ).order_by('date', 'time')
+    """
+    List the user's milestones, one page at a time and filtered by
+    MilestonesBatchFilterForm, and apply batch actions to them. The action
+    updates the selected milestones, or with ``select_across`` all those
+    matching the filters, in one UPDATE restricted to the user's own
+    milestones.
+    """
+    filter_form = forms.MilestonesBatchFilterForm(request.GET)
+    milestones = models.Milestone.objects.filter(owner=request.user,
+                                                 deleted=False)
+    if filter_form.is_valid():
+        milestones = filter_form.filter(milestones)
+    else:
+        milestones = milestones.none()
 
+    form = forms.MilestonesBatchForm(user=request.user)
     if request.method == 'POST':
         form = forms.MilestonesBatchForm(request.POST, user=request.user)
         if form.is_valid():
-            selected = request.POST.getlist('_selected_action')
-            m = models.Milestone.objects.filter(
-                ~Q(owner=request.user),
-                pk__in=selected,
-            )
-            if m.count():
-                messages.error(request, u'Milestone ownership error. You are not currently the owner of all submitted milestones.')
+            selected = milestones
+            if not form.cleaned_data['select_across']:
+                selected = models.Milestone.objects.filter(
+                    owner=request.user,
+                    pk__in=request.POST.getlist('_selected_action'))
+            updated = history.batch_update(
+                selected, request.user, history.get_ip_address(request),
+                form.cleaned_data['action'])
+            if form.cleaned_data['action'] == history.DELETE_ACTION:
+                messages.success(request, _(u'%d milestones deleted.') %
+                                 updated)
             else:
-                selected_milestones = models.Milestone.objects.filter(
-                    id__in=selected
-                )
-                if form.cleaned_data['action'] == 'delete_action':
-                    selected_milestones.update(deleted=True)
-                    messages.success(request, u'Milestones deleted')
-                else:
-                    selected_milestones.update(status=int(form.cleaned_data['action']))
-                    messages.success(request, u'Milestones updated')
-            return redirect(request.path)
-
-    dict_context = {'form': form, 'milestones': milestones}
+                messages.success(request, _(u'%d milestones updated.') %
+                                 updated)
+            return redirect(request.get_full_path())
+
+    page, cursor = pagination.get_page(milestones.for_listing(),
+                                       request.GET.get('after'))
+    stats.add_rows(len(page))
+    params = request.GET.copy()
+    params.pop('after', None)
+    next_url = None
+    if cursor:
+        params['after'] = cursor
+        next_url = '?' + params.urlencode()
+        del params['after']
+
+    dict_context = {
+        'form': form,
+        'filter_form': filter_form,
+        'milestones': page,
+        'filter_query': params.urlencode(),
+        'first_page_url': ('?' + params.urlencode()
+                           if request.GET.get('after') else None),
+        'next_page_url': next_url,
+    }
 
     return render(request, 'milestones/batch.html', dict_context)
 
 
-def get_color_dict():
-    color_dict = {}
-    colors = ['#555555', '#cccccc', '#56a83c', '#a73111', '#10845a', '#003366',
-              '#511000', '#0000ff', '#336699', '#918010', '#9999ff', '#99ccff',
-              '#cc0000', '#6699cc', '#123456', '#906090', '#ff6600', '#ff8d8d',
-              '#ff9900', '#82cccd', '#3b5998', '#0066cc', '#00dd00', '#00cbcd',
-              '#9999cc', '#333366', '#006600', '#9c00ff', '#d900dc', '#dc8c00',
-              '#4cc6ff', '#9c4cff', '#bf5b5b', '#bfb95b', '#9dbf5b', '#640005']
-    user_qs = User.objects.filter(is_active=True,
-                                  is_staff=False).order_by('first_name')
-    for user in user_qs:
-        try:
-            color_dict[user.pk] = colors.pop()
-        except IndexError:
-            color_dict[user.pk] = '#cccccc'
-
-    return color_dict
+@login_required
+def milestones_export(request):
+    """
+    Stream the milestones matching MilestonesExportForm as a CSV or XLSX
+    download, across all the articles the user may read unless one is
+    given.
+    """
+    form = forms.MilestonesExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text(),
+                                      content_type='text/plain')
+    article_id = form.cleaned_data['article']
+    if article_id is not None:
+        article = get_object_or_404(Article, pk=article_id)
+        if not article.can_read(request.user):
+            raise Http404
+
+    today = datetime.date.today()
+    format = form.cleaned_data['format']
+    milestones = form.filter(
+        models.Milestone.objects.readable_by(request.user), today)
+    response = StreamingHttpResponse(exports.iter_export(milestones, format),
+                                     content_type=exports.CONTENT_TYPES[format])
+    response['Content-Disposition'] = 'attachment; filename="%s"' % (
+        exports.get_filename(format, today))
+    return response
+
+
+# Views beyond FullCalendar's month: (name, label, days). Their ranges are
+# long enough to be shown as counts, see serializers.get_group().
+CALENDAR_RANGE_VIEWS = (
+    ('quarter', ugettext_lazy(u'quarter'), 91),
+    ('year', ugettext_lazy(u'year'), 364),
+)
 
 
 @login_required
 def milestones_calendar(request):
-    users = []
-    user_qs = User.objects.filter(is_active=True,
-                                  is_staff=False).order_by('first_name')
-    color_dict = get_color_dict()
-
-    for user in user_qs:
-        user.color = color_dict[user.pk]
-        users.append(user)
-
+    users = colors.get_calendar_users()
     article_pk = request.GET.get('apk', '')
 
-    dict_context = {'users': users, 'article_pk': article_pk}
+    feeds = [(_(u'My milestones'), ical.make_token(
+        ical.OWNER_FEED, request.user.pk, request.user))]
+    if article_pk.isdigit():
+        feeds.append((_(u'Milestones of this article'), ical.make_token(
+            ical.ARTICLE_FEED, article_pk, request.user)))
+    feed_urls = [(label, request.build_absolute_uri(
+        reverse('milestones_ics', kwargs={'token': token})))
+        for label, token in feeds]
+
+    dict_context = {
+        'users': users,
+        'article_pk': article_pk,
+        'feed_urls': feed_urls,
+        'range_views': [(name, label, days, serializers.get_group(days))
+                        for name, label, days in CALENDAR_RANGE_VIEWS],
+        'status_names': json.dumps(dict(models.Milestone.STATUS_CHOICES)),
+    }
     return render(request, 'milestones/calendar.html', dict_context)
 
 
 @login_required
+@stats.measured('view.calendar_json')
 def milestones_calendar_json(request):
-    color_dict = get_color_dict()
     start_date = datetime.datetime.fromtimestamp(
         float(request.GET.get('start', 0.0))
-    )
+    ).date()
     end_date = datetime.datetime.fromtimestamp(
         float(request.GET.get('end', 0.0))
-    )
-    milestone_qs = (models.Milestone.objects.select_related()
-                    .exclude(Q(status=models.Milestone.CANCELLED_STATUS) | Q(deleted=True))
-                    .filter(date__gte=start_date, date__lte=end_date))
+    ).date()
+    milestone_qs = models.Milestone.objects.in_window(start_date, end_date)
 
     article_pk = request.GET.get('apk')
     if article_pk:
         milestone_qs = milestone_qs.filter(article__pk=article_pk)
-
-    milestones = []
-    for milestone in milestone_qs:
-        milestone.color = color_dict[milestone.owner.pk]
-        milestones.append(milestone)
-
-    dict_context = {'milestones': milestones}
-    calendar_event_json = render_to_string('milestones/calendar.json',
-                                           dict_context)
-    return HttpResponse(calendar_event_json, mimetype="application/json")
+        scope = cache.article_scope(article_pk)
+    else:
+        scope = cache.GLOBAL
+
+    compact = request.GET.get('format') == COMPACT_FORMAT
+    group = request.GET.get('group')
+    if group not in serializers.GROUPS:
+        group = None
+    etag, last_modified = cache.get_validators(
+        [scope], start_date, end_date, compact, group,
+        request.GET.get('since'), request.GET.get('loaded_start'),
+        request.GET.get('loaded_end'))
+    response = conditional.not_modified(request, etag, last_modified)
+    if response:
+        return response
+
+    if group:
+        # Counts instead of events, for long ranges.
+        buckets = serializers.calendar_buckets(milestone_qs, start_date,
+                                               end_date, group)
+        stats.add_rows(len(buckets['buckets']))
+        response = HttpResponse(json.dumps(buckets),
+                                content_type='application/json')
+        return conditional.set_validators(response, etag, last_modified)
+    if compact:
+        content = compact_calendar(request, milestone_qs, start_date,
+                                   end_date, article_pk)
+    else:
+        events = stats.count_rows(
+            serializers.calendar_events(milestone_qs, start_date, end_date))
+        content = serializers.iter_json_list(events)
+    response = StreamingHttpResponse(content,
+                                     content_type='application/json')
+    return conditional.set_validators(response, etag, last_modified)
+
+
+COMPACT_FORMAT = 'compact'
+
+
+def compact_calendar(request, milestones, start_date, end_date, article_pk):
+    """
+    Return the compact calendar feed, see
+    serializers.iter_compact_calendar(). A client holding the events dated
+    between ``loaded_start`` and ``loaded_end`` as of version ``since``
+    gets only the events it lacks: those outside that window and those of
+    milestones changed since. Without those parameters, or when too many
+    milestones changed, all events are sent.
+    """
+    version = history.latest_change()
+    since = request.GET.get('since', '')
+    loaded = (_get_date(request, 'loaded_start'),
+              _get_date(request, 'loaded_end'))
+    changed = None
+    if since.isdigit() and int(since) <= version and all(loaded):
+        article_id = None
+        if article_pk and article_pk.isdigit():
+            article_id = int(article_pk)
+        changed = history.changed_since(int(since), article_id,
+                                        limit=settings.BULK_BATCH_SIZE)
+    if changed is None:
+        loaded = None
+    return serializers.iter_compact_calendar(milestones, start_date,
+                                             end_date, version, loaded,
+                                             changed)
+
+
+def milestones_ics(request, token):
+    """
+    Stream the iCalendar feed named by a token from ical.make_token().
+    Polling clients get a 304 through the usual validators, or, for
+    clients that cannot send them, when the ``sync`` parameter is the
+    X-Sync-Token of a previous response and nothing changed since. Either
+    way no milestone is read. ``todo=1`` turns open and completed milestones
+    into VTODOs.
+    """
+    feed = ical.read_token(token)
+    if feed is None:
+        raise Http404
+    kind, pk, user_id = feed
+    user = User.objects.filter(pk=user_id, is_active=True).first()
+    if user is None:
+        raise Http404
+
+    # Owner feeds span articles too, some of which the user may no longer
+    # be allowed to read.
+    milestones = (models.Milestone.objects.readable_by(user)
+                  .filter(deleted=False).overlapping(
+                      datetime.date.today() -
+                      datetime.timedelta(days=settings.ICAL_DAYS_BEHIND),
+                      None))
+    if kind == ical.OWNER_FEED and pk == user.pk:
+        milestones = milestones.filter(owner_id=pk)
+        scope = cache.owner_scope(pk)
+        name = user.get_full_name() or user.username
+    elif kind == ical.ARTICLE_FEED:
+        article = get_object_or_404(Article, pk=pk)
+        if not article.can_read(user):
+            raise Http404
+        milestones = milestones.filter(article_id=pk)
+        scope = cache.article_scope(pk)
+        name = article.current_revision.title
+    else:
+        raise Http404
+
+    todo = request.GET.get('todo') == '1'
+    etag, last_modified = cache.get_validators([scope], token, todo,
+                                               datetime.date.today())
+    response = conditional.not_modified(request, etag, last_modified)
+    if response is None and request.GET.get('sync') == etag:
+        response = conditional.set_validators(
+            HttpResponseNotModified(), etag, last_modified)
+    if response is None:
+        response = StreamingHttpResponse(
+            ical.iter_calendar(milestones, name, request.get_host(), todo),
+            content_type='text/calendar; charset=utf-8')
+        response = conditional.set_validators(response, etag, last_modified)
+    response['X-Sync-Token'] = etag
+    return response
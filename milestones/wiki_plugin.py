@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from django.conf.urls.defaults import patterns, url
+from django.conf.urls import patterns, url
 from django.utils.translation import ugettext as _
 
 from wiki.core.plugins import registry
@@ -11,6 +11,14 @@ from milestones import settings, models, views
 from milestones.markdown_extensions import MilestoneExtension
 
 
+def milestone_added_message(obj):
+    count = getattr(obj, 'range_count', 1)
+    if count > 1:
+        return (_(u"%(count)d milestones were added: %(title)s") %
+                {'count': count, 'title': truncate_title(obj.title)})
+    return _(u"A milestone was added: %s") % truncate_title(obj.title)
+
+
 class MilestonePlugin(BasePlugin):
     slug = settings.SLUG
     urlpatterns = {
@@ -18,6 +26,11 @@ class MilestonePlugin(BasePlugin):
             url(r'^$', views.MilestoneView.as_view(), name='milestone'),
             url(r'^edit/(?P<pk>\d+)/$', views.MilestoneEditView.as_view(),
                 name='milestone_edit'),
+            url(r'^occurrence/(?P<pk>\d+)/(?P<date>\d{4}-\d{2}-\d{2})/$',
+                views.MilestoneOccurrenceView.as_view(),
+                name='milestone_occurrence'),
+            url(r'^import/$', views.MilestoneImportView.as_view(),
+                name='milestone_import'),
         )
     }
     article_tab = (_(u'Milestones'), "icon-tasks")
@@ -39,9 +52,10 @@ class MilestonePlugin(BasePlugin):
     # is handled inside the notifications plugin.
     notifications = [
         {'model': models.Milestone,
-         'message': lambda obj: _(u"A milestone was added: %s") % truncate_title(obj.title),
+         'message': milestone_added_message,
          'key': ARTICLE_EDIT,
          'created': True,
+         'ignore': lambda obj: getattr(obj, 'skip_notification', False),
          'get_article': lambda obj: obj.article}
     ]
 